@@ -0,0 +1,513 @@
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QColor, QPainterPath, QMouseEvent
+from PyQt5.QtCore import Qt, QPointF, QRect, QEvent, QObject, QTimer, QEventLoop
+from paint import BrushSpec, BrushEngine, StrokeSession, TiledImage, History, Painter, DrawMode, ProjectFile, \
+    SaveWorker, Mirror, MirrorServer, MirrorViewer, LINE_TYPES, CAP_TYPES, JOIN_TYPES, STROKE_WORKER_BRUSH_SIZE
+from collections import deque
+import math
+import itertools
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# sizes of the sheets used by the scenarios
+CANVAS_SIZES = {"hd": (1920, 1080), "4k": (3840, 2160), "8k": (7680, 4320)}
+
+# names of the brush styles in the results
+LINE_NAMES = {Qt.SolidLine: "solid", Qt.DashLine: "dash", Qt.DotLine: "dot", Qt.DashDotLine: "dashdot",
+              Qt.DashDotDotLine: "dashdotdot"}
+CAP_NAMES = {Qt.FlatCap: "flat", Qt.SquareCap: "square", Qt.RoundCap: "round"}
+JOIN_NAMES = {Qt.MiterJoin: "miter", Qt.BevelJoin: "bevel", Qt.RoundJoin: "round"}
+
+# size of the widget in which the input is sent, and number of input events per display frame (1 kHz mouse, 60 Hz
+# display)
+WIDGET_SIZE = (1280, 720)
+FRAME_EVENTS = 16
+
+# brushes of the responsiveness scenario: a large dashed pen, and the largest dab brush with soft dabs
+RESPONSIVENESS_BRUSHES = {
+    "pen": BrushSpec(25, QColor(Qt.black).rgba(), Qt.DashLine, Qt.RoundCap, Qt.RoundJoin),
+    "dab": BrushSpec(200, QColor(Qt.black).rgba(), Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin, BrushEngine.DAB, 0.5, 0.5,
+                     0.1),
+}
+
+# side of the square selection dragged by the selection scenario, clipped to the sheet
+SELECTION_SIZE = 4000
+
+# latency increase in milliseconds always tolerated by the comparison with the baseline, below the timer noise
+LATENCY_SLACK = 0.5
+
+
+# function that builds a random stroke of a few segments around a random point of the sheet
+def random_path(rng, canvas, length=200):
+    point = QPointF(rng.uniform(0, canvas.width), rng.uniform(0, canvas.height))
+    path = QPainterPath(point)
+    for _ in range(rng.randint(2, 8)):
+        point += QPointF(rng.uniform(-length, length), rng.uniform(-length, length)) / 4
+        path.lineTo(point)
+    return path
+
+
+# function that draws strokes on an 8K sheet with the undo history enabled, and checks that the history stays
+# in its memory budget and that undo and redo cost time proportional to the stroke area
+def bench_history(strokes, budget):
+    rng = random.Random(0)
+    canvas = TiledImage(7680, 4320)
+    history = History(budget)
+
+    start = time.perf_counter()
+    peak = 0
+    for i in range(strokes):
+        brush = BrushSpec(rng.randint(1, 25), QColor(rng.randrange(2 ** 24)).rgba(), Qt.SolidLine, Qt.RoundCap,
+                          Qt.RoundJoin)
+        canvas.begin_change()
+        session = StrokeSession(canvas, brush)
+        session.draw_path(random_path(rng, canvas))
+        session.end()
+        history.push(canvas.end_change())
+        peak = max(peak, history.byte_size())
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    undone = 0
+    while history.undo(canvas) is not None and undone < 100:
+        undone += 1
+    for _ in range(undone):
+        history.redo(canvas)
+    undo_elapsed = time.perf_counter() - start
+
+    print("history: " + str(strokes) + " strokes in " + format(elapsed, ".2f") + " s, "
+          + format(strokes / elapsed, ".0f") + " strokes/s")
+    print("history: " + str(len(history.undo_stack)) + " changes kept, peak "
+          + format(peak / 2 ** 20, ".1f") + " MB for a budget of " + format(budget / 2 ** 20, ".1f") + " MB")
+    print("history: " + str(undone) + " undo + redo in " + format(undo_elapsed * 1000, ".1f") + " ms")
+    print(canvas.memory_report().replace("\n", ", "))
+    return peak <= budget
+
+
+# function that returns the brushes of a sweep: every size with the default style, then every combination of line,
+# cap and join type with the default size, or with every size when full is set
+def brush_sweep(sizes, full=False):
+    default = BrushSpec(6, QColor(0, 0, 0).rgba(), Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+    brushes = {}
+    for size in sizes:
+        brushes["size=" + str(size)] = default._replace(size=size)
+    for size, line_type, cap_type, join_type in itertools.product(sizes if full else [default.size], LINE_TYPES,
+                                                                  CAP_TYPES, JOIN_TYPES):
+        key = ("size=" + str(size) + "," if full else "") + "line=" + LINE_NAMES[line_type] + ",cap=" \
+            + CAP_NAMES[cap_type] + ",join=" + JOIN_NAMES[join_type]
+        brushes[key] = default._replace(size=size, line_type=line_type, cap_type=cap_type, join_type=join_type)
+    return brushes
+
+
+# function that parses a list of sizes such as "1-25" or "1,4,16"
+def parse_sizes(text):
+    sizes = []
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        sizes.extend(range(int(first), int(last or first) + 1))
+    return sizes
+
+
+# function that returns the statistics of the durations of a scenario, in events per second and in milliseconds
+def summarize(durations):
+    values = sorted(durations)
+    total = sum(values)
+    return {"events": len(values), "events_per_second": len(values) / total if total else 0.0,
+            "p50": values[len(values) // 2] * 1000, "p95": values[min(len(values) - 1, len(values) * 95 // 100)] * 1000,
+            "p99": values[min(len(values) - 1, len(values) * 99 // 100)] * 1000}
+
+
+# This class feeds scripted input into a Painter shown offscreen and measures the time spent on each event,
+# including the rasterization and the repaint done at the end of each display frame.
+class ScriptedInput:
+    def __init__(self, app):
+        self.app = app
+        self.painter = Painter()
+        self.painter.resize(*WIDGET_SIZE)
+        self.painter.show()
+        self.app.processEvents()
+        self.durations = []
+
+    # function that starts a scenario on a new blank sheet
+    def reset(self, width, height):
+        self.painter.set_canvas(TiledImage(width, height))
+        self.painter.resize(*WIDGET_SIZE)
+        self.app.processEvents()
+        self.painter.perf.enabled = True
+        self.restart()
+
+    # function that forgets the measures taken, before the timed part of a scenario
+    def restart(self):
+        self.painter.perf.reset()
+        self.durations = []
+
+    # function that runs an action as one input event, ending a display frame every FRAME_EVENTS events or after
+    # the action when frame is True
+    def run(self, action, frame=False):
+        start = time.perf_counter()
+        action()
+        if frame or (len(self.durations) + 1) % FRAME_EVENTS == 0:
+            self.painter.flush_stroke()
+            self.app.processEvents()
+        self.durations.append(time.perf_counter() - start)
+
+    # function that sends a mouse event to the painter
+    def mouse(self, event_type, point, button, buttons):
+        self.app.sendEvent(self.painter, QMouseEvent(event_type, point, button, buttons, Qt.NoModifier))
+
+    # function that drags the mouse along a random walk with the left button pressed
+    def drag(self, rng, events):
+        width, height = WIDGET_SIZE
+        point = QPointF(rng.uniform(0, width), rng.uniform(0, height))
+        self.run(lambda: self.mouse(QEvent.MouseButtonPress, point, Qt.LeftButton, Qt.LeftButton))
+        for _ in range(events):
+            point = QPointF(min(max(point.x() + rng.uniform(-8, 8), 0), width - 1),
+                            min(max(point.y() + rng.uniform(-8, 8), 0), height - 1))
+            self.run(lambda: self.mouse(QEvent.MouseMove, point, Qt.NoButton, Qt.LeftButton))
+        self.run(lambda: self.mouse(QEvent.MouseButtonRelease, point, Qt.LeftButton, Qt.NoButton))
+        self.app.processEvents()
+
+    # function that returns the statistics of the scenario, with the input to pixel latency measured by the painter
+    def result(self):
+        result = summarize(self.durations)
+        latency = self.painter.perf.metrics.get("latency")
+        if latency is not None:
+            result["input_to_pixel_p95"] = latency.percentile(95)
+        return result
+
+
+# This class records the delay between the time each mouse move posted to the painter is due and its delivery, the
+# events being delivered in the order they are posted.
+class DeliveryRecorder(QObject):
+    def __init__(self):
+        super().__init__()
+        self.due = deque()
+        self.delays = []
+
+    # event filter of the painter
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.MouseMove and self.due:
+            self.delays.append(time.perf_counter() - self.due.popleft())
+        return False
+
+
+# function that drags the brush of the painter with mouse moves posted at 1 kHz while the event loop runs, as a fast
+# mouse would, and returns the delays between the time each move is due and its delivery to the painter
+def post_drag(scripted, events):
+    painter = scripted.painter
+    painter.draw_mode = DrawMode.CURVE
+    recorder = DeliveryRecorder()
+    painter.installEventFilter(recorder)
+    rng = random.Random(0)
+    width, height = WIDGET_SIZE
+    point = QPointF(width / 2, height / 2)
+    scripted.mouse(QEvent.MouseButtonPress, point, Qt.LeftButton, Qt.LeftButton)
+
+    loop = QEventLoop()
+    timer = QTimer()
+    timer.setTimerType(Qt.PreciseTimer)
+    start = time.perf_counter()
+    posted = 0
+
+    # function that posts the moves due since the last tick
+    def post():
+        nonlocal point, posted
+        while posted < events and start + posted / 1000 <= time.perf_counter():
+            point = QPointF(min(max(point.x() + rng.uniform(-12, 12), 0), width - 1),
+                            min(max(point.y() + rng.uniform(-12, 12), 0), height - 1))
+            recorder.due.append(start + posted / 1000)
+            scripted.app.postEvent(painter, QMouseEvent(QEvent.MouseMove, point, Qt.NoButton, Qt.LeftButton,
+                                                        Qt.NoModifier))
+            posted += 1
+        if posted == events and not recorder.due:
+            loop.quit()
+
+    timer.timeout.connect(post)
+    timer.start(1)
+    loop.exec()
+    timer.stop()
+    scripted.mouse(QEvent.MouseButtonRelease, point, Qt.LeftButton, Qt.NoButton)
+    painter.removeEventFilter(recorder)
+    scripted.app.processEvents()
+    return recorder.delays
+
+
+# function that drags large brushes with mouse moves posted at 1 kHz, and measures the delay between the time each
+# move is due and its delivery to the painter. The strokes are rasterized in the GUI thread then in a worker thread.
+def bench_responsiveness(scripted, canvas_sizes, events):
+    results = {}
+    for canvas_name in canvas_sizes:
+        for (brush_name, brush), (name, worker_brush_size) in itertools.product(
+                RESPONSIVENESS_BRUSHES.items(), (("gui", math.inf), ("worker", STROKE_WORKER_BRUSH_SIZE))):
+            scripted.reset(*CANVAS_SIZES[canvas_name])
+            scripted.painter.worker_brush_size = worker_brush_size
+            scripted.painter.brush = brush
+            delays = post_drag(scripted, events)
+            results["responsiveness/" + brush_name + "/" + name + "/" + canvas_name] = summarize(delays)
+    return results
+
+
+# function that processes the events until a condition is true, returns False after a timeout in seconds
+def wait_until(app, condition, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        app.processEvents(QEventLoop.AllEvents, 10)
+    return True
+
+
+# function that mirrors the strokes of large brushes, dragged with mouse moves posted at 1 kHz, to a viewer in the same
+# process over the loopback interface. It measures the bytes sent per second of drawing, and the delay from the
+# reception of each input by the painter to its display by the viewer.
+def bench_mirror(scripted, canvas_sizes, events):
+    results = {}
+    for canvas_name in canvas_sizes:
+        for brush_name, brush in RESPONSIVENESS_BRUSHES.items():
+            scripted.reset(*CANVAS_SIZES[canvas_name])
+            painter = scripted.painter
+            painter.brush = brush
+            server = MirrorServer("127.0.0.1:0")
+            server.start()
+            server.ready.wait()
+            painter.mirror = Mirror(painter, server)
+            viewer = MirrorViewer(Painter(), server.address())
+            viewer.painter.perf.enabled = True
+            viewer.start()
+            joined = wait_until(scripted.app, lambda: viewer.client.bytes_received > 0 and viewer.painter.canvas.width
+                                == painter.canvas.width)
+            snapshot_bytes = server.bytes_sent
+            viewer.painter.perf.reset()
+
+            start = time.perf_counter()
+            post_drag(scripted, events)
+            elapsed = time.perf_counter() - start
+            painter.mirror.flush()
+            done = wait_until(scripted.app, lambda: viewer.client.bytes_received == server.bytes_sent
+                              and viewer.session is None)
+            viewer.stop()
+            painter.mirror.close()
+            painter.mirror = None
+            if not joined or not done:
+                print("mirror/" + brush_name + "/" + canvas_name + ": the viewer did not receive the stroke")
+                continue
+            latencies = [value / 1000 for _, value in viewer.painter.perf.metric("mirror latency").samples]
+            result = summarize(latencies)
+            result["bytes_per_second"] = (server.bytes_sent - snapshot_bytes) / elapsed
+            results["mirror/" + brush_name + "/" + canvas_name] = result
+    return results
+
+
+# function that drags a large selection of a sheet covered by strokes, its pixels float over the sheet while dragged,
+# then measures the time taken to anchor them on the sheet
+def bench_select(scripted, canvas_sizes, events):
+    results = {}
+    for canvas_name in canvas_sizes:
+        scripted.reset(*CANVAS_SIZES[canvas_name])
+        painter = scripted.painter
+        painter.draw_mode = DrawMode.CURVE
+        scripted.drag(random.Random(0), 200)
+        painter.draw_mode = DrawMode.SELECT
+        painter.select(QRect(0, 0, SELECTION_SIZE, SELECTION_SIZE))
+        scripted.restart()
+        rng = random.Random(0)
+        point = painter.view.map(QPointF(painter.selection.rect.center()))
+        scripted.run(lambda: scripted.mouse(QEvent.MouseButtonPress, point, Qt.LeftButton, Qt.LeftButton))
+        for _ in range(events):
+            point = point + QPointF(rng.uniform(-8, 8), rng.uniform(-8, 8))
+            scripted.run(lambda: scripted.mouse(QEvent.MouseMove, point, Qt.NoButton, Qt.LeftButton))
+        scripted.run(lambda: scripted.mouse(QEvent.MouseButtonRelease, point, Qt.LeftButton, Qt.NoButton), True)
+        results["select/drag/" + canvas_name] = scripted.result()
+        scripted.restart()
+        scripted.run(painter.anchor_selection, True)
+        results["select/anchor/" + canvas_name] = scripted.result()
+    return results
+
+
+# function that draws long strokes in curve mode and drags lines in line mode for every brush of the sweep
+def bench_strokes(scripted, modes, brushes, canvas_sizes, events):
+    results = {}
+    for canvas_name in canvas_sizes:
+        for mode in modes:
+            for brush_name, brush in brushes.items():
+                scripted.reset(*CANVAS_SIZES[canvas_name])
+                scripted.painter.draw_mode = mode
+                scripted.painter.brush = brush
+                scripted.drag(random.Random(0), events)
+                key = mode.name.lower() + "/" + canvas_name + "/" + brush_name
+                results[key] = scripted.result()
+    return results
+
+
+# function that resizes the window in a storm of resize events
+def bench_resize(scripted, canvas_sizes, events):
+    results = {}
+    rng = random.Random(0)
+    for canvas_name in canvas_sizes:
+        scripted.reset(*CANVAS_SIZES[canvas_name])
+        for _ in range(events):
+            size = (rng.randint(400, WIDGET_SIZE[0]), rng.randint(300, WIDGET_SIZE[1]))
+            scripted.run(lambda: scripted.painter.resize(*size))
+        results["resize/" + canvas_name] = scripted.result()
+    return results
+
+
+# function that clears a sheet covered by strokes
+def bench_clear(scripted, canvas_sizes, events):
+    results = {}
+    for canvas_name in canvas_sizes:
+        scripted.reset(*CANVAS_SIZES[canvas_name])
+        scripted.painter.draw_mode = DrawMode.CURVE
+        clears = []
+        for _ in range(events):
+            scripted.drag(random.Random(0), 50)
+            scripted.restart()
+            scripted.run(scripted.painter.clear, True)
+            clears.extend(scripted.durations)
+        scripted.durations = clears
+        results["clear/" + canvas_name] = scripted.result()
+    return results
+
+
+# function that saves and opens a sheet covered by strokes, as an image and as a project file
+def bench_io(scripted, canvas_sizes, events):
+    results = {}
+    directory = tempfile.mkdtemp(prefix="paint-bench-")
+    for canvas_name in canvas_sizes:
+        scripted.reset(*CANVAS_SIZES[canvas_name])
+        rng = random.Random(0)
+        for _ in range(20):
+            scripted.drag(rng, 50)
+        canvas = scripted.painter.canvas
+        image_path = os.path.join(directory, canvas_name + ".png")
+        project_path = os.path.join(directory, canvas_name + ".paint")
+        operations = {
+            "save-png": lambda: SaveWorker(canvas.snapshot(), image_path).run(),
+            "open-png": lambda: TiledImage.open(image_path, scripted.painter.size()).finish_loading(),
+            "save-project": lambda: ProjectFile.save(canvas, project_path),
+            "open-project": lambda: ProjectFile.load(project_path),
+        }
+        for name, operation in operations.items():
+            scripted.restart()
+            for _ in range(events):
+                scripted.run(operation, True)
+            results[name + "/" + canvas_name] = scripted.result()
+        for path in (image_path, project_path):
+            os.remove(path)
+    os.rmdir(directory)
+    return results
+
+
+# function that starts the program in new processes and measures the time until the first frame is painted, from
+# the start of the interpreter
+def bench_startup(runs):
+    durations = []
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "paint.py"), "--startup-time"]
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        for line in process.stdout:
+            if line.startswith("startup:"):
+                durations.append(time.perf_counter() - start)
+                break
+        process.wait()
+    return {"startup": summarize(durations)} if durations else {}
+
+
+# function that compares results with a baseline and returns the descriptions of the regressions: a throughput
+# lower or a 95th percentile latency higher than the baseline by more than the threshold
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, result in sorted(results.items()):
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        if result["events_per_second"] < reference["events_per_second"] * (1 - threshold):
+            regressions.append(key + ": " + format(result["events_per_second"], ".0f") + " events/s instead of "
+                               + format(reference["events_per_second"], ".0f"))
+        if result["p95"] > reference["p95"] * (1 + threshold) + LATENCY_SLACK:
+            regressions.append(key + ": p95 " + format(result["p95"], ".2f") + " ms instead of "
+                               + format(reference["p95"], ".2f") + " ms")
+    return regressions
+
+
+# function that prints the results of the scenarios, one line per scenario
+def print_results(results):
+    for key, result in sorted(results.items()):
+        line = (key.ljust(56) + format(result["events_per_second"], "10.0f") + " events/s  p50 "
+                + format(result["p50"], "7.2f") + " ms  p95 " + format(result["p95"], "7.2f") + " ms  p99 "
+                + format(result["p99"], "7.2f") + " ms")
+        if "input_to_pixel_p95" in result:
+            line += "  input to pixel p95 " + format(result["input_to_pixel_p95"], ".2f") + " ms"
+        if "bytes_per_second" in result:
+            line += "  " + format(result["bytes_per_second"] / 1000, ".1f") + " kB/s"
+        print(line)
+
+
+# This is the entry point of the benchmarks.
+if __name__ == "__main__":
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    parser = argparse.ArgumentParser(description="Benchmarks of the paint program.")
+    parser.add_argument("--scenarios",
+                        default="curve,line,resize,clear,io,select,responsiveness,mirror,startup,history",
+                        help="comma separated scenarios among curve, line, resize, clear, io, select, responsiveness, "
+                             "mirror, startup and history")
+    parser.add_argument("--sizes", default="1-25", help="brush sizes of the stroke scenarios, such as 1-25 or 1,8")
+    parser.add_argument("--full-sweep", action="store_true",
+                        help="sweep every combination of line, cap and join type at every brush size")
+    parser.add_argument("--canvas", default="hd,4k,8k", help="comma separated sheet sizes among hd, 4k and 8k")
+    parser.add_argument("--events", type=int, default=300, help="number of input events of the stroke scenarios")
+    parser.add_argument("--baseline", help="JSON file of results to compare with")
+    parser.add_argument("--save-baseline", help="JSON file in which the results are saved as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="tolerated regression, 0.25 for 25%%")
+    parser.add_argument("--strokes", type=int, default=10000, help="number of strokes of the history benchmark")
+    parser.add_argument("--budget", type=int, default=64, help="memory budget of the history in MB")
+    args = parser.parse_args()
+    scenarios = args.scenarios.split(",")
+    canvas_sizes = args.canvas.split(",")
+    for name in canvas_sizes:
+        if name not in CANVAS_SIZES:
+            parser.error("unknown sheet size: " + name)
+
+    app = QApplication(sys.argv)
+    ok = True
+    results = {}
+    if "curve" in scenarios or "line" in scenarios:
+        modes = [mode for mode in (DrawMode.CURVE, DrawMode.LINE) if mode.name.lower() in scenarios]
+        scripted = ScriptedInput(app)
+        brushes = brush_sweep(parse_sizes(args.sizes), args.full_sweep)
+        results.update(bench_strokes(scripted, modes, brushes, canvas_sizes, args.events))
+    if "resize" in scenarios:
+        results.update(bench_resize(ScriptedInput(app), canvas_sizes, args.events))
+    if "clear" in scenarios:
+        results.update(bench_clear(ScriptedInput(app), canvas_sizes, 20))
+    if "io" in scenarios:
+        results.update(bench_io(ScriptedInput(app), canvas_sizes, 3))
+    if "select" in scenarios:
+        results.update(bench_select(ScriptedInput(app), canvas_sizes, args.events))
+    if "responsiveness" in scenarios:
+        results.update(bench_responsiveness(ScriptedInput(app), canvas_sizes, 2000))
+    if "mirror" in scenarios:
+        results.update(bench_mirror(ScriptedInput(app), canvas_sizes, 2000))
+    if "startup" in scenarios:
+        results.update(bench_startup(10))
+    print_results(results)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print("regression: " + regression)
+        ok = not regressions
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=1, sort_keys=True)
+    if "history" in scenarios:
+        ok = bench_history(args.strokes, args.budget * 2 ** 20) and ok
+    sys.exit(0 if ok else 1)
@@ -1,128 +1,3989 @@
 from PyQt5.QtWidgets import QApplication, QMainWindow, QDockWidget, QAction, QFileDialog, QWidget, QLabel, \
-    QPushButton, QColorDialog, QVBoxLayout, QGridLayout, QRadioButton, QButtonGroup, QSlider, QMessageBox
-from PyQt5.QtGui import QIcon, QImage, QPainter, QPen, QColor
+    QPushButton, QColorDialog, QVBoxLayout, QGridLayout, QRadioButton, QButtonGroup, QSlider, QMessageBox, \
+    QInputDialog, QProgressBar, QDialog, QDialogButtonBox, QProgressDialog, QListWidget, QCheckBox, QComboBox
+from PyQt5.QtGui import QGuiApplication, QIcon, QImage, QImageReader, QImageWriter, QImageIOHandler, QPainter, \
+    QPainterPath, QPen, QPixmap, QColor, QRegion, QTransform, QRadialGradient
+from PyQt5 import sip
 import sys
 import os
-from PyQt5.QtCore import Qt, QPoint
+import math
+import zlib
+import struct
+import time
+import argparse
+import mmap
+import ctypes
+import concurrent.futures
+import importlib
+import threading
+import queue
+import re
+import weakref
+import json
+import csv
+from array import array
+from collections import namedtuple, deque
+from functools import lru_cache, partial
+from PyQt5.QtCore import Qt, QPoint, QPointF, QLineF, QRect, QRectF, QSizeF, QElapsedTimer, QTimer, QObject, QThread, \
+    QFileInfo, QStandardPaths, pyqtSignal
 from enum import Enum
 
 
-# This class is an enum that represents the current draw mode: curve or line.
+# This class stands for a module imported the first time one of its attributes is used, so that the modules needed
+# only by some actions do not slow down the startup. Once imported, the module replaces it in the globals.
+class LazyModule:
+    def __init__(self, name):
+        self.name = name
+
+    # function that imports the module and returns it
+    def load(self):
+        module = importlib.import_module(self.name)
+        globals()[self.name] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+
+# numpy is used by the fill, the filters and the downscaled tiles, multiprocessing by the batch renderer, asyncio by
+# the mirror
+numpy = LazyModule("numpy")
+multiprocessing = LazyModule("multiprocessing")
+asyncio = LazyModule("asyncio")
+
+# directory of the icons, next to the program whatever the current directory
+ICON_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icons")
+
+
+# function that returns an icon of the icon directory by name, each icon is loaded once
+@lru_cache(maxsize=None)
+def icon(name):
+    return QIcon(os.path.join(ICON_DIRECTORY, name + ".png"))
+
+
+# This class is an enum that represents the current draw mode: curve, line, fill or rectangle selection.
 class DrawMode(Enum):
     CURVE = 0
     LINE = 1
+    FILL = 2
+    SELECT = 3
+
+
+# This class is an enum that represents the engine drawing the strokes: a pen stroking the path, or dabs stamped
+# along it.
+class BrushEngine(Enum):
+    PEN = 0
+    DAB = 1
+
+
+# This class is an immutable description of the brush, the widgets replace it as a whole when an option changes.
+# The line, cap and join types are used by the pen, the hardness, opacity and spacing by the dabs.
+class BrushSpec(namedtuple("BrushSpec", ["size", "color", "line_type", "cap_type", "join_type", "engine", "hardness",
+                                         "opacity", "spacing"], defaults=(BrushEngine.PEN, 0.5, 1.0, 0.1))):
+    __slots__ = ()
+
+    # function that returns the pen drawing with this brush, the pen is shared and must not be modified
+    @lru_cache(maxsize=64)
+    def pen(self):
+        return QPen(QColor.fromRgba(self.color), self.size, self.line_type, self.cap_type, self.join_type)
+
+    # function that returns the distance a stroke can paint beyond its path
+    @lru_cache(maxsize=64)
+    def margin(self):
+        if self.engine == BrushEngine.DAB:
+            # the dab images have a transparent border of one pixel, plus one pixel for their rounded position
+            return math.ceil(self.size / 2) + 2
+        margin = self.size / 2
+        if self.cap_type == Qt.SquareCap:
+            margin *= math.sqrt(2)
+        if self.join_type == Qt.MiterJoin:
+            # the miter limit is in units of the pen width, a miter tip reaches that many widths from the join
+            margin = max(margin, self.pen().miterLimit() * self.size)
+        # one extra pixel for the rounding of the pen to the pixel grid
+        return math.ceil(margin) + 1
+
+
+# size in pixels of the side of the tiles composing the sheet
+TILE_SIZE = 256
+
+
+# This class stores the sheet as a grid of tiles. The tiles that have never been drawn on all share the same
+# immutable blank tile, a tile gets its own image the first time something is drawn on it.
+class TiledImage:
+    def __init__(self, width, height, color=Qt.white):
+        self.width = width
+        self.height = height
+        self.blank = QImage()
+        self.tiles = {}
+
+        # change recording the tiles modified by the current action, None when no action is recorded
+        self.change = None
+
+        # image or file mapping sharing its memory with the tiles of an opened sheet
+        self.source = None
+
+        # project file the sheet has been saved to or opened from, None if there is none
+        self.project = None
+
+        # loader decoding the tiles in the background and its preview, None once the tiles are loaded
+        self.loader = None
+        self.preview = None
+
+        # function called once the tiles are loaded
+        self.on_loaded = None
+
+        # pyramid of downscaled tiles by (level, column, row), a tile of level n covers 2^n x 2^n tiles of the sheet.
+        # They are computed when the sheet is drawn zoomed out and removed when the tiles they cover are modified.
+        self.mipmaps = {}
+
+        # function called with the modified rectangle of the sheet when tiles are modified, None for the whole sheet
+        self.on_invalidate = None
+
+        self.fill(color)
+
+    # function that builds a sheet whose tiles are decoded from an image file in the background. Until the tiles are
+    # loaded the sheet displays a downscaled preview, writing on the sheet waits for the tiles.
+    @staticmethod
+    def open(file_path, preview_size):
+        reader = QImageReader(file_path)
+        size = reader.size()
+        if not reader.canRead() or size.isEmpty():
+            raise ValueError(reader.errorString())
+        canvas = TiledImage(size.width(), size.height())
+        canvas.loader = ImageLoader(file_path, size.scaled(preview_size, Qt.KeepAspectRatio).boundedTo(size))
+        canvas.loader.start()
+        return canvas
+
+    # function that waits for the tiles decoded in the background and installs them
+    def finish_loading(self):
+        loader = self.loader
+        if loader is None:
+            return
+        loader.wait()
+        self.loader = None
+        self.preview = None
+        if loader.image is not None:
+            self.wrap_image(loader.image)
+        else:
+            print("Cannot load image: " + loader.error)
+        if self.on_loaded is not None:
+            self.on_loaded()
+
+    # function that makes the tiles views of an image in Format_RGB32, without copying its pixels. The tiles
+    # crossing the border of the image are copied.
+    def wrap_image(self, image):
+        self.source = image
+        self.invalidate()
+        bits = int(sip.voidptr(image.bits()))
+        stride = image.bytesPerLine()
+        for key in self.keys_in(self.rect()):
+            rect = self.tile_rect(key)
+            if image.rect().contains(rect):
+                self.tiles[key] = QImage(sip.voidptr(bits + rect.y() * stride + rect.x() * 4), TILE_SIZE, TILE_SIZE,
+                                         stride, QImage.Format_RGB32)
+            else:
+                tile = self.blank.copy()
+                painter = QPainter(tile)
+                painter.drawImage(0, 0, image, rect.x(), rect.y(), TILE_SIZE, TILE_SIZE)
+                painter.end()
+                self.tiles[key] = tile
+
+    # function that builds a sheet from an image, the tiles identical to the blank tile are shared
+    @staticmethod
+    def from_image(image, color=Qt.white):
+        canvas = TiledImage(image.width(), image.height(), color)
+        image = image.convertToFormat(canvas.blank.format())
+        for key in canvas.keys_in(canvas.rect()):
+            tile = QImage(canvas.blank)
+            painter = QPainter(tile)
+            painter.drawImage(0, 0, image, key[0] * TILE_SIZE, key[1] * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+            painter.end()
+            if tile != canvas.blank:
+                canvas.tiles[key] = tile
+        return canvas
+
+    # function that returns the rectangle of the whole sheet
+    def rect(self):
+        return QRect(0, 0, self.width, self.height)
+
+    # function that returns the rectangle of the sheet covered by a tile
+    @staticmethod
+    def tile_rect(key):
+        return QRect(key[0] * TILE_SIZE, key[1] * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+
+    # function that returns the keys (column, row) of the tiles intersecting a rectangle of the sheet
+    def keys_in(self, rect):
+        rect = rect & self.rect()
+        if rect.isEmpty():
+            return []
+        return [(column, row)
+                for row in range(rect.top() // TILE_SIZE, rect.bottom() // TILE_SIZE + 1)
+                for column in range(rect.left() // TILE_SIZE, rect.right() // TILE_SIZE + 1)]
+
+    # function that returns a tile for reading, the shared blank tile if the tile has never been drawn on
+    def tile(self, key):
+        if self.loader is not None:
+            self.finish_loading()
+        return self.tiles.get(key, self.blank)
+
+    # function that returns a tile for writing, allocating it on first write
+    def writable_tile(self, key):
+        if self.loader is not None:
+            self.finish_loading()
+        tile = self.tiles.get(key)
+        if self.change is not None:
+            self.change.record(key, tile)
+        self.invalidate(self.tile_rect(key))
+        if tile is None:
+            tile = self.blank.copy()
+            self.tiles[key] = tile
+        return tile
+
+    # function that returns a copy of the sheet sharing the tile images, a tile is copied only when one side writes.
+    # The tiles with an open painter are copied right away since a painter does not detach its image.
+    def snapshot(self, painted=()):
+        self.finish_loading()
+        canvas = TiledImage(self.width, self.height)
+        canvas.blank = self.blank
+        canvas.source = self.source
+        canvas.tiles = {key: tile.copy() if key in painted else QImage(tile) for key, tile in self.tiles.items()}
+        return canvas
+
+    # function that returns a copy of the sheet sharing only the tiles under a rectangle, the other tiles are blank.
+    # The pyramid tiles crossing the rectangle are shared too, they are right inside it. Like a snapshot, the view
+    # keeps the image or the file mapping the tiles may point into.
+    def view(self, rect):
+        self.finish_loading()
+        canvas = TiledImage(self.width, self.height)
+        canvas.blank = self.blank
+        canvas.source = self.source
+        canvas.tiles = {key: QImage(self.tiles[key]) for key in self.keys_in(rect) if key in self.tiles}
+        canvas.mipmaps = {(level, column, row): tile for (level, column, row), tile in self.mipmaps.items()
+                          if rect.intersects(QRect(column * TILE_SIZE << level, row * TILE_SIZE << level,
+                                                   TILE_SIZE << level, TILE_SIZE << level))}
+        return canvas
+
+    # function that fills the whole sheet with a color, all the tiles become shared again. A transparent color gives
+    # the tiles an alpha channel.
+    def fill(self, color):
+        self.finish_loading()
+        if self.change is not None:
+            self.change.record_blank(self.blank)
+            for key, tile in self.tiles.items():
+                self.change.record(key, tile)
+        opaque = QColor(color).alpha() == 255
+        self.blank = QImage(TILE_SIZE, TILE_SIZE, QImage.Format_RGB32 if opaque else QImage.Format_ARGB32_Premultiplied)
+        self.blank.fill(color)
+        self.tiles = {}
+        self.invalidate()
+
+    # function that replaces the blank tile and some tiles of the sheet
+    def replace(self, blank, tiles):
+        self.finish_loading()
+        if self.change is not None:
+            self.change.record_blank(self.blank)
+            for key in tiles:
+                self.change.record(key, self.tiles.get(key))
+        self.blank = blank
+        self.tiles.update(tiles)
+        self.invalidate()
+
+    # function that replaces tiles of the sheet by tiles drawn elsewhere, such as a stroke rasterized in a worker
+    # thread
+    def put_tiles(self, tiles):
+        for key, tile in tiles.items():
+            if self.change is not None:
+                self.change.record(key, self.tiles.get(key))
+            self.tiles[key] = tile
+            self.invalidate(self.tile_rect(key))
+
+    # function that fills a rectangle of the sheet with the blank tile, the tiles it covers entirely become shared again
+    def erase(self, rect):
+        self.finish_loading()
+        for key in self.keys_in(rect):
+            tile_rect = self.tile_rect(key)
+            if key not in self.tiles:
+                continue
+            if rect.contains(tile_rect):
+                if self.change is not None:
+                    self.change.record(key, self.tiles[key])
+                del self.tiles[key]
+                self.invalidate(tile_rect)
+                continue
+            part = (rect & tile_rect).translated(-tile_rect.topLeft())
+            painter = QPainter(self.writable_tile(key))
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(part.topLeft(), self.blank, part)
+            painter.end()
+
+    # function that draws a rectangle of another sheet at a position of the sheet, scaled by a factor. The pixels
+    # replace the pixels of a sheet with transparency, and are blended over the pixels of an opaque sheet.
+    def paste(self, source, rect, position, scale=1.0):
+        target = QRectF(QPointF(position), QSizeF(rect.size()) * scale).toAlignedRect()
+        for key in self.keys_in(target):
+            part = (target & self.tile_rect(key)).translated(-key[0] * TILE_SIZE, -key[1] * TILE_SIZE)
+            painter = QPainter(self.writable_tile(key))
+            if self.blank.hasAlphaChannel():
+                painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, scale != 1.0)
+            painter.translate(position.x() - key[0] * TILE_SIZE, position.y() - key[1] * TILE_SIZE)
+            painter.scale(scale, scale)
+            painter.translate(-rect.x(), -rect.y())
+            painter.setClipRect(rect)
+            to_source, _ = painter.transform().inverted()
+            source.draw(painter, to_source.mapRect(QRectF(part)).toAlignedRect() & rect)
+            painter.end()
+
+    # function that returns the number of levels of the pyramid above the tiles, the top level covers the sheet
+    # with one tile
+    def levels(self):
+        return max(0, math.ceil(math.log2(max(self.width, self.height) / TILE_SIZE)))
+
+    # function that returns a tile of a level of the pyramid, averaging the four tiles of the level below. The blank
+    # tile stands for the tiles covering only blank tiles.
+    def mipmap(self, level, column, row):
+        if level == 0:
+            return self.tile((column, row))
+        tile = self.mipmaps.get((level, column, row))
+        if tile is None:
+            children = [self.mipmap(level - 1, column * 2 + dx, row * 2 + dy) for dy in (0, 1) for dx in (0, 1)]
+            if all(child is self.blank for child in children):
+                tile = self.blank
+            else:
+                tile = QImage(TILE_SIZE, TILE_SIZE, self.blank.format())
+                pixels = tile_array(tile, True).view(numpy.uint8).reshape(TILE_SIZE, TILE_SIZE, 4)
+                half = TILE_SIZE // 2
+                for i, child in enumerate(children):
+                    # adding strided slices is an order of magnitude faster than summing over strided axes
+                    channels = tile_array(child).view(numpy.uint8).reshape(TILE_SIZE, TILE_SIZE, 4)
+                    rows = channels[0::2].astype(numpy.uint16) + channels[1::2]
+                    pixels[i // 2 * half:(i // 2 + 1) * half, i % 2 * half:(i % 2 + 1) * half] = \
+                        (rows[:, 0::2] + rows[:, 1::2] + 2) >> 2
+            self.mipmaps[(level, column, row)] = tile
+        return tile
+
+    # function that removes the tiles of the pyramid covering a rectangle of the sheet, the whole pyramid when the
+    # rectangle is None
+    def invalidate(self, rect=None):
+        if self.on_invalidate is not None:
+            self.on_invalidate(rect)
+        if rect is None:
+            self.mipmaps = {}
+            return
+        if not self.mipmaps:
+            return
+        rect = rect & self.rect()
+        if rect.isEmpty():
+            return
+        for level in range(1, self.levels() + 1):
+            size = TILE_SIZE << level
+            for row in range(rect.top() // size, rect.bottom() // size + 1):
+                for column in range(rect.left() // size, rect.right() // size + 1):
+                    self.mipmaps.pop((level, column, row), None)
+
+    # function that starts recording the tiles modified by an action
+    def begin_change(self):
+        self.change = TileChange()
+
+    # function that stops recording and returns the change, None if nothing has been modified
+    def end_change(self):
+        change = self.change
+        self.change = None
+        if change is None or change.is_empty():
+            return None
+        return change
+
+    # function that draws a rectangle of the sheet with a painter using sheet coordinates
+    def draw(self, painter, rect):
+        if self.loader is not None:
+            if self.preview is None and self.loader.isFinished():
+                self.finish_loading()
+            elif self.preview is not None:
+                scale = self.preview.width() / self.width
+                painter.drawImage(QRectF(rect), self.preview, QRectF(rect.x() * scale, rect.y() * scale,
+                                                                     rect.width() * scale, rect.height() * scale))
+                return
+            else:
+                painter.fillRect(rect, self.blank.pixelColor(0, 0))
+                return
+        scale = painter.transform().m11()
+        level = 0 if scale >= 1 else min(int(math.log2(1 / scale)), self.levels())
+        if level > 0:
+            self.draw_level(painter, rect, level)
+            return
+        for key in self.keys_in(rect):
+            tile_rect = self.tile_rect(key)
+            part = tile_rect & rect
+            painter.drawImage(part.topLeft(), self.tile(key), part.translated(-tile_rect.topLeft()))
+
+    # function that draws a rectangle of the sheet with the tiles of a level of the pyramid
+    def draw_level(self, painter, rect, level):
+        rect = rect & self.rect()
+        if rect.isEmpty():
+            return
+        size = TILE_SIZE << level
+        factor = 1 / (1 << level)
+        for row in range(rect.top() // size, rect.bottom() // size + 1):
+            for column in range(rect.left() // size, rect.right() // size + 1):
+                part = QRect(column * size, row * size, size, size) & rect
+                source = QRectF((part.x() - column * size) * factor, (part.y() - row * size) * factor,
+                                part.width() * factor, part.height() * factor)
+                painter.drawImage(QRectF(part), self.mipmap(level, column, row), source)
+
+    # function that assembles the tiles into a single image, used to save the sheet
+    def to_image(self):
+        image = QImage(self.width, self.height, QImage.Format_RGB32)
+        painter = QPainter(image)
+        self.draw(painter, self.rect())
+        painter.end()
+        return image
+
+    # function that returns a report on the memory used by the tiles
+    def memory_report(self):
+        tile_bytes = self.blank.sizeInBytes()
+        total = len(self.keys_in(self.rect()))
+        allocated = len(self.tiles)
+        mipmaps = sum(tile is not self.blank for tile in self.mipmaps.values())
+        return ("sheet: " + str(self.width) + "x" + str(self.height) + " px, " + str(total) + " tiles\n"
+                "allocated tiles: " + str(allocated) + " (" + str(allocated * tile_bytes // 2 ** 20) + " MB)\n"
+                "shared blank tiles: " + str(total - allocated) + "\n"
+                "downscaled tiles: " + str(mipmaps) + " (" + str(mipmaps * tile_bytes // 2 ** 20) + " MB)\n"
+                "full image would use: " + str(self.width * self.height * 4 // 2 ** 20) + " MB")
+
+
+# This class decodes an image file in a worker thread. A downscaled preview is decoded first when the format
+# supports scaled decoding natively (jpeg decodes at 1/2, 1/4 or 1/8 of the size much faster), then the full image is
+# decoded once and converted in place to Format_RGB32, so that the peak memory stays close to the size of the sheet.
+class ImageLoader(QThread):
+    # signal emitted when the preview is available
+    preview_ready = pyqtSignal(QImage)
+
+    def __init__(self, file_path, preview_size):
+        super().__init__()
+        self.file_path = file_path
+        self.preview_size = preview_size
+
+        # decoded image, None until decoded or if the decoding failed
+        self.image = None
+        self.error = ""
+
+    # function run by the worker thread
+    def run(self):
+        reader = QImageReader(self.file_path)
+        if reader.format() == b"jpeg" and reader.supportsOption(QImageIOHandler.ScaledSize):
+            reader.setScaledSize(self.preview_size)
+            preview = reader.read()
+            if not preview.isNull():
+                self.preview_ready.emit(preview.convertToFormat(QImage.Format_RGB32))
+            reader = QImageReader(self.file_path)
+        image = reader.read()
+        if image.isNull():
+            self.error = reader.errorString()
+            return
+        image.convertTo(QImage.Format_RGB32)
+        self.image = image
+
+
+# function that returns the pixels of a tile as bytes, without the padding of the tiles that are views of an image
+def tile_bytes(tile):
+    if tile.bytesPerLine() != TILE_SIZE * 4:
+        tile = tile.copy()
+    return tile.constBits().asstring(tile.sizeInBytes())
+
+
+# header of the project files: magic, version, tile size, width and height of the sheet, color of the blank tile,
+# offset and number of entries of the tile index
+PROJECT_MAGIC = b"PNTP"
+PROJECT_HEADER = struct.Struct("<4sHHIIIQI")
+# entry of the tile index: column, row and offset of the raw pixels of the tile in the file
+PROJECT_INDEX_ENTRY = struct.Struct("<IIQ")
+# alignment of the tile payloads, the first one starts after the page holding the header
+PROJECT_ALIGNMENT = 4096
+
+
+# This class is the native project format. A project file holds a header, the raw pixels of the tiles that are not
+# blank and an index of the tiles. Opening a project maps the file in memory and wraps its tiles without copying
+# them. Saving to the file the sheet comes from appends only the tiles modified since the last save followed by a
+# new index, then points the header to it; the file is rewritten when most of it is made of outdated tiles.
+class ProjectFile:
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+        # saved tiles: key -> (cache key of the tile image when saved, offset of the tile in the file)
+        self.entries = {}
+        self.file_size = 0
+
+    # function that opens a project file, raises ValueError if the file is not a valid project
+    @staticmethod
+    def load(file_path):
+        with open(file_path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < PROJECT_HEADER.size:
+                raise ValueError("not a project file")
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, version, tile_size, width, height, color, index_offset, count = PROJECT_HEADER.unpack_from(mapping)
+        if magic != PROJECT_MAGIC or version != 1 or tile_size != TILE_SIZE:
+            raise ValueError("not a project file")
+        if width <= 0 or height <= 0:
+            raise ValueError("invalid sheet size in project file")
+        if index_offset + count * PROJECT_INDEX_ENTRY.size > size:
+            raise ValueError("truncated project file")
+        canvas = TiledImage(width, height, QColor.fromRgba(color))
+        canvas.source = mapping
+        project = ProjectFile(file_path)
+        project.file_size = size
+        base = ctypes.addressof(ctypes.c_char.from_buffer(mapping))
+        tile_bytes_count = TILE_SIZE * TILE_SIZE * 4
+        for i in range(count):
+            column, row, offset = PROJECT_INDEX_ENTRY.unpack_from(mapping, index_offset + i * PROJECT_INDEX_ENTRY.size)
+            if offset + tile_bytes_count > size or column * TILE_SIZE >= width or row * TILE_SIZE >= height:
+                raise ValueError("invalid tile in project file")
+            tile = QImage(sip.voidptr(base + offset), TILE_SIZE, TILE_SIZE, TILE_SIZE * 4, QImage.Format_RGB32)
+            canvas.tiles[(column, row)] = tile
+            project.entries[(column, row)] = (tile.cacheKey(), offset)
+        canvas.project = project
+        return canvas
+
+    # function that saves a sheet to a project file. The tiles with an open painter are always written again at the
+    # next save, since the painter modifies them without changing their cache key.
+    @staticmethod
+    def save(canvas, file_path, painted=()):
+        canvas.finish_loading()
+        project = canvas.project
+        if project is not None and project.file_path == file_path and os.path.exists(file_path):
+            live = len(canvas.tiles) * TILE_SIZE * TILE_SIZE * 4
+            if project.file_size <= 2 * live + 2 * PROJECT_ALIGNMENT:
+                project.append(canvas, painted)
+                return
+        project = ProjectFile(file_path)
+        project.rewrite(canvas, painted)
+        canvas.project = project
+
+    # function that writes all the tiles to a new file which then replaces the project file
+    def rewrite(self, canvas, painted):
+        temporary_path = self.file_path + ".part"
+        with open(temporary_path, "wb") as file:
+            file.write(bytes(PROJECT_ALIGNMENT))
+            self.entries = {}
+            self.write_tiles(file, canvas, painted)
+        os.replace(temporary_path, self.file_path)
+
+    # function that appends the tiles modified since the last save to the project file
+    def append(self, canvas, painted):
+        with open(self.file_path, "r+b") as file:
+            file.seek(self.file_size)
+            self.write_tiles(file, canvas, painted)
+
+    # function that writes the modified tiles and the index at the current position of the file, then the header
+    def write_tiles(self, file, canvas, painted):
+        entries = {}
+        for key, tile in canvas.tiles.items():
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != tile.cacheKey() or key in painted:
+                offset = -file.tell() % PROJECT_ALIGNMENT + file.tell()
+                file.seek(offset)
+                file.write(tile_bytes(tile))
+                entry = (None if key in painted else tile.cacheKey(), offset)
+            entries[key] = entry
+        index_offset = file.tell()
+        file.write(b"".join(PROJECT_INDEX_ENTRY.pack(key[0], key[1], entry[1]) for key, entry in entries.items()))
+        self.file_size = file.tell()
+        file.flush()
+        os.fsync(file.fileno())
+        file.seek(0)
+        file.write(PROJECT_HEADER.pack(PROJECT_MAGIC, 1, TILE_SIZE, canvas.width, canvas.height,
+                                       canvas.blank.pixel(0, 0), index_offset, len(entries)))
+        file.flush()
+        os.fsync(file.fileno())
+        self.entries = entries
+
+
+# This class records the state of the tiles before an action modified them. Undoing or redoing the action
+# swaps the recorded tiles with the tiles of the sheet, so it costs time proportional to the modified area.
+class TileChange:
+    def __init__(self):
+        # previous tile for each modified key, None when the key was using the shared blank tile
+        self.tiles = {}
+        # previous blank tile when the action filled the whole sheet
+        self.blank = None
+        # zlib compressed tiles, used while the change is idle in the history, and the format of the tiles
+        self.packed = None
+        self.format = QImage.Format_RGB32
+
+    # function that records a tile before its first modification, the tile is shared until the sheet writes on it
+    def record(self, key, tile):
+        if key not in self.tiles:
+            self.tiles[key] = None if tile is None else QImage(tile)
+
+    # function that records the blank tile before the sheet is filled
+    def record_blank(self, blank):
+        if self.blank is None:
+            self.blank = blank
+
+    # function that returns True if the change does not modify anything
+    def is_empty(self):
+        return not self.tiles and self.blank is None
+
+    # function that returns the area of the sheet modified by the change, None if it is the whole sheet
+    def rect(self):
+        if self.blank is not None:
+            return None
+        rect = QRect()
+        for key in self.tiles:
+            rect |= TiledImage.tile_rect(key)
+        return rect
+
+    # function that returns the number of bytes used by the change
+    def byte_size(self):
+        if self.packed is not None:
+            return sum(len(data) for data in self.packed.values() if data is not None)
+        return sum(tile.sizeInBytes() for tile in self.tiles.values() if tile is not None)
+
+    # function that compresses the recorded tiles
+    def compress(self):
+        if self.packed is not None:
+            return
+        self.format = next((tile.format() for tile in self.tiles.values() if tile is not None), QImage.Format_RGB32)
+        self.packed = {key: None if tile is None else zlib.compress(tile_bytes(tile), 1)
+                       for key, tile in self.tiles.items()}
+        self.tiles = dict.fromkeys(self.tiles)
+
+    # function that restores the recorded tiles from their compressed form
+    def decompress(self):
+        if self.packed is None:
+            return
+        for key, data in self.packed.items():
+            if data is not None:
+                self.tiles[key] = QImage(zlib.decompress(data), TILE_SIZE, TILE_SIZE, self.format).copy()
+        self.packed = None
+
+    # function that swaps the recorded tiles with the tiles of the sheet, the change then records the other state
+    def swap(self, canvas):
+        self.decompress()
+        for key, tile in self.tiles.items():
+            current = canvas.tiles.pop(key, None)
+            if tile is not None:
+                canvas.tiles[key] = tile
+            self.tiles[key] = current
+            canvas.invalidate(canvas.tile_rect(key))
+        if self.blank is not None:
+            self.blank, canvas.blank = canvas.blank, self.blank
+            canvas.invalidate()
+
+
+# memory budget in bytes of the undo and redo history, shared by the layers of a picture
+HISTORY_BUDGET = 256 * 2 ** 20
+
+
+# This class keeps the undo and redo stacks of the sheet. The changes are compressed when the user is idle and
+# the oldest changes are dropped when the history uses more memory than its budget.
+class History:
+    def __init__(self, budget=HISTORY_BUDGET):
+        self.budget = budget
+        self.undo_stack = []
+        self.redo_stack = []
+
+        # number of bytes used by all the changes, and changes not compressed yet
+        self.size = 0
+        self.loose = []
+
+    # function that adds a change made by the user, the redo stack is dropped
+    def push(self, change):
+        for dropped in self.redo_stack:
+            self.size -= dropped.byte_size()
+        dropped = {id(dropped) for dropped in self.redo_stack}
+        self.loose = [loose for loose in self.loose if id(loose) not in dropped]
+        self.redo_stack = []
+        self.undo_stack.append(change)
+        self.size += change.byte_size()
+        self.loose.append(change)
+        self.enforce_budget()
+
+    # function that undoes the last change, returns the change or None if there is nothing to undo
+    def undo(self, canvas):
+        return self.move(canvas, self.undo_stack, self.redo_stack)
+
+    # function that redoes the last undone change, returns the change or None if there is nothing to redo
+    def redo(self, canvas):
+        return self.move(canvas, self.redo_stack, self.undo_stack)
+
+    # function that applies the last change of a stack and moves it to the other stack
+    def move(self, canvas, from_stack, to_stack):
+        if not from_stack:
+            return None
+        change = from_stack.pop()
+        self.size -= change.byte_size()
+        change.swap(canvas)
+        self.size += change.byte_size()
+        self.loose.append(change)
+        to_stack.append(change)
+        self.enforce_budget()
+        return change
+
+    # function that returns the number of bytes used by the history
+    def byte_size(self):
+        return self.size
+
+    # function that compresses the changes not compressed yet, called when the user is idle
+    def compress(self):
+        for change in self.loose:
+            if change.packed is None:
+                self.size -= change.byte_size()
+                change.compress()
+                self.size += change.byte_size()
+        self.loose = []
+
+    # function that compresses then drops the oldest changes until the history fits in its budget
+    def enforce_budget(self):
+        if self.size <= self.budget:
+            return
+        self.compress()
+        while self.size > self.budget and len(self.undo_stack) + len(self.redo_stack) > 1:
+            # the oldest change is at the bottom of the undo stack, then the furthest one of the redo stack
+            stack = self.undo_stack if self.undo_stack else self.redo_stack
+            self.size -= stack.pop(0).byte_size()
+
+    # function that drops all the changes
+    def clear(self):
+        self.undo_stack = []
+        self.redo_stack = []
+        self.size = 0
+        self.loose = []
+
+
+# This class records a stroke as its brush, its draw mode and its points. The coordinates of the points are packed
+# in a float array, so a point uses 8 bytes instead of a Python object.
+class StrokeRecord:
+    __slots__ = ("brush", "mode", "points")
+
+    def __init__(self, brush, mode, points=None):
+        self.brush = brush
+        self.mode = mode
+        self.points = array("f") if points is None else points
+
+    # function that appends the points of a path drawn by the stroke, skipping the point joining it to the stroke
+    def add_path(self, path):
+        first = 1 if self.points else 0
+        for i in range(first, path.elementCount()):
+            element = path.elementAt(i)
+            self.points.extend((element.x, element.y))
+
+    # function that returns the path of the stroke, scaled by a factor
+    def path(self, scale=1.0):
+        points = self.points
+        path = QPainterPath(QPointF(points[0] * scale, points[1] * scale))
+        for i in range(2, len(points), 2):
+            path.lineTo(points[i] * scale, points[i + 1] * scale)
+        return path
+
+    # function that draws the stroke on a sheet, scaled by a factor
+    def replay(self, canvas, scale=1.0):
+        if not self.points:
+            return
+        session = StrokeSession(canvas, self.brush._replace(size=self.brush.size * scale), self.mode)
+        session.draw_path(self.path(scale))
+        session.end()
+
+    # function that returns the number of bytes used by the record
+    def byte_size(self):
+        return sys.getsizeof(self.points)
+
+    # function that returns the binary form of the record
+    def encode(self):
+        points = self.points
+        if sys.byteorder == "big":
+            points = array("f", points)
+            points.byteswap()
+        return (STROKE_RECORD.pack(RECORD_STROKE, self.brush.size, self.brush.color, self.brush.line_type,
+                                   self.brush.cap_type, self.brush.join_type, self.mode.value, len(points) // 2)
+                + points.tobytes())
+
+
+# This class records a stroke drawn with dabs. Each point is followed by the pressure of the pen on it, so a point
+# uses 12 bytes.
+class DabRecord(StrokeRecord):
+    __slots__ = ()
+
+    # function that appends the points of a path drawn by the stroke and their pressures, skipping the point joining
+    # it to the stroke
+    def add_path(self, path, pressures=None):
+        first = 1 if self.points else 0
+        for i in range(first, path.elementCount()):
+            element = path.elementAt(i)
+            self.points.extend((element.x, element.y, 1.0 if pressures is None else pressures[i]))
+
+    # function that returns the path of the stroke, scaled by a factor
+    def path(self, scale=1.0):
+        points = self.points
+        path = QPainterPath(QPointF(points[0] * scale, points[1] * scale))
+        for i in range(3, len(points), 3):
+            path.lineTo(points[i] * scale, points[i + 1] * scale)
+        return path
+
+    # function that draws the stroke on a sheet, scaled by a factor
+    def replay(self, canvas, scale=1.0):
+        if not self.points:
+            return
+        session = DabSession(canvas, self.brush._replace(size=self.brush.size * scale), self.mode)
+        session.draw_path(self.path(scale), self.points[2::3])
+        session.end()
+
+    # function that returns the binary form of the record
+    def encode(self):
+        points = self.points
+        if sys.byteorder == "big":
+            points = array("f", points)
+            points.byteswap()
+        brush = self.brush
+        return (DAB_RECORD.pack(RECORD_DAB, brush.size, brush.color, brush.hardness, brush.opacity, brush.spacing,
+                                self.mode.value, len(points) // 3)
+                + points.tobytes())
+
+
+# This class records the filling of the whole sheet with a color.
+class ClearRecord(namedtuple("ClearRecord", ["color"])):
+    __slots__ = ()
+
+    # function that fills the sheet with the recorded color
+    def replay(self, canvas, scale=1.0):
+        canvas.fill(QColor.fromRgba(self.color))
+
+    # function that returns the number of bytes used by the record
+    def byte_size(self):
+        return sys.getsizeof(self)
+
+    # function that returns the binary form of the record
+    def encode(self):
+        return CLEAR_RECORD.pack(RECORD_CLEAR, self.color)
+
+
+# function that returns a numpy view of the pixels of a tile, without copying them. The view is writable only if
+# asked, since writing detaches the tile from the images sharing its pixels.
+def tile_array(tile, writable=False):
+    bits = tile.bits() if writable else tile.constBits()
+    stride = tile.bytesPerLine()
+    bits.setsize(stride * (TILE_SIZE - 1) + TILE_SIZE * 4)
+    return numpy.ndarray((TILE_SIZE, TILE_SIZE), numpy.uint32, bits, strides=(stride, 4))
+
+
+# This class finds the pixels of a sheet connected to a seed pixel and close to its color, by filling spans of rows.
+# The masks of the pixels out of the tolerance are computed with numpy by bands of one tile row, once per tile image:
+# the blank tile shared by all the tiles never drawn on is only compared once. The rows being filled are byte arrays,
+# so the ends of the spans are found by the byte search functions instead of per pixel loops.
+class FloodFill:
+    def __init__(self, canvas, tolerance, connectivity):
+        self.canvas = canvas
+        self.tolerance = tolerance
+        self.reach = 1 if connectivity == 8 else 0
+
+        # masks of the pixels out of the tolerance, by tile image cache key and by band of one tile row
+        self.tile_masks = {}
+        self.bands = {}
+
+        # rows of the mask of the pixels out of the tolerance or already filled, 1 for a blocked pixel
+        self.rows = {}
+
+        # bits of the pixels compared: the color channels, and the alpha channel on a sheet with transparency
+        self.channels = 4 if canvas.blank.hasAlphaChannel() else 3
+        self.bits = (1 << self.channels * 8) - 1
+
+        # color of the seed pixel
+        self.color = None
+
+    # function that returns the mask of the pixels of a tile out of the tolerance
+    def tile_mask(self, tile):
+        mask = self.tile_masks.get(tile.cacheKey())
+        if mask is None:
+            pixels = tile_array(tile)
+            if self.tolerance == 0:
+                mask = (pixels & self.bits) != self.color
+            else:
+                channels = pixels.view(numpy.uint8).reshape(TILE_SIZE, TILE_SIZE, 4)
+                mask = numpy.zeros((TILE_SIZE, TILE_SIZE), bool)
+                for channel in range(self.channels):
+                    value = self.color >> channel * 8 & 0xff
+                    mask |= channels[:, :, channel] < value - self.tolerance
+                    mask |= channels[:, :, channel] > value + self.tolerance
+            self.tile_masks[tile.cacheKey()] = mask
+        return mask
+
+    # function that returns the mask of the pixels out of the tolerance of a band of one tile row
+    def band(self, row):
+        band = self.bands.get(row)
+        if band is None:
+            height = min(TILE_SIZE, self.canvas.height - row * TILE_SIZE)
+            band = numpy.empty((height, self.canvas.width), bool)
+            for column in range((self.canvas.width + TILE_SIZE - 1) // TILE_SIZE):
+                left = column * TILE_SIZE
+                width = min(TILE_SIZE, self.canvas.width - left)
+                band[:, left:left + width] = self.tile_mask(self.canvas.tile((column, row)))[:height, :width]
+            self.bands[row] = band
+        return band
+
+    # function that returns a row of the mask of the pixels out of the tolerance or already filled
+    def row(self, y):
+        row = self.rows.get(y)
+        if row is None:
+            row = self.rows[y] = bytearray(self.band(y // TILE_SIZE)[y % TILE_SIZE].tobytes())
+        return row
+
+    # function that fills the pixels connected to a point and returns the bounding rectangle of the filled pixels,
+    # None if the point is out of the sheet
+    def run(self, x, y):
+        if not self.canvas.rect().contains(x, y):
+            return None
+        self.color = int(tile_array(self.canvas.tile((x // TILE_SIZE, y // TILE_SIZE)))[y % TILE_SIZE, x % TILE_SIZE]) \
+            & self.bits
+        width, height = self.canvas.width, self.canvas.height
+        blocked = memoryview(b"\x01" * width)
+        left_most, right_most, top_most, bottom_most = x, x, y, y
+        seeds = [(x, y)]
+        while seeds:
+            x, y = seeds.pop()
+            row = self.row(y)
+            if row[x]:
+                continue
+
+            # extends the span to the first pixels blocked on each side
+            left = row.rfind(1, 0, x) + 1
+            right = row.find(1, x)
+            if right < 0:
+                right = width
+            row[left:right] = blocked[:right - left]
+            if left < left_most:
+                left_most = left
+            if right > right_most:
+                right_most = right
+            if y < top_most:
+                top_most = y
+            elif y > bottom_most:
+                bottom_most = y
+
+            # adds a seed for each span of fillable pixels touching the span in the rows above and below
+            start, end = max(0, left - self.reach), min(width, right + self.reach)
+            for neighbor in (y - 1, y + 1):
+                if not 0 <= neighbor < height:
+                    continue
+                neighbor_row = self.row(neighbor)
+                i = neighbor_row.find(0, start, end)
+                while i >= 0:
+                    seeds.append((i, neighbor))
+                    i = neighbor_row.find(1, i, end)
+                    if i < 0:
+                        break
+                    i = neighbor_row.find(0, i, end)
+        return QRect(left_most, top_most, right_most - left_most, bottom_most - top_most + 1)
+
+    # function that writes a color on the filled pixels of the tiles intersecting a rectangle
+    def paint(self, rect, color):
+        for tile_row in range(rect.top() // TILE_SIZE, rect.bottom() // TILE_SIZE + 1):
+            band = self.bands[tile_row]
+            filled = numpy.zeros(band.shape, bool)
+            for y in range(band.shape[0]):
+                row = self.rows.get(tile_row * TILE_SIZE + y)
+                if row is not None:
+                    filled[y] = numpy.frombuffer(row, bool)
+            filled &= ~band
+            for column in range(rect.left() // TILE_SIZE, rect.right() // TILE_SIZE + 1):
+                left = column * TILE_SIZE
+                tile_filled = filled[:, left:left + TILE_SIZE]
+                if tile_filled.any():
+                    pixels = tile_array(self.canvas.writable_tile((column, tile_row)), True)
+                    pixels[:tile_filled.shape[0], :tile_filled.shape[1]][tile_filled] = color | 0xff000000
+
+
+# function that fills with a color the area of a sheet connected to a point and close to its color. The tolerance is
+# the largest difference allowed on each channel, the connectivity is 4 or 8 neighbors. Returns the rectangle of the
+# filled pixels, None if the point is out of the sheet.
+def flood_fill(canvas, point, color, tolerance=0, connectivity=4):
+    fill = FloodFill(canvas, tolerance, connectivity)
+    rect = fill.run(math.floor(point.x()), math.floor(point.y()))
+    if rect is not None:
+        fill.paint(rect, color)
+    return rect
+
+
+# This class records a fill as its point, its color, its tolerance and its connectivity.
+class FillRecord(namedtuple("FillRecord", ["x", "y", "color", "tolerance", "connectivity"])):
+    __slots__ = ()
+
+    # function that fills the area around the recorded point
+    def replay(self, canvas, scale=1.0):
+        flood_fill(canvas, QPointF(self.x * scale, self.y * scale), self.color, self.tolerance, self.connectivity)
+
+    # function that returns the number of bytes used by the record
+    def byte_size(self):
+        return sys.getsizeof(self)
+
+    # function that returns the binary form of the record
+    def encode(self):
+        return FILL_RECORD.pack(RECORD_FILL, self.x, self.y, self.color, self.tolerance, self.connectivity)
+
+
+# function that returns the pixels of a rectangle of a sheet as an array of height x width x 4 bytes (blue, green,
+# red, alpha), the pixels out of the sheet repeating the pixels of its border
+def read_pixels(canvas, rect):
+    clipped = rect & canvas.rect()
+    pixels = numpy.empty((clipped.height(), clipped.width()), numpy.uint32)
+    for key in canvas.keys_in(clipped):
+        part = clipped & canvas.tile_rect(key)
+        tile_x, tile_y = part.x() - key[0] * TILE_SIZE, part.y() - key[1] * TILE_SIZE
+        x, y = part.x() - clipped.x(), part.y() - clipped.y()
+        pixels[y:y + part.height(), x:x + part.width()] = \
+            tile_array(canvas.tile(key))[tile_y:tile_y + part.height(), tile_x:tile_x + part.width()]
+    pixels = numpy.pad(pixels, ((clipped.y() - rect.y(), rect.bottom() - clipped.bottom()),
+                                (clipped.x() - rect.x(), rect.right() - clipped.right())), mode="edge")
+    return pixels.view(numpy.uint8).reshape(rect.height(), rect.width(), 4)
+
+
+# function that returns the pixels of an image in Format_RGB32 as an array of height x width x 4 bytes
+def image_pixels(image):
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    pixels = numpy.frombuffer(bits, numpy.uint8).reshape(image.height(), image.bytesPerLine() // 4, 4)
+    return pixels[:, :image.width()]
+
+
+# function that returns an image holding float color channels, clipped to 0-255. The image is opaque in
+# Format_RGB32 without an alpha channel, otherwise in Format_ARGB32_Premultiplied with the colors clipped to the alpha.
+def pixels_image(channels, alpha=None):
+    height, width = channels.shape[:2]
+    image = QImage(width, height, QImage.Format_RGB32 if alpha is None else QImage.Format_ARGB32_Premultiplied)
+    bits = image.bits()
+    bits.setsize(image.sizeInBytes())
+    pixels = numpy.frombuffer(bits, numpy.uint8).reshape(height, image.bytesPerLine() // 4, 4)[:, :width]
+    if alpha is None:
+        pixels[:, :, :3] = numpy.clip(channels + 0.5, 0, 255)
+        pixels[:, :, 3] = 255
+    else:
+        pixels[:, :, :3] = numpy.minimum(numpy.clip(channels + 0.5, 0, 255), alpha[:, :, numpy.newaxis])
+        pixels[:, :, 3] = alpha
+    return image
+
+
+# function that blurs the first channels of pixels with a gaussian of a radius, the color channels by default. The blur
+# is separable, each output pixel reads the pixels up to ceil(radius) away, so the output is smaller than the input by
+# twice this halo.
+def gaussian_blur(pixels, radius, count=3):
+    halo = math.ceil(radius)
+    sigma = max(radius / 2, 0.5)
+    weights = numpy.exp(-numpy.arange(-halo, halo + 1) ** 2 / (2 * sigma * sigma))
+    weights = (weights / weights.sum()).astype(numpy.float32)
+    channels = pixels[:, :, :count].astype(numpy.float32)
+    height, width = channels.shape[0] - 2 * halo, channels.shape[1] - 2 * halo
+    rows = weights[0] * channels[:, :width]
+    for i in range(1, 2 * halo + 1):
+        rows += weights[i] * channels[:, i:i + width]
+    blurred = weights[0] * rows[:height]
+    for i in range(1, 2 * halo + 1):
+        blurred += weights[i] * rows[i:i + height]
+    return blurred
+
+
+# This class defines the gaussian blur filter.
+class BlurFilter(namedtuple("BlurFilter", ["radius"])):
+    __slots__ = ()
+    kind = 0
+    name = "Blur"
+    # True for a filter mixing neighbor pixels linearly, applied to the premultiplied channels of a sheet with
+    # transparency, its alpha channel included. The other filters are applied to the colors before premultiplication.
+    linear = True
+    # parameters of the filter dialog: field, label, minimum, maximum and default value
+    parameters = (("radius", "radius", 1, 20, 3),)
+
+    # function that returns the number of pixels read around each pixel
+    def halo(self):
+        return math.ceil(self.radius)
+
+    # function that returns the filter applied to the sheet rasterized at a scale
+    def scaled(self, scale):
+        return self._replace(radius=self.radius * scale)
+
+    # function that returns the filtered color channels of pixels surrounded by the halo, or a number of their first
+    # channels
+    def apply(self, pixels, count=3):
+        return gaussian_blur(pixels, self.radius, count)
+
+
+# This class defines the sharpen filter, an unsharp mask adding the difference between the pixels and their blur.
+class SharpenFilter(namedtuple("SharpenFilter", ["radius", "amount"])):
+    __slots__ = ()
+    kind = 1
+    name = "Sharpen"
+    linear = True
+    parameters = (("radius", "radius", 1, 10, 2), ("amount", "amount %", 0, 300, 100))
+
+    # function that returns the number of pixels read around each pixel
+    def halo(self):
+        return math.ceil(self.radius)
+
+    # function that returns the filter applied to the sheet rasterized at a scale
+    def scaled(self, scale):
+        return self._replace(radius=self.radius * scale)
+
+    # function that returns the filtered color channels of pixels surrounded by the halo, or a number of their first
+    # channels
+    def apply(self, pixels, count=3):
+        halo = self.halo()
+        center = pixels[halo:pixels.shape[0] - halo, halo:pixels.shape[1] - halo, :count].astype(numpy.float32)
+        return center + (center - gaussian_blur(pixels, self.radius, count)) * (self.amount / 100)
+
+
+# This class defines the brightness and contrast filter, the contrast scales the channels around their middle.
+class LevelsFilter(namedtuple("LevelsFilter", ["brightness", "contrast"])):
+    __slots__ = ()
+    kind = 2
+    name = "Brightness/contrast"
+    linear = False
+    parameters = (("brightness", "brightness", -100, 100, 0), ("contrast", "contrast %", 0, 300, 100))
+
+    # function that returns the number of pixels read around each pixel
+    def halo(self):
+        return 0
+
+    # function that returns the filter applied to the sheet rasterized at a scale
+    def scaled(self, scale):
+        return self
+
+    # function that returns the filtered color channels of pixels surrounded by the halo
+    def apply(self, pixels):
+        levels = (numpy.arange(256, dtype=numpy.float32) - 127.5) * (self.contrast / 100) + 127.5 + self.brightness
+        return levels[pixels[:, :, :3]]
+
+
+# This class defines the filter inverting the colors.
+class InvertFilter(namedtuple("InvertFilter", [])):
+    __slots__ = ()
+    kind = 3
+    name = "Invert"
+    linear = False
+    parameters = ()
+
+    # function that returns the number of pixels read around each pixel
+    def halo(self):
+        return 0
+
+    # function that returns the filter applied to the sheet rasterized at a scale
+    def scaled(self, scale):
+        return self
+
+    # function that returns the filtered color channels of pixels surrounded by the halo
+    def apply(self, pixels):
+        return 255 - pixels[:, :, :3].astype(numpy.float32)
+
+
+# filters by kind
+FILTERS = {image_filter.kind: image_filter for image_filter in (BlurFilter, SharpenFilter, LevelsFilter, InvertFilter)}
+
+
+# This class applies a filter to a sheet tile by tile, each tile being computed from its pixels and a halo of
+# pixels read in the neighbor tiles. The tiles are spread over a pool of threads, numpy releasing the interpreter
+# lock while it computes. Only the tiles drawn on and the tiles next to them are computed: the other tiles only read
+# blank pixels, so they all become the filtered blank tile.
+class FilterPass:
+    def __init__(self, canvas, image_filter):
+        self.canvas = canvas
+        self.filter = image_filter
+        halo = image_filter.halo()
+        columns = (canvas.width + TILE_SIZE - 1) // TILE_SIZE
+        rows = (canvas.height + TILE_SIZE - 1) // TILE_SIZE
+        reach = 0 if halo == 0 else (halo + TILE_SIZE - 1) // TILE_SIZE
+        self.keys = sorted({(column + dx, row + dy) for column, row in canvas.tiles
+                            for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1)
+                            if 0 <= column + dx < columns and 0 <= row + dy < rows})
+
+    # function that returns a tile filtered
+    def tile(self, key):
+        halo = self.filter.halo()
+        return self.image(read_pixels(self.canvas, self.canvas.tile_rect(key).adjusted(-halo, -halo, halo, halo)))
+
+    # function that returns the blank tile filtered
+    def blank(self):
+        halo = self.filter.halo()
+        pixels = tile_array(self.canvas.blank).view(numpy.uint8).reshape(TILE_SIZE, TILE_SIZE, 4)
+        return self.image(numpy.pad(pixels, ((halo, halo), (halo, halo), (0, 0)), mode="edge"))
+
+    # function that returns the image of pixels surrounded by the halo filtered. On a sheet with transparency, a
+    # linear filter is applied to the premultiplied channels and spreads the alpha channel too, the other filters
+    # change the colors of the pixels unpremultiplied and keep their alpha channel.
+    def image(self, pixels):
+        if not self.canvas.blank.hasAlphaChannel():
+            return pixels_image(self.filter.apply(pixels))
+        if self.filter.linear:
+            channels = self.filter.apply(pixels, 4)
+            return pixels_image(channels[:, :, :3], numpy.clip(channels[:, :, 3] + 0.5, 0, 255).astype(numpy.uint8))
+        alpha = pixels[:, :, 3:].astype(numpy.float32)
+        straight = pixels.copy()
+        straight[:, :, :3] = numpy.clip(pixels[:, :, :3] * numpy.float32(255) / numpy.maximum(alpha, 1) + 0.5, 0,
+                                        255)
+        halo = self.filter.halo()
+        alpha = alpha[halo:alpha.shape[0] - halo, halo:alpha.shape[1] - halo]
+        return pixels_image(self.filter.apply(straight) * (alpha / 255), alpha[:, :, 0].astype(numpy.uint8))
+
+    # function that computes the filtered tiles and returns the filtered blank tile and the tiles by key, None if
+    # cancelled returns True before all the tiles are computed
+    def run(self, cancelled=lambda: False, progress=lambda percent: None):
+        tiles = {}
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+            futures = {executor.submit(self.tile, key): key for key in self.keys}
+            for future in concurrent.futures.as_completed(futures):
+                if cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    return None
+                tiles[futures[future]] = future.result()
+                progress(100 * len(tiles) // len(futures))
+        return self.blank(), tiles
+
+
+# This class applies a filter to a snapshot of the sheet in a worker thread.
+class FilterWorker(QThread):
+    # signal emitted with the percentage of the tiles already filtered
+    progress = pyqtSignal(int)
+
+    def __init__(self, snapshot, image_filter):
+        super().__init__()
+        self.filter_pass = FilterPass(snapshot, image_filter)
+
+        # filtered blank tile and tiles, None if the filter has been cancelled
+        self.result = None
+
+    # function run by the worker thread
+    def run(self):
+        self.result = self.filter_pass.run(self.isInterruptionRequested, self.progress.emit)
+
+
+# This class records a filter applied to the whole sheet.
+class FilterRecord(namedtuple("FilterRecord", ["filter"])):
+    __slots__ = ()
+
+    # function that applies the recorded filter to the sheet
+    def replay(self, canvas, scale=1.0):
+        canvas.replace(*FilterPass(canvas, self.filter.scaled(scale)).run())
+
+    # function that returns the number of bytes used by the record
+    def byte_size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.filter)
+
+    # function that returns the binary form of the record
+    def encode(self):
+        values = tuple(self.filter) + (0.0,) * (2 - len(self.filter))
+        return FILTER_RECORD.pack(RECORD_FILTER, self.filter.kind, *values)
+
+
+# This class records the erasing of a rectangle of the sheet, the cut of a selection.
+class EraseRecord(namedtuple("EraseRecord", ["x", "y", "width", "height"])):
+    __slots__ = ()
+
+    # function that erases the recorded rectangle
+    def replay(self, canvas, scale=1.0):
+        canvas.erase(QRectF(self.x * scale, self.y * scale, self.width * scale, self.height * scale).toRect())
+
+    # function that returns the number of bytes used by the record
+    def byte_size(self):
+        return sys.getsizeof(self)
+
+    # function that returns the binary form of the record
+    def encode(self):
+        return ERASE_RECORD.pack(RECORD_ERASE, self.x, self.y, self.width, self.height)
+
+
+# This class records the move of the pixels of a rectangle of the sheet to another position, the rectangle being
+# erased, as a selection dragged and dropped.
+class MoveRecord(namedtuple("MoveRecord", ["x", "y", "width", "height", "to_x", "to_y"])):
+    __slots__ = ()
+
+    # function that moves the pixels of the recorded rectangle
+    def replay(self, canvas, scale=1.0):
+        rect = QRectF(self.x * scale, self.y * scale, self.width * scale, self.height * scale).toRect()
+        source = canvas.view(rect)
+        canvas.erase(rect)
+        canvas.paste(source, rect, QPoint(round(self.to_x * scale), round(self.to_y * scale)))
+
+    # function that returns the number of bytes used by the record
+    def byte_size(self):
+        return sys.getsizeof(self)
+
+    # function that returns the binary form of the record
+    def encode(self):
+        return MOVE_RECORD.pack(RECORD_MOVE, self.x, self.y, self.width, self.height, self.to_x, self.to_y)
+
+
+# This class records pixels pasted at a position of the sheet. The pixels are a rectangle of a view on the tiles of
+# the sheet they were copied from, they are only read into an image when the record is encoded.
+class PasteRecord(namedtuple("PasteRecord", ["x", "y", "source", "rect"])):
+    __slots__ = ()
+
+    # function that pastes the recorded pixels
+    def replay(self, canvas, scale=1.0):
+        canvas.paste(self.source, self.rect, QPoint(round(self.x * scale), round(self.y * scale)), scale)
+
+    # function that returns the number of bytes used by the record, counting the tiles it shares
+    def byte_size(self):
+        return sys.getsizeof(self) + sum(tile.sizeInBytes() for tile in self.source.tiles.values())
+
+    # function that returns the pasted pixels as an image with transparency
+    def image(self):
+        image = QImage(self.rect.size(), QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.translate(-self.rect.x(), -self.rect.y())
+        self.source.draw(painter, self.rect)
+        painter.end()
+        return image
+
+    # function that returns the binary form of the record, the pixels are compressed
+    def encode(self):
+        image = self.image()
+        pixels = zlib.compress(image.constBits().asstring(image.sizeInBytes()), 1)
+        return PASTE_RECORD.pack(RECORD_PASTE, self.x, self.y, self.rect.width(), self.rect.height(),
+                                 len(pixels)) + pixels
+
+
+# binary form of the records: a type byte followed by the fields of the record, the points of a stroke follow its
+# header as little endian floats
+RECORD_STROKE = 0
+RECORD_CLEAR = 1
+STROKE_RECORD = struct.Struct("<BfIBBBBI")
+CLEAR_RECORD = struct.Struct("<BI")
+# the types 2 and 3 are the undo and redo records of the journal
+RECORD_FILL = 4
+RECORD_FILTER = 5
+FILL_RECORD = struct.Struct("<BffIBB")
+FILTER_RECORD = struct.Struct("<BBff")
+# the points of a dab stroke are followed by their pressure
+RECORD_DAB = 6
+DAB_RECORD = struct.Struct("<BfIfffBI")
+# the pixels of a paste follow its header, compressed with zlib
+RECORD_ERASE = 7
+RECORD_MOVE = 8
+RECORD_PASTE = 9
+ERASE_RECORD = struct.Struct("<BiiII")
+MOVE_RECORD = struct.Struct("<BiiIIii")
+PASTE_RECORD = struct.Struct("<BiiIII")
+
+# values accepted when decoding the options of a brush
+LINE_TYPES = (Qt.SolidLine, Qt.DashLine, Qt.DotLine, Qt.DashDotLine, Qt.DashDotDotLine)
+CAP_TYPES = (Qt.FlatCap, Qt.SquareCap, Qt.RoundCap)
+JOIN_TYPES = (Qt.MiterJoin, Qt.BevelJoin, Qt.RoundJoin)
+
+
+# function that decodes the record starting at an offset of a buffer, returns the record and the offset after it
+def decode_record(data, offset):
+    try:
+        if data[offset] == RECORD_STROKE:
+            _, size, color, line_type, cap_type, join_type, mode, count = STROKE_RECORD.unpack_from(data, offset)
+            offset += STROKE_RECORD.size
+            end = offset + count * 8
+            if line_type not in LINE_TYPES or cap_type not in CAP_TYPES or join_type not in JOIN_TYPES \
+                    or not 0 < size <= 1000 or end > len(data):
+                raise ValueError("invalid stroke record")
+            points = array("f")
+            points.frombytes(bytes(data[offset:end]))
+            if sys.byteorder == "big":
+                points.byteswap()
+            brush = BrushSpec(size, color, Qt.PenStyle(line_type), Qt.PenCapStyle(cap_type),
+                              Qt.PenJoinStyle(join_type))
+            return StrokeRecord(brush, DrawMode(mode), points), end
+        if data[offset] == RECORD_DAB:
+            _, size, color, hardness, opacity, spacing, mode, count = DAB_RECORD.unpack_from(data, offset)
+            offset += DAB_RECORD.size
+            end = offset + count * 12
+            if not 0 < size <= 1000 or not 0 <= hardness <= 1 or not 0 < opacity <= 1 or not 0 < spacing <= 10 \
+                    or end > len(data):
+                raise ValueError("invalid dab record")
+            points = array("f")
+            points.frombytes(bytes(data[offset:end]))
+            if sys.byteorder == "big":
+                points.byteswap()
+            brush = BrushSpec(size, color, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin, BrushEngine.DAB, hardness,
+                              opacity, spacing)
+            return DabRecord(brush, DrawMode(mode), points), end
+        if data[offset] == RECORD_CLEAR:
+            _, color = CLEAR_RECORD.unpack_from(data, offset)
+            return ClearRecord(color), offset + CLEAR_RECORD.size
+        if data[offset] == RECORD_FILL:
+            _, x, y, color, tolerance, connectivity = FILL_RECORD.unpack_from(data, offset)
+            if not math.isfinite(x) or not math.isfinite(y) or not 0 <= tolerance <= 255 or connectivity not in (4, 8):
+                raise ValueError("invalid fill record")
+            return FillRecord(x, y, color, tolerance, connectivity), offset + FILL_RECORD.size
+        if data[offset] == RECORD_FILTER:
+            _, kind, first, second = FILTER_RECORD.unpack_from(data, offset)
+            if kind not in FILTERS:
+                raise ValueError("invalid filter record")
+            image_filter = FILTERS[kind](*(first, second)[:len(FILTERS[kind]._fields)])
+            # the values must be in the range of the sliders of the filter dialog, NaN is out of any range
+            if not all(minimum <= getattr(image_filter, field) <= maximum
+                       for field, _, minimum, maximum, _ in image_filter.parameters):
+                raise ValueError("invalid filter record")
+            return FilterRecord(image_filter), offset + FILTER_RECORD.size
+        if data[offset] == RECORD_ERASE:
+            return EraseRecord(*ERASE_RECORD.unpack_from(data, offset)[1:]), offset + ERASE_RECORD.size
+        if data[offset] == RECORD_MOVE:
+            return MoveRecord(*MOVE_RECORD.unpack_from(data, offset)[1:]), offset + MOVE_RECORD.size
+        if data[offset] == RECORD_PASTE:
+            _, x, y, width, height, length = PASTE_RECORD.unpack_from(data, offset)
+            offset += PASTE_RECORD.size
+            end = offset + length
+            if not 0 < width <= 2 ** 16 or not 0 < height <= 2 ** 16 or end > len(data):
+                raise ValueError("invalid paste record")
+            try:
+                pixels = zlib.decompress(bytes(data[offset:end]))
+            except zlib.error as error:
+                raise ValueError("invalid paste record") from error
+            if len(pixels) != width * height * 4:
+                raise ValueError("invalid paste record")
+            image = QImage(pixels, width, height, QImage.Format_ARGB32_Premultiplied).copy()
+            return PasteRecord(x, y, TiledImage.from_image(image, Qt.transparent), image.rect()), end
+    except (struct.error, IndexError) as error:
+        raise ValueError("truncated record") from error
+    raise ValueError("unknown record type " + str(data[offset]))
+
+
+# header of the stroke files: magic, version, width and height of the sheet
+STROKE_FILE_MAGIC = b"PSTK"
+STROKE_FILE_HEADER = struct.Struct("<4sHII")
+
+
+# This class keeps the vector records of the actions made on the sheet since it was created or opened. It follows
+# the undo history, so the sheet can be rasterized again at any scale from the base image and the active records.
+class StrokeLog:
+    def __init__(self, width, height, base=None):
+        self.width = width
+        self.height = height
+
+        # sheet opened by the user, None for a new sheet
+        self.base = base
+
+        # records of the actions, the ones after count have been undone
+        self.records = []
+        self.count = 0
+
+    # function that adds the record of an action, the undone records are dropped
+    def push(self, record):
+        del self.records[self.count:]
+        self.records.append(record)
+        self.count += 1
+
+    # function that deactivates the last record
+    def undo(self):
+        self.count = max(0, self.count - 1)
+
+    # function that activates again the last undone record
+    def redo(self):
+        self.count = min(len(self.records), self.count + 1)
+
+    # function that returns the records of the actions that are not undone
+    def active(self):
+        return self.records[:self.count]
+
+    # function that returns the number of bytes used by the records
+    def byte_size(self):
+        return sum(record.byte_size() for record in self.records)
+
+    # function that writes the active records to a stroke file, the base image is not saved
+    def save(self, file_path):
+        with open(file_path, "wb") as file:
+            file.write(STROKE_FILE_HEADER.pack(STROKE_FILE_MAGIC, 1, self.width, self.height))
+            for record in self.active():
+                file.write(record.encode())
+
+    # function that reads a stroke file, raises ValueError if the file is corrupt
+    @staticmethod
+    def load(file_path):
+        with open(file_path, "rb") as file:
+            data = file.read()
+        if len(data) < STROKE_FILE_HEADER.size:
+            raise ValueError("not a stroke file")
+        magic, version, width, height = STROKE_FILE_HEADER.unpack_from(data)
+        if magic != STROKE_FILE_MAGIC or version != 1 or not 0 < width <= 2 ** 16 or not 0 < height <= 2 ** 16:
+            raise ValueError("not a stroke file")
+        log = StrokeLog(width, height)
+        offset = STROKE_FILE_HEADER.size
+        while offset < len(data):
+            record, offset = decode_record(data, offset)
+            log.push(record)
+        return log
+
+    # function that rasterizes the sheet from its records, the result is scaled by a factor
+    def rasterize(self, scale=1.0):
+        if self.base is not None and scale == 1.0:
+            canvas = self.base.snapshot()
+        elif self.base is not None:
+            canvas = TiledImage(round(self.width * scale), round(self.height * scale), self.base.blank.pixelColor(0, 0))
+            to_base = QTransform.fromScale(1 / scale, 1 / scale)
+            for key in canvas.keys_in(canvas.rect()):
+                painter = QPainter(canvas.writable_tile(key))
+                painter.setRenderHint(QPainter.SmoothPixmapTransform)
+                painter.translate(-key[0] * TILE_SIZE, -key[1] * TILE_SIZE)
+                painter.scale(scale, scale)
+                self.base.draw(painter, to_base.mapRect(QRectF(canvas.tile_rect(key))).toAlignedRect()
+                               .adjusted(-1, -1, 1, 1))
+                painter.end()
+        else:
+            canvas = TiledImage(round(self.width * scale), round(self.height * scale))
+        for record in self.active():
+            record.replay(canvas, scale)
+        return canvas
+
+
+# This class keeps the painters and the pen open on the tiles of the sheet for the whole duration of a stroke.
+# A painter is opened on a tile the first time the stroke reaches it.
+class StrokeSession:
+    def __init__(self, canvas, brush, mode=DrawMode.CURVE):
+        self.canvas = canvas
+        self.brush = brush
+        self.painters = {}
+
+        # vector record of the stroke, filled as the stroke is drawn
+        self.record = StrokeRecord(brush, mode)
+
+        # length already drawn, used to continue the dash pattern from one segment to the next
+        self.length = 0.0
+
+    # function that returns the painters of the tiles under a rectangle of the sheet, opening the missing ones
+    def painters_in(self, rect):
+        painters = []
+        for key in self.canvas.keys_in(rect):
+            painter = self.painters.get(key)
+            if painter is None:
+                painter = self.open_painter(key)
+                self.painters[key] = painter
+            painters.append(painter)
+        return painters
+
+    # function that opens a painter on a tile, in sheet coordinates
+    def open_painter(self, key):
+        painter = QPainter(self.canvas.writable_tile(key))
+        painter.translate(-key[0] * TILE_SIZE, -key[1] * TILE_SIZE)
+        painter.setPen(self.brush.pen())
+        return painter
+
+    # function that returns the pen for the next segment, shifting the dash pattern by the length already drawn
+    def next_pen(self):
+        if self.brush.line_type != Qt.SolidLine and self.length > 0:
+            pen = QPen(self.brush.pen())
+            pen.setDashOffset(self.length / max(self.brush.size, 1))
+            return pen
+        return None
+
+    # function to draw a segment of the stroke, returns the area of the sheet that has been modified
+    def draw_line(self, from_point, to_point, pressures=None):
+        path = QPainterPath(from_point)
+        path.lineTo(to_point)
+        return self.draw_path(path, pressures)
+
+    # function that returns the area of the sheet covered by a path drawn with the brush
+    def path_rect(self, path):
+        margin = self.brush.margin()
+        return path.controlPointRect().toAlignedRect().adjusted(-margin, -margin, margin, margin)
+
+    # function to draw a path made of several segments of the stroke, returns the area of the sheet modified. The pen
+    # ignores the pressure on the points of the path.
+    def draw_path(self, path, pressures=None):
+        rect = self.path_rect(path)
+        pen = self.next_pen()
+        for painter in self.painters_in(rect):
+            if pen is not None:
+                painter.setPen(pen)
+            painter.drawPath(path)
+        self.canvas.invalidate(rect)
+        self.length += path.length()
+        self.record.add_path(path)
+        return rect
+
+    # function that closes the painters at the end of the stroke
+    def end(self):
+        for painter in self.painters.values():
+            painter.end()
+        self.painters = {}
+
+
+# number of pressure levels scaling the dabs
+DAB_PRESSURE_LEVELS = 64
+
+
+# function that returns the image of a dab: a disc of a diameter and a color, opaque up to the hardness fraction of
+# its radius then fading to its edge. The images are shared by the strokes and must not be modified.
+@lru_cache(maxsize=128)
+def dab_image(diameter, hardness, color):
+    side = math.ceil(diameter) + 2
+    image = QImage(side, side, QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(Qt.NoPen)
+    center = QPointF(side / 2, side / 2)
+    opaque = QColor.fromRgba(color)
+    if hardness < 1:
+        gradient = QRadialGradient(center, diameter / 2)
+        gradient.setColorAt(hardness, opaque)
+        gradient.setColorAt(1, QColor(opaque.red(), opaque.green(), opaque.blue(), 0))
+        painter.setBrush(gradient)
+    else:
+        painter.setBrush(opaque)
+    painter.drawEllipse(center, diameter / 2, diameter / 2)
+    painter.end()
+    return image
+
+
+# This class draws a stroke by stamping dabs along its path, one every spacing fraction of the dab diameter. The
+# pressure of the pen scales the dabs. The dab images are cached by diameter, hardness and color, so drawing a stroke
+# only blits them. The distance to the last dab is carried from one path to the next, so the dabs do not depend on
+# how the stroke is split into paths.
+class DabSession(StrokeSession):
+    def __init__(self, canvas, brush, mode=DrawMode.CURVE):
+        super().__init__(canvas, brush, mode)
+        self.record = DabRecord(brush, mode)
+
+        # distance along the stroke from the last dab, None before the first dab
+        self.distance = None
+
+    # function that opens a painter on a tile, blitting the dabs with the opacity of the brush
+    def open_painter(self, key):
+        painter = super().open_painter(key)
+        painter.setOpacity(self.brush.opacity)
+        return painter
+
+    # function that returns the diameter of a dab under a pressure, the pressure is rounded so that a brush has a
+    # few dab images in the cache
+    def diameter(self, pressure):
+        level = round(min(max(pressure, 0.0), 1.0) * DAB_PRESSURE_LEVELS)
+        return max(1.0, self.brush.size * level / DAB_PRESSURE_LEVELS)
+
+    # function that stamps a dab centered on a point, returns the area of the sheet modified
+    def stamp(self, point, pressure):
+        image = dab_image(self.diameter(pressure), self.brush.hardness, self.brush.color)
+        position = QPoint(round(point.x() - image.width() / 2), round(point.y() - image.height() / 2))
+        rect = QRect(position, image.size())
+        for painter in self.painters_in(rect):
+            painter.drawImage(position, image)
+        return rect
+
+    # function to draw a path made of several segments of the stroke, returns the area of the sheet modified. The
+    # pressures are the ones of the elements of the path, 1 for all of them when None.
+    def draw_path(self, path, pressures=None):
+        rect = QRect()
+        element = path.elementAt(0)
+        previous = QPointF(element.x, element.y)
+        previous_pressure = 1.0 if pressures is None else pressures[0]
+        if self.distance is None:
+            rect |= self.stamp(previous, previous_pressure)
+            self.distance = 0.0
+        for i in range(1, path.elementCount()):
+            element = path.elementAt(i)
+            point = QPointF(element.x, element.y)
+            pressure = 1.0 if pressures is None else pressures[i]
+            length = QLineF(previous, point).length()
+            travelled = 0.0
+            while length > 0:
+                fraction = travelled / length
+                spacing = max(1.0, self.brush.spacing * self.diameter(
+                    previous_pressure + (pressure - previous_pressure) * fraction))
+                # the spacing shrinks when the pressure drops, the next dab is then stamped at once
+                step = max(0.0, spacing - self.distance)
+                if travelled + step > length:
+                    break
+                travelled += step
+                fraction = travelled / length
+                rect |= self.stamp(previous + (point - previous) * fraction,
+                                   previous_pressure + (pressure - previous_pressure) * fraction)
+                self.distance = 0.0
+            self.distance += length - travelled
+            previous, previous_pressure = point, pressure
+        if not rect.isEmpty():
+            self.canvas.invalidate(rect)
+        self.record.add_path(path, pressures)
+        return rect
+
+
+# function that returns the session drawing a stroke with the engine of a brush
+def stroke_session(canvas, brush, mode=DrawMode.CURVE):
+    if brush.engine == BrushEngine.DAB:
+        return DabSession(canvas, brush, mode)
+    return StrokeSession(canvas, brush, mode)
+
+
+# blend modes of the layers: name and composition mode drawing the layer on the layers below it
+BLEND_MODES = (("normal", QPainter.CompositionMode_SourceOver), ("multiply", QPainter.CompositionMode_Multiply),
+               ("screen", QPainter.CompositionMode_Screen), ("overlay", QPainter.CompositionMode_Overlay),
+               ("darken", QPainter.CompositionMode_Darken), ("lighten", QPainter.CompositionMode_Lighten),
+               ("difference", QPainter.CompositionMode_Difference))
+
+
+# This class is a layer of the picture: a sheet with its own undo history and stroke log, and the way it is blended
+# with the layers below it.
+class Layer:
+    def __init__(self, name, canvas, log):
+        self.name = name
+        self.canvas = canvas
+        self.history = History()
+        self.log = log
+
+        # blending settings: a hidden layer is not composited
+        self.visible = True
+        self.opacity = 1.0
+        self.blend_mode = QPainter.CompositionMode_SourceOver
+
+    # function that returns True if the layer is drawn as it is: visible, opaque and in normal mode
+    def plain(self):
+        return self.visible and self.opacity == 1.0 and self.blend_mode == QPainter.CompositionMode_SourceOver
+
+    # function that returns a tile of the layer, its blank tile for the None key
+    def tile(self, key):
+        return self.canvas.blank if key is None else self.canvas.tile(key)
+
+    # function that blends a part of a tile of the layer with a painter open on a tile of the layers below
+    def blend(self, painter, key, part):
+        painter.setOpacity(self.opacity)
+        painter.setCompositionMode(self.blend_mode)
+        painter.drawImage(part.topLeft(), self.tile(key), part)
+
+    # function that returns a copy of the layer rasterized again from its stroke log at a scale
+    def rasterized(self, scale):
+        layer = Layer(self.name, self.log.rasterize(scale), self.log)
+        layer.visible = self.visible
+        layer.opacity = self.opacity
+        layer.blend_mode = self.blend_mode
+        return layer
+
+
+# This class is the picture of a layer stack, a sheet whose tiles are composited from the layers when they are drawn.
+# A composited tile is kept until a layer modifies it, then only the modified part of the tile is composited again.
+# The tiles that are blank in every layer share the composited blank tile.
+class LayerComposite(TiledImage):
+    def __init__(self, stack):
+        bottom = stack.layers[0].canvas
+        super().__init__(bottom.width, bottom.height)
+        self.stack = stack
+        self.project = bottom.project
+
+        # part of each composited tile modified in a layer since it has been composited, in the tile coordinates
+        self.stale = {}
+
+    # function that marks a rectangle of the sheet modified in a layer, the whole sheet when it is None
+    def mark(self, rect):
+        if rect is None:
+            self.tiles = {}
+            self.stale = {}
+            self.blank = self.stack.compose(None)
+        else:
+            for key in self.keys_in(rect):
+                if key in self.tiles:
+                    tile_rect = self.tile_rect(key)
+                    self.stale[key] = self.stale.get(key, QRect()) | (rect & tile_rect).translated(-tile_rect.topLeft())
+        self.invalidate(rect)
+
+    # function that returns a composited tile, compositing it or its modified part first
+    def tile(self, key):
+        tile = self.tiles.get(key)
+        if tile is None:
+            if not self.stack.drawn(key):
+                return self.blank
+            tile = self.stack.compose(key)
+            self.tiles[key] = tile
+        elif key in self.stale:
+            self.stack.compose(key, tile, self.stale.pop(key))
+        return tile
+
+
+# This class keeps the layers of the picture, the bottom one first, and the layer receiving the actions. The picture
+# is composited over white from three surfaces: the cached composite of the layers below the active layer, the
+# active layer, and the cached composite of the layers above it. A stroke on the active layer then composites only
+# its dirty rectangle from these three surfaces, whatever the number of layers. The layers above are composited
+# together only when they are all in normal mode, other modes do not combine, so they are blended one by one.
+class LayerStack:
+    def __init__(self, layers):
+        self.layers = layers
+        self.active = len(layers) - 1
+
+        # number of layers created, used to name the new ones
+        self.created = len(layers)
+
+        # composited tiles of the visible layers below and above the active layer by key, the None key holding their
+        # composited blank tiles
+        self.below = {}
+        self.above = {}
+
+        self.composite = LayerComposite(self)
+        for layer in layers:
+            self.watch(layer)
+        self.composite.mark(None)
+        self.split_history_budget()
+
+    # function that follows the modifications of the tiles of a layer
+    def watch(self, layer):
+        layer.canvas.on_invalidate = lambda rect: self.layer_changed(layer, rect)
+
+    # function that splits the memory budget of the history between the layers, the oldest changes of the layers over
+    # their share are dropped
+    def split_history_budget(self):
+        for layer in self.layers:
+            layer.history.budget = HISTORY_BUDGET // len(self.layers)
+            layer.history.enforce_budget()
+
+    # function that compresses the histories of all the layers, called when the user is idle
+    def compress_history(self):
+        for layer in self.layers:
+            layer.history.compress()
+
+    # function that returns the layer receiving the actions
+    def active_layer(self):
+        return self.layers[self.active]
+
+    # function that returns True if the picture is the bottom layer drawn as it is, the composite is then not used
+    def plain(self):
+        return len(self.layers) == 1 and self.layers[0].plain() and not self.layers[0].canvas.blank.hasAlphaChannel()
+
+    # function that returns the sheet to draw: the bottom layer when the picture is plain, the composite otherwise
+    def image(self):
+        return self.layers[0].canvas if self.plain() else self.composite
+
+    # function that returns True if a tile has been drawn on in a visible layer
+    def drawn(self, key):
+        return any(key in layer.canvas.tiles for layer in self.layers if layer.visible)
+
+    # function called when a rectangle of a layer is modified, None for the whole layer
+    def layer_changed(self, layer, rect):
+        if not layer.visible or self.plain():
+            return
+        if layer is not self.active_layer():
+            self.below = {}
+            self.above = {}
+        self.composite.mark(rect)
+
+    # function called when the layers or their blending settings change, the whole picture is composited again
+    def changed(self):
+        self.below = {}
+        self.above = {}
+        self.composite.mark(None)
+
+    # function that changes the active layer, the picture does not change
+    def set_active(self, index):
+        self.active = index
+        self.below = {}
+        self.above = {}
+
+    # function that adds a transparent layer above the active layer and makes it active
+    def add(self):
+        bottom = self.layers[0].canvas
+        bottom.finish_loading()
+        canvas = TiledImage(bottom.width, bottom.height, Qt.transparent)
+        self.created += 1
+        layer = Layer("Layer " + str(self.created), canvas, StrokeLog(canvas.width, canvas.height, canvas.snapshot()))
+        self.watch(layer)
+        self.active += 1
+        self.layers.insert(self.active, layer)
+        self.split_history_budget()
+        self.changed()
+
+    # function that removes the active layer, the last layer cannot be removed
+    def remove(self):
+        if len(self.layers) == 1:
+            return
+        del self.layers[self.active]
+        self.active = max(0, self.active - 1)
+        self.split_history_budget()
+        self.changed()
+
+    # function that moves the active layer up or down by an offset
+    def move(self, offset):
+        index = self.active + offset
+        if not 0 <= index < len(self.layers):
+            return
+        self.layers[self.active], self.layers[index] = self.layers[index], self.layers[self.active]
+        self.active = index
+        self.changed()
+
+    # function that returns the composited tile of the visible layers below the active layer
+    def below_tile(self, key):
+        layers = [layer for layer in self.layers[:self.active] if layer.visible]
+        if key is not None and not any(key in layer.canvas.tiles for layer in layers):
+            key = None
+        tile = self.below.get(key)
+        if tile is None:
+            tile = QImage(TILE_SIZE, TILE_SIZE, QImage.Format_RGB32)
+            tile.fill(Qt.white)
+            painter = QPainter(tile)
+            for layer in layers:
+                layer.blend(painter, key, tile.rect())
+            painter.end()
+            self.below[key] = tile
+        return tile
+
+    # function that returns the composited tile of the visible layers above the active layer, all in normal mode
+    def above_tile(self, key, layers):
+        if key is not None and not any(key in layer.canvas.tiles for layer in layers):
+            key = None
+        tile = self.above.get(key)
+        if tile is None:
+            tile = QImage(TILE_SIZE, TILE_SIZE, QImage.Format_ARGB32_Premultiplied)
+            tile.fill(Qt.transparent)
+            painter = QPainter(tile)
+            for layer in layers:
+                layer.blend(painter, key, tile.rect())
+            painter.end()
+            self.above[key] = tile
+        return tile
+
+    # function that composites a part of a tile of the picture, or a new tile when none is given. The None key
+    # composites the blank tiles of the layers.
+    def compose(self, key, tile=None, part=None):
+        if tile is None:
+            tile = QImage(TILE_SIZE, TILE_SIZE, QImage.Format_RGB32)
+            part = tile.rect()
+        painter = QPainter(tile)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.drawImage(part.topLeft(), self.below_tile(key), part)
+        layer = self.active_layer()
+        if layer.visible:
+            layer.blend(painter, key, part)
+        above = [layer for layer in self.layers[self.active + 1:] if layer.visible]
+        if len(above) > 1 and all(layer.blend_mode == QPainter.CompositionMode_SourceOver for layer in above):
+            painter.setOpacity(1.0)
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+            painter.drawImage(part.topLeft(), self.above_tile(key, above), part)
+        else:
+            for layer in above:
+                layer.blend(painter, key, part)
+        painter.end()
+        return tile
+
+    # function that returns the picture as a sheet sharing the composited tiles
+    def flatten(self):
+        if self.plain():
+            return self.layers[0].canvas.snapshot()
+        canvas = TiledImage(self.composite.width, self.composite.height)
+        canvas.blank = self.composite.blank
+        keys = set().union(*(layer.canvas.tiles for layer in self.layers if layer.visible))
+        canvas.tiles = {key: QImage(self.composite.tile(key)) for key in keys}
+        return canvas
+
+    # function that rasterizes the picture from the stroke logs of the layers, the result is scaled by a factor
+    def rasterize(self, scale=1.0):
+        if self.plain():
+            return self.layers[0].log.rasterize(scale)
+        return LayerStack([layer.rasterized(scale) for layer in self.layers]).flatten()
+
+
+# brush size from which the strokes are rasterized in a worker thread, the smaller brushes rasterize in less time than
+# the tiles they modify take to be copied to the GUI thread
+STROKE_WORKER_BRUSH_SIZE = 12
+
+
+# This class rasterizes a stroke in a worker thread, so that the event loop keeps handling the input while a large
+# brush is drawn. The worker owns a snapshot of the sheet, on which a stroke session draws the paths sent by the GUI
+# thread, copying each tile the first time it writes on it. The modified tiles are published as copies that the GUI
+# thread installs in the sheet. The paths are drawn in the order and grouping they are sent, as the GUI thread would
+# draw them, so the pixels are identical.
+class StrokeWorker(QThread):
+    # signal emitted when modified tiles have been published
+    rasterized = pyqtSignal()
+
+    def __init__(self, canvas, brush, mode):
+        super().__init__()
+        self.session = stroke_session(canvas.snapshot(), brush, mode)
+        self.record = self.session.record
+
+        # paths to draw with the pressures on their points, None ends the stroke
+        self.paths = queue.Queue()
+
+        # copies of the tiles modified since the GUI thread took them and the area they cover, guarded by the lock
+        self.lock = threading.Lock()
+        self.published = {}
+        self.published_rect = QRect()
+
+        # keys of the tiles drawn by the stroke, known once the worker has ended
+        self.keys = []
+
+    # function that sends a segment of the stroke to the worker, the area modified is known once it is published
+    def draw_line(self, from_point, to_point, pressures=None):
+        path = QPainterPath(from_point)
+        path.lineTo(to_point)
+        return self.draw_path(path, pressures)
+
+    # function that sends a path to the worker, the area modified is known once it is published
+    def draw_path(self, path, pressures=None):
+        self.paths.put((path, pressures))
+        return QRect()
+
+    # function run by the worker thread
+    def run(self):
+        canvas = self.session.canvas
+        while True:
+            item = self.paths.get()
+            if item is None:
+                break
+            try:
+                rect = self.session.draw_path(*item)
+                painters = self.session.painters
+                tiles = {key: canvas.tiles[key].copy() for key in canvas.keys_in(rect) if key in painters}
+                with self.lock:
+                    self.published.update(tiles)
+                    self.published_rect |= rect
+            finally:
+                self.paths.task_done()
+            self.rasterized.emit()
+        self.keys = list(self.session.painters)
+        self.session.end()
+        self.paths.task_done()
+
+    # function that returns the tiles published since the last call and the area they cover
+    def take(self):
+        with self.lock:
+            tiles, rect = self.published, self.published_rect
+            self.published = {}
+            self.published_rect = QRect()
+        return tiles, rect
+
+    # function that waits until the paths sent have been drawn and published
+    def sync(self):
+        self.paths.join()
+
+    # function that ends the stroke, returns the tiles drawn, owned by the sheet from then on, and the area modified
+    # since the last tiles taken
+    def finish(self):
+        self.paths.put(None)
+        self.wait()
+        _, rect = self.take()
+        return {key: self.session.canvas.tiles[key] for key in self.keys}, rect
+
+
+# This class saves a snapshot of the sheet in a worker thread. The image is encoded to a temporary file which
+# replaces the destination once complete, so a cancelled save leaves the destination untouched.
+class SaveWorker(QThread):
+    # signal emitted with the percentage of the save already done
+    progress = pyqtSignal(int)
+
+    def __init__(self, snapshot, file_path):
+        super().__init__()
+        self.snapshot = snapshot
+        self.file_path = file_path
+
+        # error message, None if the save succeeded
+        self.error = None
+
+    # function run by the worker thread
+    def run(self):
+        canvas = self.snapshot
+        image = QImage(canvas.width, canvas.height, QImage.Format_RGB32)
+        painter = QPainter(image)
+        rows = (canvas.height + TILE_SIZE - 1) // TILE_SIZE
+        for row in range(rows):
+            if self.isInterruptionRequested():
+                painter.end()
+                self.error = "cancelled"
+                return
+            canvas.draw(painter, QRect(0, row * TILE_SIZE, canvas.width, TILE_SIZE))
+            self.progress.emit(50 * (row + 1) // rows)
+        painter.end()
+
+        temporary_path = self.file_path + ".part"
+        writer = QImageWriter(temporary_path, QFileInfo(self.file_path).suffix().lower().encode())
+        if not writer.write(image):
+            self.error = writer.errorString()
+        elif self.isInterruptionRequested():
+            self.error = "cancelled"
+        else:
+            try:
+                os.replace(temporary_path, self.file_path)
+            except OSError as error:
+                self.error = str(error)
+        if self.error is not None and os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        self.progress.emit(100)
+
+
+# This class measures the longest time the GUI thread spends without processing its events, while it is started.
+class StallMonitor(QObject):
+    def __init__(self, interval=5):
+        super().__init__()
+        self.interval = interval
+        self.longest = 0
+        self.clock = QElapsedTimer()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+
+    # function that starts measuring, the longest stall is reset
+    def start(self):
+        self.longest = 0
+        self.clock.start()
+        self.timer.start(self.interval)
+
+    # function called by the timer, a late call means that the event loop has been blocked
+    def tick(self):
+        self.longest = max(self.longest, self.clock.restart() - self.interval)
+
+    # function that stops measuring
+    def stop(self):
+        self.timer.stop()
+
+
+# This class runs the saves one after the other in worker threads. Saving again to a file that is being saved
+# cancels the running save, saves to other files are queued.
+class BackgroundSaver(QObject):
+    # signal emitted with the percentage of the running save already done
+    progress = pyqtSignal(int)
+    # signal emitted when a save ends with the file path, the error message or an empty string, and the longest
+    # stall of the GUI thread in milliseconds during the save
+    saved = pyqtSignal(str, str, int)
+
+    def __init__(self):
+        super().__init__()
+        self.worker = None
+        self.queue = []
+        self.monitor = StallMonitor()
+
+    # function that saves a snapshot of the sheet to a file
+    def save(self, snapshot, file_path):
+        if self.worker is not None and self.worker.file_path == file_path:
+            self.worker.requestInterruption()
+        self.queue = [job for job in self.queue if job[1] != file_path]
+        self.queue.append((snapshot, file_path))
+        if self.worker is None:
+            self.start_next()
+
+    # function that starts the next queued save
+    def start_next(self):
+        snapshot, file_path = self.queue.pop(0)
+        self.worker = SaveWorker(snapshot, file_path)
+        self.worker.progress.connect(self.progress)
+        self.worker.finished.connect(partial(self.worker_finished, self.worker))
+        self.monitor.start()
+        self.worker.start()
+
+    # function called in the GUI thread when a worker thread has finished, the next queued save is started before the
+    # end of the save is signaled. The finished signal of a worker already handled by finish() is ignored.
+    def worker_finished(self, worker):
+        if worker is not self.worker:
+            return
+        self.worker = None
+        self.monitor.stop()
+        longest = self.monitor.longest
+        if self.queue:
+            self.start_next()
+        self.saved.emit(worker.file_path, worker.error or "", longest)
+
+    # function that waits for the running save and runs the queued ones, used before quitting
+    def finish(self):
+        while self.worker is not None:
+            self.worker.wait()
+            self.worker_finished(self.worker)
+
+
+# kinds of base a journal file applies to: a blank sheet, the checkpoint of the previous generation, or the state
+# left by the journal of the previous generation
+JOURNAL_BASE_BLANK = 0
+JOURNAL_BASE_CHECKPOINT = 1
+JOURNAL_BASE_CONTINUE = 2
+# header of the journal files: magic, generation, kind of base, width and height of the sheet
+JOURNAL_MAGIC = b"PJRN"
+JOURNAL_HEADER = struct.Struct("<4sIBII")
+# one byte records of the journal, the other records use the binary form of the stroke log records
+JOURNAL_UNDO = 2
+JOURNAL_REDO = 3
+
+# Windows access right querying the exit code of a process, exit code of a process still running, and error of a
+# process existing but not opened to us
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+STILL_ACTIVE = 259
+ERROR_ACCESS_DENIED = 5
+
+
+# function that returns True if a process is running. On Windows os.kill terminates the process instead of probing
+# it, the exit code of the process is queried instead.
+def process_running(pid):
+    if sys.platform == "win32":
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.OpenProcess.restype = ctypes.c_void_p
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+        code = ctypes.c_ulong()
+        queried = kernel32.GetExitCodeProcess(ctypes.c_void_p(handle), ctypes.byref(code))
+        kernel32.CloseHandle(ctypes.c_void_p(handle))
+        return not queried or code.value == STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+# This class writes a checkpoint of the sheet to a project file in a worker thread.
+class CheckpointWorker(QThread):
+    def __init__(self, snapshot, file_path, generation):
+        super().__init__()
+        self.snapshot = snapshot
+        self.file_path = file_path
+        self.generation = generation
+        self.error = None
+
+    # function run by the worker thread
+    def run(self):
+        try:
+            ProjectFile.save(self.snapshot, self.file_path)
+        except OSError as error:
+            self.error = str(error)
+
+
+# This class writes the actions made on the sheet to an append-only journal, so that they can be recovered after a
+# crash. The records are buffered and written with a single write and fsync per flush interval. When the journal
+# grows too large, a checkpoint of the sheet is written to a project file in the background and a new journal
+# generation is started, so that recovering replays at most one checkpoint interval of actions. A lock file holding
+# the pid of the program tells on startup whether the last session ended cleanly.
+class Journal(QObject):
+    def __init__(self, directory, painter, flush_interval=1000, checkpoint_size=4 * 2 ** 20):
+        super().__init__()
+        self.directory = directory
+        self.painter = painter
+        self.checkpoint_size = checkpoint_size
+        self.lock_path = os.path.join(directory, "session.lock")
+
+        # current generation, its file and the records not written yet
+        self.generation = max(Journal.generations(directory, "journal") + Journal.generations(directory, "checkpoint")
+                              + [0])
+        self.file = None
+        self.buffer = bytearray()
+
+        # bytes journaled since the last checkpoint and changes journaled since then, only those can be undone or
+        # redone by replaying the journal
+        self.size = 0
+        self.changes = weakref.WeakSet()
+
+        # checkpoint being written and checkpoints waiting for it
+        self.worker = None
+        self.queue = []
+
+        # True when an action that the records cannot replay has been made since the last checkpoint
+        self.stale = False
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(self.tick)
+        self.flush_timer.start(flush_interval)
+
+    # function that returns the generations of the files of a kind present in the directory, or of the files with a
+    # suffix added to their name, such as the .part files of the checkpoints being written
+    @staticmethod
+    def generations(directory, kind, suffix=""):
+        pattern = re.compile(kind + r"-(\d{8})\." + ("paint" if kind == "checkpoint" else "bin") + re.escape(suffix))
+        names = os.listdir(directory) if os.path.isdir(directory) else []
+        return sorted(int(match.group(1)) for match in map(pattern.fullmatch, names) if match is not None)
+
+    # function that returns the path of a file of a kind and a generation
+    def path(self, kind, generation):
+        extension = ".paint" if kind == "checkpoint" else ".bin"
+        return os.path.join(self.directory, kind + "-" + format(generation, "08d") + extension)
+
+    # function that returns True if the lock file of the directory belongs to a program that is still running
+    @staticmethod
+    def locked(directory):
+        try:
+            with open(os.path.join(directory, "session.lock")) as file:
+                pid = int(file.read())
+        except (OSError, ValueError):
+            return False
+        if pid == os.getpid():
+            return False
+        return process_running(pid)
+
+    # function that returns True if the last session using the directory did not end cleanly
+    @staticmethod
+    def unclean(directory):
+        return os.path.exists(os.path.join(directory, "session.lock")) and not Journal.locked(directory)
+
+    # function that rebuilds the sheet from the last checkpoint and the journals following it. Returns the sheet, its
+    # log and its history, or None if there is nothing to recover. Replaying stops at the first truncated record.
+    @staticmethod
+    def recover(directory):
+        checkpoints = Journal.generations(directory, "checkpoint")
+        journals = Journal.generations(directory, "journal")
+        canvas = log = None
+        history = History()
+        generation = min(journals) if journals else None
+        if checkpoints:
+            checkpoint = checkpoints[-1]
+            try:
+                canvas = ProjectFile.load(os.path.join(directory, "checkpoint-" + format(checkpoint, "08d") + ".paint"))
+                canvas.project = None
+                log = StrokeLog(canvas.width, canvas.height, canvas.snapshot())
+                generation = checkpoint + 1
+            except (OSError, ValueError):
+                canvas = None
+        while generation in journals:
+            with open(os.path.join(directory, "journal-" + format(generation, "08d") + ".bin"), "rb") as file:
+                data = file.read()
+            if len(data) < JOURNAL_HEADER.size:
+                break
+            magic, _, base, width, height = JOURNAL_HEADER.unpack_from(data)
+            if magic != JOURNAL_MAGIC:
+                break
+            if base == JOURNAL_BASE_BLANK:
+                canvas = TiledImage(width, height)
+                log = StrokeLog(width, height)
+                history = History()
+            elif canvas is None or (base == JOURNAL_BASE_CHECKPOINT and generation - 1 not in checkpoints[-1:]):
+                # the checkpoint this journal applies to has not been completely written
+                break
+            if not Journal.replay(data, canvas, log, history):
+                break
+            generation += 1
+        if canvas is None:
+            return None
+        return canvas, log, history
+
+    # function that replays the records of a journal file on a sheet, returns False if a record is truncated
+    @staticmethod
+    def replay(data, canvas, log, history):
+        offset = JOURNAL_HEADER.size
+        while offset < len(data):
+            if data[offset] == JOURNAL_UNDO:
+                if history.undo(canvas) is not None:
+                    log.undo()
+                offset += 1
+            elif data[offset] == JOURNAL_REDO:
+                if history.redo(canvas) is not None:
+                    log.redo()
+                offset += 1
+            else:
+                try:
+                    record, offset = decode_record(data, offset)
+                except ValueError:
+                    return False
+                canvas.begin_change()
+                record.replay(canvas)
+                change = canvas.end_change()
+                if change is not None:
+                    history.push(change)
+                    log.push(record)
+        return True
+
+    # function that starts journaling the sheet of the painter, from a blank sheet or from a checkpoint of it
+    def start(self, blank):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "w") as file:
+            file.write(str(os.getpid()))
+        if blank:
+            self.remove_files(self.generation + 1)
+            self.rotate(JOURNAL_BASE_BLANK)
+        else:
+            self.checkpoint(JOURNAL_BASE_CHECKPOINT)
+
+    # function that starts a new generation, the sheet opened from a file becomes the base of the journal
+    def reset(self):
+        self.checkpoint(JOURNAL_BASE_CHECKPOINT)
+
+    # function that journals an action made on the sheet
+    def append(self, record, change):
+        data = record.encode()
+        self.buffer += data
+        self.size += len(data)
+        self.changes.add(change)
+        if self.size > self.checkpoint_size:
+            self.checkpoint(JOURNAL_BASE_CONTINUE)
+
+    # function that journals an undo, undoing a change older than the last checkpoint needs a new checkpoint
+    def undo(self, change):
+        self.history_action(JOURNAL_UNDO, change)
+
+    # function that journals a redo, redoing a change older than the last checkpoint needs a new checkpoint
+    def redo(self, change):
+        self.history_action(JOURNAL_REDO, change)
+
+    # function that journals an undo or a redo
+    def history_action(self, action, change):
+        if change in self.changes:
+            self.buffer.append(action)
+            self.size += 1
+        else:
+            self.checkpoint(JOURNAL_BASE_CONTINUE)
+
+    # function that journals an action that the records cannot replay, such as an action on a layer. The sheet is
+    # checkpointed at the next flush, so that a series of actions is checkpointed once.
+    def changed(self):
+        self.stale = True
+
+    # function called every flush interval, checkpoints the sheet after an action the records cannot replay once the
+    # previous checkpoint is written, then writes the buffered records
+    def tick(self):
+        if self.stale and self.worker is None:
+            self.checkpoint(JOURNAL_BASE_CHECKPOINT)
+        self.flush()
+
+    # function that writes the buffered records with a single write and fsync
+    def flush(self):
+        if not self.buffer or self.file is None:
+            return
+        self.file.write(self.buffer)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = bytearray()
+
+    # function that ends the current generation and starts a new journal file
+    def rotate(self, base):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+        self.generation += 1
+        self.file = open(self.path("journal", self.generation), "wb")
+        self.file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, self.generation, base, self.painter.canvas.width,
+                                            self.painter.canvas.height))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size = 0
+        self.changes = weakref.WeakSet()
+
+    # function that writes a checkpoint of the sheet in the background, the journal continues in a new generation
+    def checkpoint(self, base):
+        snapshot = self.painter.snapshot()
+        self.stale = False
+        self.rotate(base)
+        self.queue.append(CheckpointWorker(snapshot, self.path("checkpoint", self.generation - 1),
+                                           self.generation - 1))
+        if self.worker is None:
+            self.start_next()
+
+    # function that starts the next queued checkpoint
+    def start_next(self):
+        self.worker = self.queue.pop(0)
+        self.worker.finished.connect(self.checkpoint_finished)
+        self.worker.start()
+
+    # function called in the GUI thread when a checkpoint has been written, the files it replaces are removed
+    def checkpoint_finished(self):
+        worker = self.worker
+        self.worker = None
+        if worker.error is not None:
+            print("Cannot write checkpoint: " + worker.error)
+        else:
+            self.remove_files(worker.generation)
+        if self.queue:
+            self.start_next()
+
+    # function that removes the checkpoints older than a generation and the journals up to it, with the partial
+    # checkpoints up to it left by an interrupted write. No checkpoint is being written when it is called.
+    def remove_files(self, generation):
+        for checkpoint in Journal.generations(self.directory, "checkpoint"):
+            if checkpoint < generation:
+                os.remove(self.path("checkpoint", checkpoint))
+        for checkpoint in Journal.generations(self.directory, "checkpoint", ".part"):
+            if checkpoint <= generation:
+                os.remove(self.path("checkpoint", checkpoint) + ".part")
+        for journal in Journal.generations(self.directory, "journal"):
+            if journal <= generation:
+                os.remove(self.path("journal", journal))
+
+    # function that ends the session cleanly, nothing is left to recover
+    def close(self):
+        self.flush_timer.stop()
+        if self.worker is not None:
+            self.worker.wait()
+        self.queue = []
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.remove_files(self.generation + 1)
+        if os.path.exists(self.lock_path):
+            os.remove(self.lock_path)
+
+
+# greeting sent by the mirror to each viewer: magic and version of the protocol
+MIRROR_MAGIC = b"PMIR"
+MIRROR_HELLO = struct.Struct("<4sH")
+# header of the batches of messages: byte length of the messages and time the oldest input they carry was received,
+# from time.perf_counter of the mirror, which viewers on the same machine can compare to their own
+MIRROR_BATCH = struct.Struct("<Id")
+# messages, a type byte followed by their fields. A sheet message replaces the picture by a blank sheet of a size and
+# tile format, the tiles message following it fills the sheet.
+MIRROR_SHEET = 0
+MIRROR_TILES = 1
+MIRROR_BRUSH = 2
+MIRROR_BEGIN = 3
+MIRROR_PATH = 4
+MIRROR_END = 5
+MIRROR_RECORD = 6
+MIRROR_SHEET_MESSAGE = struct.Struct("<BIIB")
+MIRROR_TILES_MESSAGE = struct.Struct("<BI")
+MIRROR_BRUSH_MESSAGE = struct.Struct("<BfIBBBBfff")
+MIRROR_BEGIN_MESSAGE = struct.Struct("<BB")
+# tile of a tiles message: column, row and length of the compressed pixels, empty for a tile using the blank tile.
+# The column -1 stands for the blank tile.
+MIRROR_TILE = struct.Struct("<hhI")
+# formats of the tiles of the sheets sent, opaque or with transparency
+MIRROR_TILE_FORMATS = (QImage.Format_RGB32, QImage.Format_ARGB32_Premultiplied)
+# the points of the paths are sent in 1/256 of pixel and the pressures in 1/65535, as differences with the previous
+# point of the stroke, so a move of less than 32 pixels takes two bytes per coordinate and a constant pressure one
+MIRROR_POINT_SCALE = 256
+MIRROR_PRESSURE_SCALE = 65535
+
+# size in bytes of the data waiting to be sent to a viewer from which it is dropped, it gets a snapshot if it joins
+# again
+MIRROR_MAX_BACKLOG = 64 * 2 ** 20
+
+
+# function that parses the address of a mirror: the path of a Unix socket when it contains a slash, host:port
+# otherwise. Returns the host, None for a Unix socket, and the port or the path. Raises ValueError if invalid.
+def mirror_address(text):
+    if "/" in text:
+        return None, text
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+# function that appends a signed integer to a buffer as a zigzag varint: 7 bits per byte, so the small differences
+# between the points of a path take one or two bytes
+def write_varint(buffer, value):
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+# function that reads a zigzag varint at an offset of a buffer, returns the integer and the offset after it
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return (value >> 1) if not value & 1 else -(value >> 1) - 1, offset
+
+
+# function that returns the message of tiles replacing the tiles of the viewers, and their blank tile if not None. A
+# tile None uses the blank tile.
+def encode_mirror_tiles(blank, tiles):
+    parts = [MIRROR_TILES_MESSAGE.pack(MIRROR_TILES, len(tiles) + (blank is not None))]
+    for (column, row), tile in ([((-1, -1), blank)] if blank is not None else []) + list(tiles.items()):
+        data = b"" if tile is None else zlib.compress(tile_bytes(tile), 1)
+        parts.append(MIRROR_TILE.pack(column, row, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+# function that returns the messages replacing the picture of the viewers by a sheet
+def encode_mirror_snapshot(canvas):
+    return (MIRROR_SHEET_MESSAGE.pack(MIRROR_SHEET, canvas.width, canvas.height, int(canvas.blank.format()))
+            + encode_mirror_tiles(canvas.blank, canvas.tiles))
+
+
+# This class decodes the batches of messages received by a viewer. It keeps the previous point of the stroke, from
+# which the points are sent as differences, and the format of the tiles of the sheet.
+class MirrorDecoder:
+    def __init__(self):
+        self.previous = (0, 0, 0)
+        self.format = QImage.Format_RGB32
+
+    # function that decodes a batch, returns its messages as tuples starting with their type. Raises ValueError if
+    # the batch is corrupt.
+    def decode(self, data):
+        messages = []
+        offset = 0
+        try:
+            while offset < len(data):
+                kind = data[offset]
+                if kind == MIRROR_SHEET:
+                    _, width, height, tile_format = MIRROR_SHEET_MESSAGE.unpack_from(data, offset)
+                    offset += MIRROR_SHEET_MESSAGE.size
+                    if not 0 < width <= 2 ** 16 or not 0 < height <= 2 ** 16 or tile_format not in MIRROR_TILE_FORMATS:
+                        raise ValueError("invalid sheet message")
+                    self.format = QImage.Format(tile_format)
+                    messages.append((kind, width, height, self.format))
+                elif kind == MIRROR_TILES:
+                    _, count = MIRROR_TILES_MESSAGE.unpack_from(data, offset)
+                    offset += MIRROR_TILES_MESSAGE.size
+                    blank = None
+                    tiles = {}
+                    for _ in range(count):
+                        column, row, length = MIRROR_TILE.unpack_from(data, offset)
+                        offset += MIRROR_TILE.size + length
+                        tile = None
+                        if length:
+                            pixels = zlib.decompress(data[offset - length:offset])
+                            if len(pixels) != TILE_SIZE * TILE_SIZE * 4:
+                                raise ValueError("invalid tile")
+                            tile = QImage(pixels, TILE_SIZE, TILE_SIZE, self.format).copy()
+                        if column == -1:
+                            blank = tile
+                        else:
+                            tiles[(column, row)] = tile
+                    messages.append((kind, blank, tiles))
+                elif kind == MIRROR_BRUSH:
+                    _, size, color, line_type, cap_type, join_type, engine, hardness, opacity, spacing = \
+                        MIRROR_BRUSH_MESSAGE.unpack_from(data, offset)
+                    offset += MIRROR_BRUSH_MESSAGE.size
+                    if line_type not in LINE_TYPES or cap_type not in CAP_TYPES or join_type not in JOIN_TYPES \
+                            or not 0 < size <= 1000:
+                        raise ValueError("invalid brush message")
+                    messages.append((kind, BrushSpec(size, color, Qt.PenStyle(line_type), Qt.PenCapStyle(cap_type),
+                                                     Qt.PenJoinStyle(join_type), BrushEngine(engine), hardness,
+                                                     opacity, spacing)))
+                elif kind == MIRROR_BEGIN:
+                    _, mode = MIRROR_BEGIN_MESSAGE.unpack_from(data, offset)
+                    offset += MIRROR_BEGIN_MESSAGE.size
+                    self.previous = (0, 0, 0)
+                    messages.append((kind, DrawMode(mode)))
+                elif kind == MIRROR_PATH:
+                    count, offset = read_varint(data, offset + 1)
+                    if count < 1:
+                        raise ValueError("empty path")
+                    path = QPainterPath()
+                    pressures = array("f")
+                    x, y, pressure = self.previous
+                    for i in range(count):
+                        dx, offset = read_varint(data, offset)
+                        dy, offset = read_varint(data, offset)
+                        dp, offset = read_varint(data, offset)
+                        x, y, pressure = x + dx, y + dy, pressure + dp
+                        point = QPointF(x / MIRROR_POINT_SCALE, y / MIRROR_POINT_SCALE)
+                        if i == 0:
+                            path.moveTo(point)
+                        else:
+                            path.lineTo(point)
+                        pressures.append(pressure / MIRROR_PRESSURE_SCALE)
+                    self.previous = (x, y, pressure)
+                    messages.append((kind, path, pressures))
+                elif kind == MIRROR_END:
+                    offset += 1
+                    messages.append((kind,))
+                elif kind == MIRROR_RECORD:
+                    record, offset = decode_record(data, offset + 1)
+                    messages.append((kind, record))
+                else:
+                    raise ValueError("unknown message type " + str(kind))
+        except (struct.error, IndexError, zlib.error) as error:
+            raise ValueError("truncated message") from error
+        if offset != len(data):
+            raise ValueError("truncated message")
+        return messages
+
+
+# This class runs the server of the mirror in a thread, with an asyncio event loop. The GUI thread hands it the
+# batches to send to the viewers. A viewer connecting waits for a snapshot of the picture, the GUI thread takes it
+# when asked by the joined signal, then the viewer receives the batches following the snapshot.
+class MirrorServer(QThread):
+    # signal emitted when viewers have connected and wait for a snapshot
+    joined = pyqtSignal()
+
+    def __init__(self, address):
+        super().__init__()
+        self.host, self.port = mirror_address(address)
+        self.loop = None
+
+        # set once the server listens or has failed to, with the error
+        self.ready = threading.Event()
+        self.error = None
+
+        # writers of the viewers receiving the batches, and of the viewers waiting for a snapshot
+        self.viewers = []
+        self.waiting = []
+
+        # number of bytes sent to the viewers
+        self.bytes_sent = 0
+
+    # function that returns the address the server listens on
+    def address(self):
+        return self.port if self.host is None else self.host + ":" + str(self.port)
+
+    # function run by the worker thread
+    def run(self):
+        asyncio.run(self.serve())
+
+    # coroutine that listens until the server is stopped
+    async def serve(self):
+        # the event exists before the loop is published, stop() uses both
+        self.stopping = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        try:
+            if self.host is None:
+                server = await asyncio.start_unix_server(self.connected, self.port)
+            else:
+                server = await asyncio.start_server(self.connected, self.host, self.port)
+                self.port = server.sockets[0].getsockname()[1]
+        except OSError as error:
+            self.error = str(error)
+            self.ready.set()
+            return
+        self.ready.set()
+        async with server:
+            await self.stopping.wait()
+        for writer in self.viewers + self.waiting:
+            writer.close()
+
+    # coroutine handling the connection of a viewer, the viewer sends nothing and the connection ends when it closes
+    async def connected(self, reader, writer):
+        writer.write(MIRROR_HELLO.pack(MIRROR_MAGIC, 1))
+        self.waiting.append(writer)
+        self.joined.emit()
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        self.drop(writer)
+
+    # function that stops sending to a viewer
+    def drop(self, writer):
+        for writers in (self.viewers, self.waiting):
+            if writer in writers:
+                writers.remove(writer)
+        writer.close()
+
+    # function that writes data to viewers, dropping the ones that do not read fast enough
+    def write(self, writers, data):
+        for writer in list(writers):
+            if writer.transport.get_write_buffer_size() > MIRROR_MAX_BACKLOG:
+                self.drop(writer)
+                continue
+            writer.write(data)
+            self.bytes_sent += len(data)
+
+    # function that returns a batch made of messages, each message is bytes or a function encoding it. The
+    # functions are called in the thread of the server, so the tiles are compressed outside the GUI thread.
+    @staticmethod
+    def batch(messages, input_time):
+        data = b"".join(message() if callable(message) else message for message in messages)
+        return MIRROR_BATCH.pack(len(data), input_time) + data
+
+    # function that sends a batch to the viewers, from the GUI thread
+    def send(self, messages, input_time):
+        self.loop.call_soon_threadsafe(lambda: self.write(self.viewers, self.batch(messages, input_time)))
+
+    # function that sends a snapshot of the picture to the waiting viewers, from the GUI thread. The viewers then
+    # receive the batches sent after it.
+    def welcome(self, canvas):
+        self.loop.call_soon_threadsafe(self.send_snapshot, canvas)
+
+    # function that sends a snapshot to the waiting viewers, in the thread of the server
+    def send_snapshot(self, canvas):
+        if self.waiting:
+            self.write(self.waiting, self.batch([partial(encode_mirror_snapshot, canvas)], time.perf_counter()))
+            self.viewers.extend(self.waiting)
+            self.waiting = []
+
+    # function that stops the server and waits for its thread, from the GUI thread
+    def stop(self):
+        if self.isRunning():
+            self.ready.wait()
+        if self.loop is not None and self.error is None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        self.wait()
+
+
+# This class publishes the drawing session to the viewers of a mirror server, as a stream of compact messages rather
+# than images. When the picture is a single plain layer, the strokes are sent segment by segment as they are
+# rasterized, and the other actions as their records, which the viewers replay. Otherwise, like after an undo or a
+# redo, the tiles of the picture modified by each action are sent, and a snapshot when the whole picture changes. The
+# messages are sent in batches, once the event being handled is done.
+class Mirror(QObject):
+    def __init__(self, painter, server):
+        super().__init__()
+        self.painter = painter
+        self.server = server
+        server.joined.connect(self.join)
+
+        # messages waiting to be sent and time the oldest input they carry was received
+        self.messages = []
+        self.input_time = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.flush)
+
+        # brush of the last stroke sent, True while a stroke is sent segment by segment, and the previous point of
+        # the stroke sent, in the units of the protocol
+        self.brush = None
+        self.streaming = False
+        self.previous = (0, 0, 0)
+
+        # True when viewers wait for a snapshot, taken once the stroke in progress ends
+        self.joining = False
+
+    # function that queues a message, the input it carries was received at a time, now when None
+    def add(self, message, input_time=None):
+        if not self.messages:
+            self.timer.start()
+        self.messages.append(message)
+        input_time = time.perf_counter() if input_time is None else input_time
+        self.input_time = input_time if self.input_time is None else min(self.input_time, input_time)
+
+    # function that sends the queued messages as a batch
+    def flush(self):
+        if self.messages:
+            self.server.send(self.messages, self.input_time)
+            self.messages = []
+            self.input_time = None
+
+    # function called when viewers connect, they get a snapshot once no stroke is in progress. The brush is sent
+    # again with the next stroke since the new viewers start with the default brush.
+    def join(self):
+        if self.painter.stroke is not None:
+            self.joining = True
+            return
+        self.joining = False
+        self.brush = None
+        self.flush()
+        self.server.welcome(self.painter.snapshot())
+
+    # function that sends a snapshot of the picture to the viewers, when the whole picture changed
+    def reset(self):
+        self.add(partial(encode_mirror_snapshot, self.painter.snapshot()))
+
+    # function that starts sending a stroke, segment by segment when the picture is a single plain layer
+    def begin_stroke(self, brush, mode):
+        self.streaming = self.painter.layers.plain()
+        if not self.streaming:
+            return
+        if brush != self.brush:
+            self.add(MIRROR_BRUSH_MESSAGE.pack(MIRROR_BRUSH, brush.size, brush.color, brush.line_type,
+                                               brush.cap_type, brush.join_type, brush.engine.value, brush.hardness,
+                                               brush.opacity, brush.spacing))
+            self.brush = brush
+        self.add(MIRROR_BEGIN_MESSAGE.pack(MIRROR_BEGIN, mode.value))
+        self.previous = (0, 0, 0)
+
+    # function that sends a path of the stroke and the pressures on its points, the first input of the path was
+    # received at a time
+    def path(self, path, pressures=None, input_time=None):
+        if not self.streaming:
+            return
+        message = bytearray((MIRROR_PATH,))
+        write_varint(message, path.elementCount())
+        previous_x, previous_y, previous_pressure = self.previous
+        for i in range(path.elementCount()):
+            element = path.elementAt(i)
+            x = round(element.x * MIRROR_POINT_SCALE)
+            y = round(element.y * MIRROR_POINT_SCALE)
+            pressure = round((1.0 if pressures is None else pressures[i]) * MIRROR_PRESSURE_SCALE)
+            write_varint(message, x - previous_x)
+            write_varint(message, y - previous_y)
+            write_varint(message, pressure - previous_pressure)
+            previous_x, previous_y, previous_pressure = x, y, pressure
+        self.previous = (previous_x, previous_y, previous_pressure)
+        self.add(bytes(message), input_time)
+
+    # function that sends a segment of the stroke
+    def line(self, from_point, to_point, pressures=None):
+        path = QPainterPath(from_point)
+        path.lineTo(to_point)
+        self.path(path, pressures)
+
+    # function that ends the stroke, then sends the snapshot the viewers which connected during the stroke wait for
+    def end_stroke(self):
+        if self.streaming:
+            self.add(bytes((MIRROR_END,)))
+            self.streaming = False
+        if self.joining:
+            self.join()
+
+    # function that sends an action made on the sheet: its record when the picture is a single plain layer, the
+    # strokes being already sent, and the tiles it modified otherwise. A fill is sent as its tiles too, since it would
+    # spread differently over the rounding differences of the strokes drawn by the viewers, and so are the moves and
+    # pastes of selections, which carry these differences along.
+    def changed(self, record, change):
+        if not self.painter.layers.plain() or isinstance(record, (FillRecord, MoveRecord, PasteRecord)):
+            self.swapped(change)
+        elif not isinstance(record, StrokeRecord):
+            self.add(bytes((MIRROR_RECORD,)) + record.encode())
+
+    # function that sends the tiles of the picture modified by a change, after it has been made, undone or redone
+    def swapped(self, change):
+        if change.rect() is None:
+            self.reset()
+            return
+        image = self.painter.layers.image()
+        tiles = {}
+        for key in change.tiles:
+            tile = image.tile(key)
+            tiles[key] = None if tile is image.blank else QImage(tile)
+        self.add(partial(encode_mirror_tiles, None, tiles))
+
+    # function that sends the messages waiting and stops the server
+    def close(self):
+        self.flush()
+        self.server.stop()
+
+
+# This class receives the stream of a mirror in a thread, with an asyncio event loop, and hands the decoded messages
+# of each batch to the GUI thread.
+class MirrorClient(QThread):
+    # signal emitted with the messages of each batch and the time the oldest input they carry was received
+    received = pyqtSignal(object, float)
+    # signal emitted with the reason when the connection ends
+    closed = pyqtSignal(str)
+
+    def __init__(self, address):
+        super().__init__()
+        self.host, self.port = mirror_address(address)
+        self.loop = None
+        self.task = None
+
+        # number of bytes received
+        self.bytes_received = 0
+
+    # function run by the worker thread
+    def run(self):
+        asyncio.run(self.receive())
+
+    # coroutine that receives the batches until the connection ends or the client is stopped
+    async def receive(self):
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        decoder = MirrorDecoder()
+        try:
+            if self.host is None:
+                reader, writer = await asyncio.open_unix_connection(self.port)
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            magic, version = MIRROR_HELLO.unpack(await reader.readexactly(MIRROR_HELLO.size))
+            if magic != MIRROR_MAGIC or version != 1:
+                raise ValueError("not a mirror")
+            while True:
+                try:
+                    length, input_time = MIRROR_BATCH.unpack(await reader.readexactly(MIRROR_BATCH.size))
+                except asyncio.IncompleteReadError:
+                    self.closed.emit("connection closed")
+                    break
+                data = await reader.readexactly(length)
+                self.bytes_received += MIRROR_BATCH.size + length
+                self.received.emit(decoder.decode(data), input_time)
+            writer.close()
+        except asyncio.CancelledError:
+            self.closed.emit("stopped")
+        except (OSError, ValueError, asyncio.IncompleteReadError) as error:
+            self.closed.emit(str(error))
+
+    # function that stops the client and waits for its thread, from the GUI thread
+    def stop(self):
+        if self.loop is not None and self.isRunning():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        self.wait()
+
+
+# This class applies the stream of a mirror to a painter in viewer mode: the strokes are drawn as their paths
+# arrive, the records replayed and the tiles installed. The delay from the input on the mirror to its display in the
+# viewer is recorded by the instrumentation of the painter.
+class MirrorViewer(QObject):
+    def __init__(self, painter, address):
+        super().__init__()
+        self.painter = painter
+        self.client = MirrorClient(address)
+        self.client.received.connect(self.apply)
+
+        # brush of the strokes and session of the stroke in progress
+        self.brush = BrushSpec(6, QColor(0, 0, 0).rgba(), Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+        self.session = None
+
+    # function that starts receiving the stream
+    def start(self):
+        self.client.start()
+
+    # function that stops receiving the stream
+    def stop(self):
+        self.client.stop()
+
+    # function that applies the messages of a batch
+    def apply(self, messages, input_time):
+        painter = self.painter
+        for message in messages:
+            kind = message[0]
+            if kind == MIRROR_SHEET:
+                self.replace_sheet(*message[1:])
+            elif kind == MIRROR_TILES:
+                _, blank, tiles = message
+                canvas = painter.canvas
+                rect = QRect()
+                for key, tile in tiles.items():
+                    if tile is None:
+                        canvas.tiles.pop(key, None)
+                    else:
+                        canvas.tiles[key] = tile
+                    rect |= canvas.tile_rect(key)
+                if blank is not None:
+                    canvas.blank = blank
+                    canvas.invalidate()
+                    painter.update()
+                else:
+                    canvas.invalidate(rect)
+                    painter.update_sheet(rect)
+            elif kind == MIRROR_BRUSH:
+                self.brush = message[1]
+            elif kind == MIRROR_BEGIN:
+                self.session = stroke_session(painter.canvas, self.brush, message[1])
+            elif kind == MIRROR_PATH and self.session is not None:
+                painter.update_sheet(self.session.draw_path(message[1], message[2]))
+            elif kind == MIRROR_END and self.session is not None:
+                self.session.end()
+                self.session = None
+            elif kind == MIRROR_RECORD:
+                message[1].replay(painter.canvas)
+                painter.update()
+        painter.perf.record("mirror latency", (time.perf_counter() - input_time) * 1000)
+
+    # function that replaces the sheet of the painter by a blank sheet, keeping the view if the size is the same. The
+    # blank tile and the tiles follow in a tiles message. A stroke in progress continues on the new sheet.
+    def replace_sheet(self, width, height, tile_format):
+        painter = self.painter
+        canvas = TiledImage(width, height)
+        keep_view = not painter.view_fitted and (width, height) == (painter.canvas.width, painter.canvas.height)
+        zoom, pan = painter.zoom, painter.pan
+        painter.set_canvas(canvas)
+        if keep_view:
+            painter.view_fitted = False
+            painter.set_view(zoom, pan)
+        if self.session is not None:
+            self.session.end()
+            self.session = stroke_session(canvas, self.session.brush, self.session.record.mode)
+
+
+# This class counts the pixels repainted per second by a widget.
+class RepaintCounter:
+    def __init__(self):
+        self.pixels = 0
+        self.pixels_per_second = 0
+        self.timer = QElapsedTimer()
+        self.timer.start()
+
+    # function that records a repainted rectangle and returns True when the rate has been refreshed
+    def add(self, rect):
+        self.pixels += rect.width() * rect.height()
+        elapsed = self.timer.elapsed()
+        if elapsed < 1000:
+            return False
+        self.pixels_per_second = self.pixels * 1000 // elapsed
+        self.pixels = 0
+        self.timer.restart()
+        return True
+
+
+# number of samples kept by each metric of the instrumentation
+METRIC_SAMPLES = 10000
+
+
+# This class keeps the measures of a metric: count, total, maximum and the last samples with their time.
+class Metric:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.samples = deque(maxlen=METRIC_SAMPLES)
+
+    # function that records a value
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+        self.samples.append((time.perf_counter(), value))
+
+    # function that returns the value under which fall p percents of the kept samples
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        values = sorted(value for _, value in self.samples)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    # function that returns the statistics of the metric
+    def summary(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99),
+                "max": self.maximum}
+
+
+# This class is the timer of a stage that records nothing, used while the instrumentation is disabled.
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+# This class measures in milliseconds one run of a stage of the paint pipeline.
+class StageTimer:
+    __slots__ = ("metric", "start")
+
+    def __init__(self, metric):
+        self.metric = metric
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metric.add((time.perf_counter() - self.start) * 1000)
+        return False
+
+
+# This class collects timers and counters on the stages of the paint pipeline. It is disabled by default: a stage
+# then returns a shared timer that does nothing and the other functions return after one test.
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}
+
+        # time of the oldest input not yet rasterized, and of the oldest input rasterized but not yet displayed
+        self.input_time = None
+        self.rasterized_time = None
+
+    # function that returns the metric of a name, created on first use
+    def metric(self, name):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Metric()
+        return metric
+
+    # function that returns a context manager timing a stage
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return StageTimer(self.metric(name))
+
+    # function that records a value of a metric
+    def record(self, name, value):
+        if self.enabled:
+            self.metric(name).add(value)
+
+    # function that marks the reception of an input
+    def input_received(self):
+        if self.enabled and self.input_time is None:
+            self.input_time = time.perf_counter()
+
+    # function that marks the rasterization of the inputs received
+    def input_rasterized(self):
+        if self.enabled and self.input_time is not None:
+            if self.rasterized_time is None:
+                self.rasterized_time = self.input_time
+            self.input_time = None
+
+    # function that marks the display of the inputs rasterized and records the input to pixel latency
+    def frame_presented(self):
+        if self.enabled and self.rasterized_time is not None:
+            self.metric("latency").add((time.perf_counter() - self.rasterized_time) * 1000)
+            self.rasterized_time = None
+
+    # function that forgets the measures
+    def reset(self):
+        self.metrics = {}
+        self.input_time = None
+        self.rasterized_time = None
+
+    # function that returns one line of statistics per metric, for the overlay
+    def report_lines(self):
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            summary = metric.summary()
+            lines.append(name + ": n=" + str(summary["count"]) + " mean=" + format(summary["mean"], ".2f")
+                         + " p95=" + format(summary["p95"], ".2f") + " max=" + format(summary["max"], ".2f"))
+        return lines
+
+    # function that exports the statistics and the samples of the metrics, in CSV when the path ends with .csv
+    # and in JSON otherwise
+    def export(self, file_path):
+        with open(file_path, "w", newline="") as file:
+            if file_path.lower().endswith(".csv"):
+                writer = csv.writer(file)
+                writer.writerow(["metric", "time", "value"])
+                for name, metric in sorted(self.metrics.items()):
+                    writer.writerows((name, format(when, ".6f"), value) for when, value in metric.samples)
+            else:
+                json.dump({name: dict(metric.summary(), samples=list(metric.samples))
+                           for name, metric in sorted(self.metrics.items())}, file, indent=1)
+
+
+# This class represents a rectangle selected on the sheet. Its pixels stay on the sheet until the selection is
+# dragged or pasted, they then float over the sheet as a view on the tiles they come from, and are drawn on the sheet
+# when the selection is anchored.
+class Selection:
+    def __init__(self, rect, source=None, origin=None):
+        # rectangle covered by the selection on the sheet, it follows the selection when it is dragged
+        self.rect = QRect(rect)
+
+        # view holding the floating pixels and their rectangle on it, None while the pixels are on the sheet
+        self.source = source
+        self.origin = origin
+
+        # rectangle the floating pixels were lifted from, erased when they are anchored, None for pasted pixels
+        self.lifted = None
+
+    # function that returns True if the pixels of the selection float over the sheet
+    def floating(self):
+        return self.source is not None
 
 
 # This class defines the widget that allows to paint in the central area of the window.
 class Painter(QWidget):
+    # signal emitted every second with the number of pixels repainted per second
+    repaint_rate_changed = pyqtSignal(int)
+    # signal emitted when the layers, the active layer or their blending settings change
+    layers_changed = pyqtSignal()
+
     def __init__(self):
         super().__init__()
 
         # init name and description
         self.setAccessibleName("Painter")
         self.setAccessibleDescription(
-            "This is the paint area. Allows the user to draw according to the selected options.")
+            "This is the paint area. Allows the user to draw according to the selected options. "
+            "Use the mouse wheel to scroll, ctrl + mouse wheel to zoom and the middle button to move the sheet.")
 
-        # init image that represents the "drawing sheet"
-        self.image = QImage(self.size(), QImage.Format_RGB32)
-        self.image.fill(Qt.white)
+        # init the layers of the picture, starting with a tiled image that represents the "drawing sheet" and the
+        # vector records of the actions made on it. The size of the sheet does not depend on the size of the widget.
+        self.layers = LayerStack([Layer("Background", TiledImage(1920, 1080), StrokeLog(1920, 1080))])
+
+        # init view transform: zoom factor and position of the sheet origin in the widget
+        self.zoom = 1.0
+        self.pan = QPointF()
+        self.view = QTransform()
+        self.view_fitted = True
+
+        # reference to the last position of the mouse while moving the sheet with the middle button
+        self.pan_point = None
 
         # init default draw settings
         self.drawing = False
         self.draw_mode = DrawMode.CURVE
-        self.brush_size = 6
-        self.brush_color = QColor(0, 0, 0)
-        self.brush_line_type = Qt.SolidLine
-        self.brush_cap_type = Qt.RoundCap
-        self.brush_join_type = Qt.RoundJoin
+        self.brush = BrushSpec(6, QColor(0, 0, 0).rgba(), Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
 
-        # reference to last point recorded by mouse
-        self.lastPoint = QPoint()
+        # init default fill settings: largest difference on each channel and number of neighbors of a pixel
+        self.fill_tolerance = 0
+        self.fill_connectivity = 4
 
-        # reference to the image backup
-        self.backup = QImage()
+        # stroke session or stroke worker in progress, None when the user is not drawing
+        self.stroke = None
 
-    # function to draw a line between tow points
-    def draw(self, from_point, to_point):
-        painter = QPainter(self.image)
-        pen = QPen(self.brush_color, self.brush_size, self.brush_line_type,
-                   self.brush_cap_type, self.brush_join_type)
-        painter.setPen(pen)
-        painter.drawLine(from_point, to_point)
+        # brush size from which the strokes are rasterized in a worker thread
+        self.worker_brush_size = STROKE_WORKER_BRUSH_SIZE
+
+        # points received since the last frame and the pressures on them, they are rasterized together once per
+        # display frame
+        self.pending_path = QPainterPath()
+        self.pending_pressures = array("f")
+        self.pending_timer = QElapsedTimer()
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.flush_stroke)
+
+        # maximum delay in milliseconds between the reception of a point and its rasterization
+        self.max_latency = 25
+
+        # timer compressing the undo and redo history after one second without drawing
+        self.history_timer = QTimer(self)
+        self.history_timer.setSingleShot(True)
+        self.history_timer.setInterval(1000)
+        self.history_timer.timeout.connect(lambda: self.layers.compress_history())
+
+        # journal of the actions used to recover the sheet after a crash, None when disabled
+        self.journal = None
+
+        # mirror publishing the session to viewers, None when disabled, and True for a painter showing the session of
+        # a mirror, which does not draw
+        self.mirror = None
+        self.read_only = False
+
+        # reference to last point recorded by mouse, in sheet coordinates, and the pressure of the pen on it
+        self.lastPoint = QPointF()
+        self.pressure = 1.0
+
+        # pressure of the last tablet event, None until a tablet pen is used
+        self.tablet_pressure = None
+
+        # reference to the end point of the line previewed in line mode, None when there is no preview
+        self.preview_point = None
+
+        # selected rectangle of the sheet, None when nothing is selected, and the pixels copied or cut, kept as a
+        # floating selection until they are pasted, None when nothing has been copied
+        self.selection = None
+        self.clipboard = None
+
+        # corner of the selection being drawn and offset of the mouse in the selection being dragged, None when the
+        # mouse does neither
+        self.select_point = None
+        self.drag_offset = None
+
+        # counter of the pixels repainted per second
+        self.repaint_counter = RepaintCounter()
+
+        # timers and counters on the stages of the paint pipeline, shown in an overlay refreshed twice per second
+        self.perf = Instrumentation()
+        self.hud_timer = QTimer(self)
+        self.hud_timer.setInterval(500)
+        self.hud_timer.timeout.connect(lambda: self.update(self.hud_rect()))
+
+        # function called once the first frame has been painted, from the event loop
+        self.on_first_paint = None
+
+    # sheet of the active layer, the actions are made on it
+    @property
+    def canvas(self):
+        return self.layers.active_layer().canvas
+
+    # undo and redo history of the active layer
+    @property
+    def history(self):
+        return self.layers.active_layer().history
+
+    @history.setter
+    def history(self, history):
+        self.layers.active_layer().history = history
+        self.layers.split_history_budget()
+
+    # vector records of the actions made on the active layer
+    @property
+    def log(self):
+        return self.layers.active_layer().log
+
+    @log.setter
+    def log(self, log):
+        self.layers.active_layer().log = log
+
+    # function to draw a line between tow points in the current stroke
+    def draw(self, from_point, to_point, pressures=None):
+        with self.perf.stage("draw"):
+            rect = self.stroke.draw_line(from_point, to_point, pressures)
+        if self.mirror is not None:
+            self.mirror.line(from_point, to_point, pressures)
+        self.sheet_rasterized(rect)
+
+    # function that adds a point to the current stroke, the point is rasterized at the next frame
+    def add_point(self, point, pressure=1.0):
+        if self.pending_path.isEmpty():
+            self.pending_path.moveTo(QPointF(self.lastPoint))
+            self.pending_pressures.append(self.pressure)
+            self.pending_timer.start()
+        self.pending_path.lineTo(QPointF(point))
+        self.pending_pressures.append(pressure)
+        self.lastPoint = point
+        self.pressure = pressure
+        self.perf.input_received()
+        if self.pending_timer.elapsed() >= self.max_latency:
+            self.flush_stroke()
+
+    # function that rasterizes the pending points of the stroke and repaints the area they cover
+    def flush_stroke(self):
+        if self.pending_path.isEmpty():
+            return
+        with self.perf.stage("draw"):
+            rect = self.stroke.draw_path(self.pending_path, self.pending_pressures)
+        if self.mirror is not None:
+            self.mirror.path(self.pending_path, self.pending_pressures,
+                             time.perf_counter() - self.pending_timer.elapsed() / 1000)
+        self.perf.record("segments per frame", self.pending_path.elementCount() - 1)
+        self.sheet_rasterized(rect)
+        self.pending_path = QPainterPath()
+        self.pending_pressures = array("f")
+
+    # function that repaints an area of the sheet rasterized, a stroke worker returns an empty area and repaints the
+    # tiles once it publishes them
+    def sheet_rasterized(self, rect):
+        if not rect.isEmpty():
+            self.update_sheet(rect)
+            self.perf.input_rasterized()
+
+    # function that installs in the sheet the tiles published by a stroke worker, once per batch of published tiles
+    def take_tiles(self, worker):
+        if worker is not self.stroke:
+            return
+        tiles, rect = worker.take()
+        if tiles:
+            self.canvas.put_tiles(tiles)
+            self.update_sheet(rect)
+            self.perf.input_rasterized()
+
+    # function that rasterizes the pending points of the stroke and waits for them to be in the sheet, returns the
+    # keys of the tiles with an open painter
+    def settle_stroke(self):
+        self.flush_stroke()
+        if isinstance(self.stroke, StrokeWorker):
+            self.stroke.sync()
+            self.take_tiles(self.stroke)
+            return ()
+        return self.stroke.painters
+
+    # function that opens the stroke session, or starts a stroke worker for a large brush
+    def begin_stroke(self):
+        self.drop_selection()
+        self.canvas.begin_change()
+        if self.brush.size >= self.worker_brush_size:
+            worker = StrokeWorker(self.canvas, self.brush, self.draw_mode)
+            worker.rasterized.connect(lambda: self.take_tiles(worker))
+            worker.start()
+            self.stroke = worker
+        else:
+            self.stroke = stroke_session(self.canvas, self.brush, self.draw_mode)
+        if self.mirror is not None:
+            self.mirror.begin_stroke(self.brush, self.draw_mode)
+        refresh_rate = self.screen().refreshRate() if self.screen() is not None else 60
+        self.frame_timer.start(max(1, min(round(1000 / refresh_rate), self.max_latency)))
+
+    # function that closes the stroke session
+    def end_stroke(self):
+        if self.stroke is not None:
+            self.flush_stroke()
+            self.frame_timer.stop()
+            if isinstance(self.stroke, StrokeWorker):
+                tiles, rect = self.stroke.finish()
+                self.canvas.put_tiles(tiles)
+                self.update_sheet(rect)
+                self.perf.input_rasterized()
+            else:
+                self.stroke.end()
+            record = self.stroke.record
+            self.stroke = None
+            if self.mirror is not None:
+                self.mirror.end_stroke()
+            self.push_change(record)
+
+    # function that fills with the brush color the area around a point of the sheet
+    def fill(self, point):
+        self.drop_selection()
+        record = FillRecord(point.x(), point.y(), self.brush.color, self.fill_tolerance, self.fill_connectivity)
+        self.canvas.begin_change()
+        with self.perf.stage("fill"):
+            rect = flood_fill(self.canvas, point, record.color, record.tolerance, record.connectivity)
+        self.push_change(record)
+        if rect is not None:
+            self.update_sheet(rect)
+
+    # function that replaces the blank tile and tiles of the sheet by the tiles computed by a filter
+    def apply_filter(self, record, blank, tiles):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        self.canvas.begin_change()
+        self.canvas.replace(blank, tiles)
+        self.push_change(record)
+        self.update()
+
+    # function that adds the change recorded on the sheet to the history and the record of the action to the log
+    def push_change(self, record):
+        change = self.canvas.end_change()
+        if change is not None:
+            self.history.push(change)
+            self.log.push(record)
+            self.history_timer.start()
+            if self.journal is not None and self.layers.plain():
+                self.journal.append(record, change)
+            elif self.journal is not None:
+                self.journal.changed()
+            if self.mirror is not None:
+                self.mirror.changed(record, change)
+
+    # function that undoes the last change of the sheet
+    def undo(self):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        change = self.history.undo(self.canvas)
+        if change is not None:
+            self.log.undo()
+            if self.journal is not None and self.layers.plain():
+                self.journal.undo(change)
+            elif self.journal is not None:
+                self.journal.changed()
+            if self.mirror is not None:
+                self.mirror.swapped(change)
+        self.update_change(change)
+
+    # function that redoes the last undone change of the sheet
+    def redo(self):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        change = self.history.redo(self.canvas)
+        if change is not None:
+            self.log.redo()
+            if self.journal is not None and self.layers.plain():
+                self.journal.redo(change)
+            elif self.journal is not None:
+                self.journal.changed()
+            if self.mirror is not None:
+                self.mirror.swapped(change)
+        self.update_change(change)
+
+    # function that repaints the area of the sheet modified by a change
+    def update_change(self, change):
+        if change is None:
+            return
+        rect = change.rect()
+        if rect is None:
+            self.update()
+        else:
+            self.update_sheet(rect)
+        self.history_timer.start()
+
+    # function that returns the area of the sheet covered by a segment drawn with the current brush
+    def segment_rect(self, from_point, to_point):
+        margin = self.brush.margin()
+        return QRectF(from_point, to_point).normalized().toAlignedRect().adjusted(-margin, -margin, margin, margin)
+
+    # function that replaces the picture by a single layer holding the sheet, the view is fitted to the new sheet.
+    # Without a log, the new sheet becomes the base image of a new log.
+    def set_canvas(self, canvas, log=None):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        self.canvas.finish_loading()
+        if log is None and canvas.loader is not None:
+            # the base of the log is taken when the tiles are loaded, before any stroke can write on them
+            log = StrokeLog(canvas.width, canvas.height)
+            canvas.on_loaded = lambda: self.loaded(canvas)
+            canvas.loader.preview_ready.connect(lambda preview: self.preview_loaded(canvas, preview))
+            canvas.loader.finished.connect(canvas.finish_loading)
+        elif log is None:
+            log = StrokeLog(canvas.width, canvas.height, canvas.snapshot())
+        self.layers = LayerStack([Layer("Background", canvas, log)])
+        self.layers_changed.emit()
+        if self.journal is not None and canvas.loader is None:
+            self.journal.reset()
+        if self.mirror is not None and canvas.loader is None:
+            self.mirror.reset()
+        self.fit_view()
+
+    # function called when the preview of a sheet loaded in the background is available
+    def preview_loaded(self, canvas, preview):
+        if canvas.loader is not None:
+            canvas.preview = preview
+            self.update()
+
+    # function called when the tiles of a sheet loaded in the background are available
+    def loaded(self, canvas):
+        bottom = self.layers.layers[0]
+        if canvas is bottom.canvas:
+            bottom.log.base = canvas.snapshot()
+            self.update()
+            if self.journal is not None:
+                self.journal.reset()
+            if self.mirror is not None:
+                self.mirror.reset()
+
+    # function that returns a snapshot of the picture, drawing can continue while the snapshot is used. The
+    # snapshot of several layers is the picture flattened.
+    def snapshot(self):
+        painted = () if self.stroke is None else self.settle_stroke()
+        if not self.layers.plain():
+            return self.layers.flatten()
+        return self.canvas.snapshot(painted)
+
+    # function that saves the picture to a project file, only the tiles modified since the last save are written. The
+    # project of several layers holds the picture flattened.
+    def save_project(self, file_path):
+        painted = () if self.stroke is None else self.settle_stroke()
+        if not self.layers.plain():
+            canvas = self.layers.flatten()
+            canvas.project = self.layers.composite.project
+            ProjectFile.save(canvas, file_path)
+            self.layers.composite.project = canvas.project
+        else:
+            ProjectFile.save(self.canvas, file_path, painted)
+
+    # function that fills the whole sheet of the active layer with white, or with transparent pixels on a layer
+    # with transparency
+    def clear(self):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        color = QColor(Qt.transparent if self.canvas.blank.hasAlphaChannel() else Qt.white)
+        self.canvas.begin_change()
+        self.canvas.fill(color)
+        self.push_change(ClearRecord(color.rgba()))
+        self.update()
+
+    # function that selects a rectangle of the sheet, nothing when the rectangle is None. Floating pixels are anchored
+    # first.
+    def select(self, rect):
+        self.anchor_selection()
+        if self.selection is not None:
+            self.update_sheet(self.selection.rect)
+        rect = QRect() if rect is None else rect & self.canvas.rect()
+        self.selection = None if rect.isEmpty() else Selection(rect)
+        if self.selection is not None:
+            self.update_sheet(rect)
+
+    # function that anchors the floating pixels and forgets the selection, before an action on the sheet
+    def drop_selection(self):
+        self.select(None)
+        self.select_point = None
+        self.drag_offset = None
+
+    # function that makes the pixels of the selection float over the sheet to drag them, they are not copied
+    def lift_selection(self):
+        selection = self.selection
+        if not selection.floating():
+            selection.source = self.canvas.view(selection.rect)
+            selection.origin = QRect(selection.rect)
+            selection.lifted = QRect(selection.rect)
+            self.update_sheet(selection.rect)
+
+    # function that moves the selection to a position of the sheet, only the old and the new selection areas are
+    # repainted
+    def move_selection(self, position):
+        self.update_sheet(self.selection.rect)
+        self.selection.rect.moveTopLeft(position)
+        self.update_sheet(self.selection.rect)
+        self.perf.input_received()
+        self.perf.input_rasterized()
+
+    # function that draws the floating pixels of the selection on the sheet, erasing the rectangle they were lifted
+    # from, as one change. The selection stays selected.
+    def anchor_selection(self):
+        selection = self.selection
+        if selection is None or not selection.floating():
+            return
+        lifted = selection.lifted
+        if lifted != selection.rect:
+            position = selection.rect.topLeft()
+            self.canvas.begin_change()
+            with self.perf.stage("anchor"):
+                if lifted is None:
+                    record = PasteRecord(position.x(), position.y(), selection.source, selection.origin)
+                else:
+                    record = MoveRecord(lifted.x(), lifted.y(), lifted.width(), lifted.height(), position.x(),
+                                        position.y())
+                    self.canvas.erase(lifted)
+                self.canvas.paste(selection.source, selection.origin, position)
+            self.push_change(record)
+        selection.source = None
+        selection.origin = None
+        selection.lifted = None
+        if lifted is not None:
+            self.update_sheet(lifted)
+        self.update_sheet(selection.rect)
+
+    # function that copies the pixels of the selection, the copy shares the tiles of the sheet
+    def copy_selection(self):
+        self.end_stroke()
+        self.drawing = False
+        selection = self.selection
+        if selection is None:
+            return
+        if selection.floating():
+            self.clipboard = Selection(selection.rect, selection.source, selection.origin)
+        else:
+            self.clipboard = Selection(selection.rect, self.canvas.view(selection.rect), QRect(selection.rect))
+
+    # function that copies the pixels of the selection and erases them, floating pixels are erased from the rectangle
+    # they were lifted from
+    def cut_selection(self):
+        self.copy_selection()
+        selection = self.selection
+        if selection is None:
+            return
+        rect = selection.lifted if selection.floating() else selection.rect
+        self.selection = None
+        self.drag_offset = None
+        self.update_sheet(selection.rect)
+        if rect is not None:
+            self.canvas.begin_change()
+            self.canvas.erase(rect)
+            self.push_change(EraseRecord(rect.x(), rect.y(), rect.width(), rect.height()))
+            self.update_sheet(rect)
+
+    # function that pastes the copied pixels as a floating selection, where they were copied from when it is on the
+    # sheet and at the origin of the sheet otherwise
+    def paste_clipboard(self):
+        self.end_stroke()
+        self.drawing = False
+        if self.clipboard is None:
+            return
+        self.drop_selection()
+        rect = QRect(self.clipboard.rect)
+        if not rect.intersects(self.canvas.rect()):
+            rect.moveTopLeft(QPoint())
+        self.selection = Selection(rect, self.clipboard.source, self.clipboard.origin)
+        self.update_sheet(rect)
+
+    # function that adds a transparent layer above the active layer
+    def add_layer(self):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        self.layers.add()
+        self.update_layers()
+
+    # function that removes the active layer
+    def remove_layer(self):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        self.layers.remove()
+        self.update_layers()
+
+    # function that moves the active layer up or down by an offset
+    def move_layer(self, offset):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        self.layers.move(offset)
+        self.update_layers()
+
+    # function that makes a layer the active layer
+    def set_active_layer(self, index):
+        self.end_stroke()
+        self.drawing = False
+        self.drop_selection()
+        self.layers.set_active(index)
+        self.layers_changed.emit()
+
+    # function that changes the blending settings of the active layer
+    def set_layer_blending(self, visible, opacity, blend_mode):
+        layer = self.layers.active_layer()
+        layer.visible = visible
+        layer.opacity = opacity
+        layer.blend_mode = blend_mode
+        self.layers.changed()
+        self.update_layers()
+
+    # function called when the layers change, the journal checkpoints the picture since its records do not keep the
+    # layers, and the mirror sends it again
+    def update_layers(self):
+        self.layers_changed.emit()
+        if self.journal is not None:
+            self.journal.changed()
+        if self.mirror is not None:
+            self.mirror.reset()
+        self.update()
+
+    # function that changes the zoom factor and the position of the sheet in the widget
+    def set_view(self, zoom, pan):
+        self.zoom = zoom
+        self.pan = pan
+        self.view = QTransform(zoom, 0, 0, zoom, pan.x(), pan.y())
         self.update()
 
+    # function that zooms the view by a factor, keeping the given widget position under the mouse
+    def zoom_at(self, position, factor):
+        zoom = min(max(self.zoom * factor, 1 / 64), 32)
+        self.view_fitted = False
+        self.set_view(zoom, position - (position - self.pan) * (zoom / self.zoom))
+
+    # function that centers the whole sheet in the widget, zooming out if it does not fit. The zoom keeps its minimum
+    # while the widget is empty, before it is shown or when it is minimized.
+    def fit_view(self):
+        zoom = max(min(1.0, self.width() / self.canvas.width, self.height() / self.canvas.height), 1 / 64)
+        self.view_fitted = True
+        self.set_view(zoom, QPointF((self.width() - self.canvas.width * zoom) / 2,
+                                    (self.height() - self.canvas.height * zoom) / 2))
+
+    # function that converts a position in the widget to a position on the sheet
+    def to_sheet(self, position):
+        return QPointF((position.x() - self.pan.x()) / self.zoom, (position.y() - self.pan.y()) / self.zoom)
+
+    # function that repaints the area of the widget showing a rectangle of the sheet
+    def update_sheet(self, rect):
+        self.update(self.view.mapRect(QRectF(rect)).toAlignedRect().adjusted(-1, -1, 1, 1))
+
     # mouse press event listener
     def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
+        if event.button() == Qt.LeftButton and not self.read_only:
             self.drawing = True
-            self.lastPoint = event.pos()
-            if self.draw_mode == DrawMode.LINE:
-                self.backup = self.image.copy()
+            self.lastPoint = self.to_sheet(event.pos())
+            self.pressure = self.event_pressure(event)
+            if self.selection is not None and self.selection.rect.contains(self.lastPoint.toPoint()) \
+                    and (self.draw_mode == DrawMode.SELECT or self.selection.floating()):
+                # floating pixels are dragged in every mode, pressing elsewhere anchors them
+                self.drawing = False
+                self.lift_selection()
+                self.drag_offset = self.lastPoint.toPoint() - self.selection.rect.topLeft()
+            elif self.draw_mode == DrawMode.SELECT:
+                self.drawing = False
+                self.drop_selection()
+                self.select_point = self.lastPoint
+            elif self.draw_mode == DrawMode.LINE:
+                self.move_preview(self.lastPoint)
+            elif self.draw_mode == DrawMode.FILL:
+                self.drawing = False
+                self.fill(self.lastPoint)
+            else:
+                self.begin_stroke()
+        elif event.button() == Qt.MiddleButton:
+            self.pan_point = event.pos()
 
     # mouse move event listener
     def mouseMoveEvent(self, event):
-        if (event.buttons() == Qt.LeftButton) & (self.draw_mode == DrawMode.CURVE) & self.drawing:
-            self.draw(self.lastPoint, event.pos())
-            self.lastPoint = event.pos()
-        if (event.buttons() == Qt.LeftButton) & (self.draw_mode == DrawMode.LINE) & self.drawing:
-            self.image = self.backup.copy()
-            self.draw(self.lastPoint, event.pos())
+        with self.perf.stage("mouseMoveEvent"):
+            if (event.buttons() == Qt.LeftButton) & (self.draw_mode == DrawMode.CURVE) & self.drawing:
+                self.add_point(self.to_sheet(event.pos()), self.event_pressure(event))
+            if (event.buttons() == Qt.LeftButton) & (self.draw_mode == DrawMode.LINE) & self.drawing:
+                self.move_preview(self.to_sheet(event.pos()))
+            if (event.buttons() == Qt.LeftButton) and self.drag_offset is not None:
+                self.move_selection(self.to_sheet(event.pos()).toPoint() - self.drag_offset)
+            if (event.buttons() == Qt.LeftButton) and self.select_point is not None:
+                self.select(QRectF(self.select_point, self.to_sheet(event.pos())).normalized().toRect())
+            if (event.buttons() & Qt.MiddleButton) and self.pan_point is not None:
+                self.view_fitted = False
+                self.set_view(self.zoom, self.pan + QPointF(event.pos() - self.pan_point))
+                self.pan_point = event.pos()
 
     # mouse release event listener
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
             self.drawing = False
+            self.select_point = None
+            self.drag_offset = None
+            if self.preview_point is not None:
+                self.move_preview(None)
+                self.begin_stroke()
+                self.draw(self.lastPoint, self.to_sheet(event.pos()), array("f", (self.pressure, self.pressure)))
+            self.end_stroke()
+        elif event.button() == Qt.MiddleButton:
+            self.pan_point = None
+
+    # tablet event listener, keeps the pressure of the pen and lets Qt send the matching mouse event
+    def tabletEvent(self, event):
+        self.tablet_pressure = event.pressure()
+        event.ignore()
+
+    # function that returns the pressure of the pen that moved the mouse, 1 for a mouse
+    def event_pressure(self, event):
+        if event.source() == Qt.MouseEventSynthesizedByQt and self.tablet_pressure is not None:
+            return self.tablet_pressure
+        return 1.0
 
-    # paint event listener, draw the image in the paint area
+    # mouse wheel event listener, scrolls the sheet or zooms with the control key
+    def wheelEvent(self, event):
+        delta = event.angleDelta()
+        if event.modifiers() & Qt.ControlModifier:
+            self.zoom_at(event.position(), 1.25 ** (delta.y() / 120))
+        else:
+            self.view_fitted = False
+            self.set_view(self.zoom, self.pan + QPointF(delta.x(), delta.y()))
+
+    # function that moves the end of the previewed line, only the old and the new line areas are repainted
+    def move_preview(self, point):
+        if self.preview_point is not None:
+            self.update_sheet(self.segment_rect(self.lastPoint, self.preview_point))
+        self.preview_point = point
+        if point is not None:
+            self.update_sheet(self.segment_rect(self.lastPoint, point))
+            self.perf.input_received()
+            self.perf.input_rasterized()
+
+    # paint event listener, draw the visible part of the image in the paint area
     def paintEvent(self, event):
         canvas_painter = QPainter(self)
-        canvas_painter.drawImage(self.rect(), self.image, self.image.rect())
+        with self.perf.stage("paintEvent"):
+            image = self.layers.image()
+            sheet_rect = self.view.mapRect(QRectF(image.rect())).toAlignedRect()
+            refreshed = False
+            copied = 0
+            for rect in (event.region() - QRegion(sheet_rect)).rects():
+                canvas_painter.fillRect(rect, Qt.darkGray)
+            canvas_painter.setTransform(self.view)
+            inverted, _ = self.view.inverted()
+            for rect in event.region().rects():
+                image.draw(canvas_painter, inverted.mapRect(QRectF(rect)).toAlignedRect())
+                if self.selection is not None and self.selection.floating():
+                    self.draw_floating(canvas_painter, inverted.mapRect(QRectF(rect)).toAlignedRect())
+                refreshed |= self.repaint_counter.add(rect)
+                copied += rect.width() * rect.height() * 4
+            if self.preview_point is not None:
+                canvas_painter.setPen(self.brush.pen())
+                canvas_painter.drawLine(self.lastPoint, self.preview_point)
+            if self.selection is not None:
+                canvas_painter.setBrush(Qt.NoBrush)
+                canvas_painter.setPen(QPen(Qt.white, 0))
+                canvas_painter.drawRect(QRectF(self.selection.rect))
+                canvas_painter.setPen(QPen(Qt.black, 0, Qt.DashLine))
+                canvas_painter.drawRect(QRectF(self.selection.rect))
+            if refreshed:
+                self.repaint_rate_changed.emit(self.repaint_counter.pixels_per_second)
+        self.perf.record("bytes copied", copied)
+        self.perf.frame_presented()
+        if self.perf.enabled:
+            self.draw_hud(canvas_painter)
+        if self.on_first_paint is not None:
+            QTimer.singleShot(0, self.on_first_paint)
+            self.on_first_paint = None
+
+    # function that draws the floating pixels of the selection over a rectangle of the sheet, and the rectangle they
+    # were lifted from erased on a single plain layer. The sheet is not modified until the pixels are anchored.
+    def draw_floating(self, painter, rect):
+        selection = self.selection
+        if selection.lifted is not None and self.layers.plain():
+            painter.fillRect(selection.lifted & rect, self.canvas.blank.pixelColor(0, 0))
+        part = selection.rect & rect
+        if not part.isEmpty():
+            offset = selection.rect.topLeft() - selection.origin.topLeft()
+            painter.save()
+            painter.translate(offset)
+            selection.source.draw(painter, part.translated(-offset))
+            painter.restore()
 
-    # resize event listener
+    # resize event listener, no pixel work: the sheet is only centered again while the view has not been changed
     def resizeEvent(self, event):
-        self.image = self.image.scaled(self.width(), self.height())
+        with self.perf.stage("resizeEvent"):
+            if self.view_fitted:
+                self.fit_view()
 
+    # function that returns the area of the widget covered by the performance overlay
+    def hud_rect(self):
+        return QRect(8, 8, 460, 16 * max(1, len(self.perf.metrics)) + 8)
 
-# This class defines the widget for the selection of the draw mode.
-class DrawModeWidget(QWidget):
-    def __init__(self, painter):
-        super().__init__()
+    # function that draws the statistics of the instrumentation over the sheet
+    def draw_hud(self, painter):
+        painter.resetTransform()
+        rect = self.hud_rect()
+        painter.fillRect(rect, QColor(0, 0, 0, 160))
+        painter.setPen(Qt.white)
+        for i, line in enumerate(self.perf.report_lines()):
+            painter.drawText(rect.x() + 6, rect.y() + 16 * (i + 1), line)
 
-        # init name and description
-        self.setAccessibleName("Draw mode widget")
-        self.setAccessibleDescription("Allows to select the desired draw mode.")
+    # function that shows or hides the performance overlay, the measures are only taken while it is shown
+    def set_hud_visible(self, visible):
+        self.perf.enabled = visible
+        if visible:
+            self.hud_timer.start()
+        else:
+            self.hud_timer.stop()
+        self.update()
 
-        # reference to the painter widget
-        self.painter = painter
 
-        # radio buttons declaration
-        mode_1 = QRadioButton("curve")
-        mode_2 = QRadioButton("line")
-        mode_1.setChecked(True)
+# This class defines the widget selecting an option of the painter with radio buttons, one per choice. The option
+# is a field of the brush or an attribute of the painter.
+class OptionWidget(QWidget):
+    def __init__(self, painter, field, choices):
+        super().__init__()
 
-        # adding buttons to group
-        self.draw_mode_group = QButtonGroup()
-        self.draw_mode_group.addButton(mode_1)
-        self.draw_mode_group.addButton(mode_2)
-        i = 0
-        for button in self.draw_mode_group.buttons():
-            self.draw_mode_group.setId(button, i)
-            i += 1
-        self.draw_mode_group.buttonClicked.connect(self.set_draw_mode)
+        # reference to the painter widget, the option and the value of each button
+        self.painter = painter
+        self.field = field
+        self.values = [value for _, value in choices]
 
-        # adding buttons to layout
-        draw_mode_layout = QVBoxLayout()
-        draw_mode_layout.addWidget(mode_1)
-        draw_mode_layout.addWidget(mode_2)
-        self.setLayout(draw_mode_layout)
+        # radio buttons declaration, the button of the current value is checked
+        self.option_group = QButtonGroup()
+        option_layout = QVBoxLayout()
+        current = self.value()
+        for i, (label, value) in enumerate(choices):
+            button = QRadioButton(label)
+            button.setChecked(value == current)
+            self.option_group.addButton(button, i)
+            option_layout.addWidget(button)
+        self.option_group.buttonClicked.connect(self.set_option)
+        self.setLayout(option_layout)
 
-    # function that change the draw mode of painter
-    def set_draw_mode(self):
-        id_button = self.draw_mode_group.checkedId()
-        if id_button == 0:
-            self.painter.draw_mode = DrawMode.CURVE
-        elif id_button == 1:
-            self.painter.draw_mode = DrawMode.LINE
+    # function that returns the current value of the option
+    def value(self):
+        if self.field in BrushSpec._fields:
+            return getattr(self.painter.brush, self.field)
+        return getattr(self.painter, self.field)
+
+    # function that change the option of painter
+    def set_option(self):
+        value = self.values[self.option_group.checkedId()]
+        if self.field in BrushSpec._fields:
+            self.painter.brush = self.painter.brush._replace(**{self.field: value})
+        else:
+            setattr(self.painter, self.field, value)
 
 
 # This class defines the widget for the selection of the brush color.
@@ -130,10 +3991,6 @@ class BrushColorWidget(QWidget):
     def __init__(self, painter):
         super().__init__()
 
-        # init name and description
-        self.setAccessibleName("Brush color widget")
-        self.setAccessibleDescription("Allows to select the desired brush color and displays the current color.")
-
         # reference to the painter widget
         self.painter = painter
 
@@ -159,7 +4016,7 @@ class BrushColorWidget(QWidget):
             blue = color.getRgb()[2]
             style = "background: rgb(" + str(red) + "," + str(green) + "," + str(blue) + ")"
             self.color_indicator.setStyleSheet(style)
-            self.painter.brush_color = color
+            self.painter.brush = self.painter.brush._replace(color=color.rgba())
 
 
 # This class defines the widget for the selection of the brush thickness.
@@ -167,10 +4024,6 @@ class BrushThicknessWidget(QWidget):
     def __init__(self, painter):
         super().__init__()
 
-        # init name and description
-        self.setAccessibleName("Brush thickness widget")
-        self.setAccessibleDescription("Allows to change the brush thickness and displays the current size.")
-
         # reference to the painter widget
         self.painter = painter
 
@@ -178,8 +4031,8 @@ class BrushThicknessWidget(QWidget):
         self.thickness_slider = QSlider(Qt.Horizontal)
         self.thickness_slider.setTickInterval(1)
         self.thickness_slider.setMinimum(1)
-        self.thickness_slider.setMaximum(25)
-        self.thickness_slider.setTickInterval(5)
+        self.thickness_slider.setMaximum(200)
+        self.thickness_slider.setTickInterval(25)
         self.thickness_slider.setTickPosition(QSlider.TicksBelow)
         self.thickness_slider.setValue(6)
         self.thickness_slider.valueChanged.connect(self.set_brush_thickness)
@@ -195,159 +4048,320 @@ class BrushThicknessWidget(QWidget):
 
     # function that change the brush thickness of painter
     def set_brush_thickness(self):
-        self.painter.brush_size = self.thickness_slider.value()
+        self.painter.brush = self.painter.brush._replace(size=self.thickness_slider.value())
         self.thickness_size_label.setText(str(self.thickness_slider.value()) + "px")
 
 
-# This class defines the widget for the selection of the brush line type selection.
-class BrushLineTypeWidget(QWidget):
+# This class defines the widget for the settings of the dab brush: the check box selecting the dabs instead of the
+# pen, and the sliders of the hardness, the opacity and the spacing of the dabs, in percent.
+class DabBrushWidget(QWidget):
     def __init__(self, painter):
         super().__init__()
 
-        # init name and description
-        self.setAccessibleName("Brush line type widget")
-        self.setAccessibleDescription("Allows to select the brush line type.")
-
         # reference to the painter widget
         self.painter = painter
 
-        # radio buttons declaration
-        line_type_1 = QRadioButton("solid")
-        line_type_2 = QRadioButton("dash")
-        line_type_3 = QRadioButton("dot")
-        line_type_4 = QRadioButton("dash dot")
-        line_type_5 = QRadioButton("dash dot dot")
-        line_type_1.setChecked(True)
+        # declaration of the check box
+        self.dab_check_box = QCheckBox("stamp dabs")
+        self.dab_check_box.setChecked(painter.brush.engine == BrushEngine.DAB)
+        self.dab_check_box.toggled.connect(self.set_brush_engine)
+        dab_layout = QGridLayout()
+        dab_layout.addWidget(self.dab_check_box, 0, 0, 1, 2)
 
-        # adding buttons to group
-        self.line_type_group = QButtonGroup()
-        self.line_type_group.addButton(line_type_1)
-        self.line_type_group.addButton(line_type_2)
-        self.line_type_group.addButton(line_type_3)
-        self.line_type_group.addButton(line_type_4)
-        self.line_type_group.addButton(line_type_5)
-        i = 0
-        for button in self.line_type_group.buttons():
-            self.line_type_group.setId(button, i)
-            i += 1
-        self.line_type_group.buttonClicked.connect(self.set_brush_line_type)
-
-        # adding buttons to layout
-        line_type_layout = QVBoxLayout()
-        line_type_layout.addWidget(line_type_1)
-        line_type_layout.addWidget(line_type_2)
-        line_type_layout.addWidget(line_type_3)
-        line_type_layout.addWidget(line_type_4)
-        line_type_layout.addWidget(line_type_5)
-        self.setLayout(line_type_layout)
-
-    # function that change the brush line type of painter
-    def set_brush_line_type(self):
-        id_button = self.line_type_group.checkedId()
-        if id_button == 0:
-            self.painter.brush_line_type = Qt.SolidLine
-        elif id_button == 1:
-            self.painter.brush_line_type = Qt.DashLine
-        elif id_button == 2:
-            self.painter.brush_line_type = Qt.DotLine
-        elif id_button == 3:
-            self.painter.brush_line_type = Qt.DashDotLine
-        elif id_button == 4:
-            self.painter.brush_line_type = Qt.DashDotDotLine
-
-
-# This class defines the widget for the selection of the brush cap type.
-class BrushCapTypeWidget(QWidget):
+        # declaration of the sliders and labels: brush field, label, range and tick interval in percent
+        self.sliders = {}
+        self.value_labels = {}
+        for row, (field, label, minimum, maximum, ticks) in enumerate((("hardness", "hardness:", 0, 100, 25),
+                                                                       ("opacity", "opacity:", 1, 100, 25),
+                                                                       ("spacing", "spacing:", 1, 200, 50))):
+            slider = QSlider(Qt.Horizontal)
+            slider.setMinimum(minimum)
+            slider.setMaximum(maximum)
+            slider.setTickInterval(ticks)
+            slider.setTickPosition(QSlider.TicksBelow)
+            slider.setValue(round(getattr(painter.brush, field) * 100))
+            slider.valueChanged.connect(partial(self.set_dab_option, field))
+            self.sliders[field] = slider
+            self.value_labels[field] = QLabel(str(slider.value()) + "%")
+            dab_layout.addWidget(slider, row * 2 + 1, 0, 1, 2)
+            dab_layout.addWidget(QLabel(label), row * 2 + 2, 0, 1, 1)
+            dab_layout.addWidget(self.value_labels[field], row * 2 + 2, 1, 1, 1)
+        self.setLayout(dab_layout)
+
+    # function that change the brush engine of painter
+    def set_brush_engine(self, checked):
+        self.painter.brush = self.painter.brush._replace(engine=BrushEngine.DAB if checked else BrushEngine.PEN)
+
+    # function that change the hardness, the opacity or the spacing of the dabs of painter
+    def set_dab_option(self, field, value):
+        self.painter.brush = self.painter.brush._replace(**{field: value / 100})
+        self.value_labels[field].setText(str(value) + "%")
+
+
+# This class defines the widget for the settings of the fill mode.
+class FillWidget(QWidget):
     def __init__(self, painter):
         super().__init__()
 
-        # init name and description
-        self.setAccessibleName("Brush cap type widget")
-        self.setAccessibleDescription("Allows to select the brush cap type.")
-
         # reference to the painter widget
         self.painter = painter
 
+        # declaration of the tolerance slider and labels
+        self.tolerance_slider = QSlider(Qt.Horizontal)
+        self.tolerance_slider.setMinimum(0)
+        self.tolerance_slider.setMaximum(255)
+        self.tolerance_slider.setTickInterval(32)
+        self.tolerance_slider.setTickPosition(QSlider.TicksBelow)
+        self.tolerance_slider.setValue(0)
+        self.tolerance_slider.valueChanged.connect(self.set_fill_tolerance)
+        tolerance_label = QLabel("tolerance:")
+        self.tolerance_value_label = QLabel(str(self.tolerance_slider.value()))
+
         # radio buttons declaration
-        cap_type_1 = QRadioButton("flat")
-        cap_type_2 = QRadioButton("square")
-        cap_type_3 = QRadioButton("round")
-        cap_type_3.setChecked(True)
+        connectivity_1 = QRadioButton("4 neighbors")
+        connectivity_2 = QRadioButton("8 neighbors")
+        connectivity_1.setChecked(True)
 
         # adding buttons to group
-        self.cap_type_group = QButtonGroup()
-        self.cap_type_group.addButton(cap_type_1)
-        self.cap_type_group.addButton(cap_type_2)
-        self.cap_type_group.addButton(cap_type_3)
+        self.connectivity_group = QButtonGroup()
+        self.connectivity_group.addButton(connectivity_1)
+        self.connectivity_group.addButton(connectivity_2)
         i = 0
-        for button in self.cap_type_group.buttons():
-            self.cap_type_group.setId(button, i)
+        for button in self.connectivity_group.buttons():
+            self.connectivity_group.setId(button, i)
             i += 1
-        self.cap_type_group.buttonClicked.connect(self.set_brush_cap_type)
-
-        # adding buttons to layout
-        cap_type_layout = QVBoxLayout()
-        cap_type_layout.addWidget(cap_type_1)
-        cap_type_layout.addWidget(cap_type_2)
-        cap_type_layout.addWidget(cap_type_3)
-        self.setLayout(cap_type_layout)
-
-    # function that change the brush cap type of painter
-    def set_brush_cap_type(self):
-        id_button = self.cap_type_group.checkedId()
-        if id_button == 0:
-            self.painter.brush_cap_type = Qt.FlatCap
-        elif id_button == 1:
-            self.painter.brush_cap_type = Qt.SquareCap
-        elif id_button == 2:
-            self.painter.brush_cap_type = Qt.RoundCap
-
-
-# This class defines the widget for the selection of the brush join type.
-class BrushJoinTypeWidget(QWidget):
+        self.connectivity_group.buttonClicked.connect(self.set_fill_connectivity)
+
+        # adding slider, labels and buttons to layout
+        fill_layout = QGridLayout()
+        fill_layout.addWidget(self.tolerance_slider, 0, 0, 1, 2)
+        fill_layout.addWidget(tolerance_label, 1, 0, 1, 1)
+        fill_layout.addWidget(self.tolerance_value_label, 1, 1, 1, 1)
+        fill_layout.addWidget(connectivity_1, 2, 0, 1, 2)
+        fill_layout.addWidget(connectivity_2, 3, 0, 1, 2)
+        self.setLayout(fill_layout)
+
+    # function that change the fill tolerance of painter
+    def set_fill_tolerance(self):
+        self.painter.fill_tolerance = self.tolerance_slider.value()
+        self.tolerance_value_label.setText(str(self.tolerance_slider.value()))
+
+    # function that change the fill connectivity of painter
+    def set_fill_connectivity(self):
+        self.painter.fill_connectivity = 8 if self.connectivity_group.checkedId() == 1 else 4
+
+
+# This class defines the widget managing the layers: the list of the layers, the top one first, the buttons adding,
+# removing and moving the active layer and its blending settings.
+class LayersWidget(QWidget):
     def __init__(self, painter):
         super().__init__()
 
-        # init name and description
-        self.setAccessibleName("Brush join type widget")
-        self.setAccessibleDescription("Allows to select the brush join type.")
-
         # reference to the painter widget
         self.painter = painter
 
-        # radio buttons declaration
-        join_type_1 = QRadioButton("miter")
-        join_type_2 = QRadioButton("bevel")
-        join_type_3 = QRadioButton("round")
-        join_type_3.setChecked(True)
+        # declaration of the list of the layers
+        self.layer_list = QListWidget()
+        self.layer_list.currentRowChanged.connect(self.set_active_layer)
 
-        # adding buttons to group
-        self.join_type_group = QButtonGroup()
-        self.join_type_group.addButton(join_type_1)
-        self.join_type_group.addButton(join_type_2)
-        self.join_type_group.addButton(join_type_3)
-        i = 0
-        for button in self.join_type_group.buttons():
-            self.join_type_group.setId(button, i)
-            i += 1
-        self.join_type_group.buttonClicked.connect(self.set_brush_join_type)
-
-        # adding buttons to layout
-        cap_type_layout = QVBoxLayout()
-        cap_type_layout.addWidget(join_type_1)
-        cap_type_layout.addWidget(join_type_2)
-        cap_type_layout.addWidget(join_type_3)
-        self.setLayout(cap_type_layout)
-
-    # function that change the brush join type of painter
-    def set_brush_join_type(self):
-        id_button = self.join_type_group.checkedId()
-        if id_button == 0:
-            self.painter.brush_join_type = Qt.MiterJoin
-        elif id_button == 1:
-            self.painter.brush_join_type = Qt.BevelJoin
-        elif id_button == 2:
-            self.painter.brush_join_type = Qt.RoundJoin
+        # buttons declaration
+        add_button = QPushButton("add")
+        add_button.clicked.connect(self.painter.add_layer)
+        remove_button = QPushButton("remove")
+        remove_button.clicked.connect(self.painter.remove_layer)
+        up_button = QPushButton("up")
+        up_button.clicked.connect(lambda: self.painter.move_layer(1))
+        down_button = QPushButton("down")
+        down_button.clicked.connect(lambda: self.painter.move_layer(-1))
+
+        # declaration of the blending settings of the active layer
+        self.visible_box = QCheckBox("visible")
+        self.visible_box.toggled.connect(self.set_layer_blending)
+        self.opacity_slider = QSlider(Qt.Horizontal)
+        self.opacity_slider.setMinimum(0)
+        self.opacity_slider.setMaximum(100)
+        self.opacity_slider.valueChanged.connect(self.set_layer_blending)
+        opacity_label = QLabel("opacity:")
+        self.opacity_value_label = QLabel()
+        self.blend_mode_box = QComboBox()
+        for name, _ in BLEND_MODES:
+            self.blend_mode_box.addItem(name)
+        self.blend_mode_box.currentIndexChanged.connect(self.set_layer_blending)
+
+        # adding list, buttons and settings to layout
+        layers_layout = QGridLayout()
+        layers_layout.addWidget(self.layer_list, 0, 0, 1, 2)
+        layers_layout.addWidget(add_button, 1, 0, 1, 1)
+        layers_layout.addWidget(remove_button, 1, 1, 1, 1)
+        layers_layout.addWidget(up_button, 2, 0, 1, 1)
+        layers_layout.addWidget(down_button, 2, 1, 1, 1)
+        layers_layout.addWidget(self.visible_box, 3, 0, 1, 2)
+        layers_layout.addWidget(self.opacity_slider, 4, 0, 1, 2)
+        layers_layout.addWidget(opacity_label, 5, 0, 1, 1)
+        layers_layout.addWidget(self.opacity_value_label, 5, 1, 1, 1)
+        layers_layout.addWidget(self.blend_mode_box, 6, 0, 1, 2)
+        self.setLayout(layers_layout)
+
+        self.painter.layers_changed.connect(self.update_layers)
+        self.update_layers()
+
+    # function that displays the layers of painter and the settings of the active layer, without changing them
+    def update_layers(self):
+        layers = self.painter.layers
+        layer = layers.active_layer()
+        for widget in (self.layer_list, self.visible_box, self.opacity_slider, self.blend_mode_box):
+            widget.blockSignals(True)
+        self.layer_list.clear()
+        for listed in reversed(layers.layers):
+            self.layer_list.addItem(listed.name if listed.visible else listed.name + " (hidden)")
+        self.layer_list.setCurrentRow(len(layers.layers) - 1 - layers.active)
+        self.visible_box.setChecked(layer.visible)
+        self.opacity_slider.setValue(round(layer.opacity * 100))
+        self.opacity_value_label.setText(str(self.opacity_slider.value()) + " %")
+        self.blend_mode_box.setCurrentIndex([mode for _, mode in BLEND_MODES].index(layer.blend_mode))
+        for widget in (self.layer_list, self.visible_box, self.opacity_slider, self.blend_mode_box):
+            widget.blockSignals(False)
+
+    # function that change the active layer of painter
+    def set_active_layer(self, row):
+        if row >= 0:
+            self.painter.set_active_layer(len(self.painter.layers.layers) - 1 - row)
+
+    # function that change the blending settings of the active layer of painter
+    def set_layer_blending(self):
+        self.painter.set_layer_blending(self.visible_box.isChecked(), self.opacity_slider.value() / 100,
+                                        BLEND_MODES[self.blend_mode_box.currentIndex()][1])
+
+
+# maximum size of the preview of the filter dialog
+FILTER_PREVIEW_SIZE = (360, 240)
+
+
+# This class defines the dialog setting the parameters of a filter, with a preview of the filter applied to the sheet
+# downscaled.
+class FilterDialog(QDialog):
+    def __init__(self, canvas, filter_type, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(filter_type.name)
+        self.filter_type = filter_type
+
+        # sheet downscaled once for the preview
+        self.scale = min(1.0, FILTER_PREVIEW_SIZE[0] / canvas.width, FILTER_PREVIEW_SIZE[1] / canvas.height)
+        self.image = QImage(max(1, round(canvas.width * self.scale)), max(1, round(canvas.height * self.scale)),
+                            QImage.Format_RGB32)
+        self.image.fill(Qt.white)
+        painter = QPainter(self.image)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.scale(self.scale, self.scale)
+        canvas.draw(painter, canvas.rect())
+        painter.end()
+        self.preview = QLabel()
+
+        # declaration of a slider and a label per parameter
+        layout = QGridLayout()
+        layout.addWidget(self.preview, 0, 0, 1, 3)
+        self.sliders = []
+        for i, (_, label, minimum, maximum, default) in enumerate(filter_type.parameters):
+            slider = QSlider(Qt.Horizontal)
+            slider.setMinimum(minimum)
+            slider.setMaximum(maximum)
+            slider.setValue(default)
+            value_label = QLabel(str(default))
+            slider.valueChanged.connect(value_label.setNum)
+            slider.valueChanged.connect(self.update_preview)
+            layout.addWidget(QLabel(label + ":"), i + 1, 0)
+            layout.addWidget(slider, i + 1, 1)
+            layout.addWidget(value_label, i + 1, 2)
+            self.sliders.append(slider)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons, len(self.sliders) + 1, 0, 1, 3)
+        self.setLayout(layout)
+        self.update_preview()
+
+    # function that returns the filter with the parameters of the sliders
+    def image_filter(self):
+        return self.filter_type(*(slider.value() for slider in self.sliders))
+
+    # function that applies the filter to the downscaled sheet and displays it
+    def update_preview(self):
+        image_filter = self.image_filter().scaled(self.scale)
+        halo = image_filter.halo()
+        pixels = numpy.pad(image_pixels(self.image), ((halo, halo), (halo, halo), (0, 0)), mode="edge")
+        self.preview.setPixmap(QPixmap.fromImage(pixels_image(image_filter.apply(pixels))))
+
+
+# This class describes a dock of the window: its title, its label in the menus, the name and description displayed
+# by its help, the function building its widget for the painter, whether it is shown at startup and whether its
+# height is fixed to the size of the widget.
+class DockSpec(namedtuple("DockSpec", ["title", "label", "name", "description", "build", "visible", "fixed_height"])):
+    __slots__ = ()
+
+
+# docks of the window, from top to bottom
+DOCKS = (
+    DockSpec("Draw mode", "Draw mode", "Draw mode widget",
+             "Allows to select the desired draw mode. In select mode, a rectangle of the sheet is selected by dragging "
+             "the mouse, and moved by dragging it from inside; it can be copied, cut and pasted from the Edit menu.",
+             partial(OptionWidget, field="draw_mode",
+                     choices=(("curve", DrawMode.CURVE), ("line", DrawMode.LINE), ("fill", DrawMode.FILL),
+                              ("select", DrawMode.SELECT))),
+             True, True),
+    DockSpec("Brush colour", "Brush color", "Brush color widget",
+             "Allows to select the desired brush color and displays the current color.", BrushColorWidget, True, True),
+    DockSpec("Brush thickness", "Brush thickness", "Brush thickness widget",
+             "Allows to change the brush thickness and displays the current size.", BrushThicknessWidget, True, True),
+    DockSpec("Dab brush", "Dab brush", "Dab brush widget",
+             "Allows to draw with round dabs stamped along the stroke instead of the pen, and to change the hardness "
+             "of their edge, their opacity and the spacing between them as a fraction of the brush size. The pressure "
+             "of a tablet pen scales the dabs.", DabBrushWidget, True, True),
+    DockSpec("Brush line type", "Brush line type", "Brush line type widget", "Allows to select the brush line type.",
+             partial(OptionWidget, field="line_type",
+                     choices=tuple(zip(("solid", "dash", "dot", "dash dot", "dash dot dot"), LINE_TYPES))),
+             True, True),
+    DockSpec("Brush cap type", "Brush cap type", "Brush cap type widget", "Allows to select the brush cap type.",
+             partial(OptionWidget, field="cap_type", choices=tuple(zip(("flat", "square", "round"), CAP_TYPES))),
+             True, True),
+    DockSpec("Brush join type", "Brush join type", "Brush join type widget", "Allows to select the brush join type.",
+             partial(OptionWidget, field="join_type", choices=tuple(zip(("miter", "bevel", "round"), JOIN_TYPES))),
+             True, True),
+    DockSpec("Fill", "Fill", "Fill widget",
+             "Allows to change the tolerance of the fill mode, the largest difference on each color channel of the "
+             "filled pixels, and to fill across the pixel corners.", FillWidget, True, True),
+    DockSpec("Layers", "Layers", "Layers widget",
+             "Allows to add, remove and reorder the layers of the picture and to select the layer to draw on. The "
+             "selected layer can be hidden, made translucent with its opacity and blended with the layers below it "
+             "with a blend mode.", LayersWidget, True, False),
+)
+
+
+# This class is a dock whose widget is built the first time the dock is shown, so that the hidden docks cost
+# nothing at startup. The help of the dock does not need its widget.
+class LazyDock(QDockWidget):
+    def __init__(self, spec, painter):
+        super().__init__(spec.title)
+        self.spec = spec
+        self.painter = painter
+        self.setAccessibleName(spec.name)
+        self.setAccessibleDescription(spec.description)
+        self.setFixedWidth(200)
+
+    # function that returns the widget of the dock, building it the first time
+    def content(self):
+        if self.widget() is None:
+            widget = self.spec.build(self.painter)
+            widget.setAccessibleName(self.spec.name)
+            widget.setAccessibleDescription(self.spec.description)
+            self.setWidget(widget)
+            if self.spec.fixed_height:
+                self.setMaximumHeight(self.minimumSizeHint().height())
+        return self.widget()
+
+    # show event listener, builds the widget before the dock is displayed
+    def showEvent(self, event):
+        self.content()
+        super().showEvent(event)
 
 
 # This class creates the main window and display all widget and menu that compose the UI.
@@ -371,74 +4385,108 @@ class Window(QMainWindow):
         self.setCentralWidget(self.painter)
         self.painter.show()
 
-        # init draw mode widget
-        self.draw_mode = QDockWidget("Draw mode")
-        self.addDockWidget(Qt.RightDockWidgetArea, self.draw_mode)
-        self.draw_mode.setWidget(DrawModeWidget(self.painter))
-        self.draw_mode.setMaximumHeight(self.draw_mode.minimumSizeHint().height())
-        self.draw_mode.setFixedWidth(200)
-
-        # init brush color widget
-        self.brush_colour = QDockWidget("Brush colour")
-        self.addDockWidget(Qt.RightDockWidgetArea, self.brush_colour)
-        self.brush_colour.setWidget(BrushColorWidget(self.painter))
-        self.brush_colour.setMaximumHeight(self.brush_colour.minimumSizeHint().height())
-        self.brush_colour.setFixedWidth(200)
-
-        # init brush thickness widget
-        self.brush_thickness = QDockWidget("Brush thickness")
-        self.addDockWidget(Qt.RightDockWidgetArea, self.brush_thickness)
-        self.brush_thickness.setWidget(BrushThicknessWidget(self.painter))
-        self.brush_thickness.setMaximumHeight(self.brush_thickness.minimumSizeHint().height())
-        self.brush_thickness.setFixedWidth(200)
-
-        # init brush line type widget
-        self.brush_line_type = QDockWidget("Brush line type")
-        self.addDockWidget(Qt.RightDockWidgetArea, self.brush_line_type)
-        self.brush_line_type.setWidget(BrushLineTypeWidget(self.painter))
-        self.brush_line_type.setMaximumHeight(self.brush_line_type.minimumSizeHint().height())
-        self.brush_line_type.setFixedWidth(200)
-
-        # init brush cap type widget
-        self.brush_cap_type = QDockWidget("Brush cap type")
-        self.addDockWidget(Qt.RightDockWidgetArea, self.brush_cap_type)
-        self.brush_cap_type.setWidget(BrushCapTypeWidget(self.painter))
-        self.brush_cap_type.setMaximumHeight(self.brush_cap_type.minimumSizeHint().height())
-        self.brush_cap_type.setFixedWidth(200)
-
-        # init brush join type widget
-        self.brush_join_type = QDockWidget("Brush join type")
-        self.addDockWidget(Qt.RightDockWidgetArea, self.brush_join_type)
-        self.brush_join_type.setWidget(BrushJoinTypeWidget(self.painter))
-        self.brush_join_type.setMaximumHeight(self.brush_join_type.minimumSizeHint().height())
-        self.brush_join_type.setFixedWidth(200)
+        # init status bar, displays the number of pixels repainted per second and the progress of the saves
+        self.painter.repaint_rate_changed.connect(
+            lambda rate: self.statusBar().showMessage("repainted: " + str(rate) + " px/s"))
+        self.save_progress = QProgressBar()
+        self.save_progress.setMaximumWidth(200)
+        self.save_progress.hide()
+        self.statusBar().addPermanentWidget(self.save_progress)
+
+        # init background saver
+        self.saver = BackgroundSaver()
+        self.saver.progress.connect(self.save_progress.setValue)
+        self.saver.saved.connect(self.saved)
+
+        # filter being applied in the background, None if there is none
+        self.filter_worker = None
+
+        # init docks, the widget of a dock is built the first time it is shown
+        self.docks = []
+        for spec in DOCKS:
+            dock = LazyDock(spec, self.painter)
+            self.addDockWidget(Qt.RightDockWidgetArea, dock)
+            if not spec.visible:
+                dock.hide()
+            self.docks.append(dock)
 
         # init menu
         menu = self.menuBar()
         file_menu = menu.addMenu("File")
+        edit_menu = menu.addMenu("Edit")
+        filters_menu = menu.addMenu("Filters")
         window_menu = menu.addMenu("Window")
         help_menu = menu.addMenu("Help")
 
         # open action
-        open_action = QAction(QIcon("./icons/open.png"), "Open", self)
+        open_action = QAction(icon("open"), "Open", self)
         open_action.setShortcut("Ctrl+O")
         file_menu.addAction(open_action)
         open_action.triggered.connect(self.open)
 
         # save action
-        save_action = QAction(QIcon("./icons/save.png"), "Save", self)
+        save_action = QAction(icon("save"), "Save", self)
         save_action.setShortcut("Ctrl+S")
         file_menu.addAction(save_action)
         save_action.triggered.connect(self.save)
 
+        # save strokes action
+        save_strokes_action = QAction(icon("save"), "Save strokes", self)
+        save_strokes_action.setShortcut("Ctrl+Shift+S")
+        file_menu.addAction(save_strokes_action)
+        save_strokes_action.triggered.connect(self.save_strokes)
+
+        # export action
+        export_action = QAction(icon("save"), "Export at scale", self)
+        export_action.setShortcut("Ctrl+E")
+        file_menu.addAction(export_action)
+        export_action.triggered.connect(self.export)
+
+        # export performance data action
+        export_perf_action = QAction(icon("save"), "Export performance data", self)
+        file_menu.addAction(export_perf_action)
+        export_perf_action.triggered.connect(self.export_performance)
+
         # clear action
-        clear_action = QAction(QIcon("./icons/clear.png"), "Clear", self)
+        clear_action = QAction(icon("clear"), "Clear", self)
         clear_action.setShortcut("Ctrl+C")
         file_menu.addAction(clear_action)
         clear_action.triggered.connect(self.clear)
 
+        # undo action
+        undo_action = QAction("Undo", self)
+        undo_action.setShortcut("Ctrl+Z")
+        edit_menu.addAction(undo_action)
+        undo_action.triggered.connect(self.painter.undo)
+
+        # redo action
+        redo_action = QAction("Redo", self)
+        redo_action.setShortcut("Ctrl+Y")
+        edit_menu.addAction(redo_action)
+        redo_action.triggered.connect(self.painter.redo)
+
+        # copy, cut and paste actions, ctrl + C and ctrl + X being the clear and exit actions
+        copy_action = QAction("Copy", self)
+        copy_action.setShortcut("Ctrl+Shift+C")
+        edit_menu.addAction(copy_action)
+        copy_action.triggered.connect(self.painter.copy_selection)
+        cut_action = QAction("Cut", self)
+        cut_action.setShortcut("Ctrl+Shift+X")
+        edit_menu.addAction(cut_action)
+        cut_action.triggered.connect(self.painter.cut_selection)
+        paste_action = QAction("Paste", self)
+        paste_action.setShortcut("Ctrl+V")
+        edit_menu.addAction(paste_action)
+        paste_action.triggered.connect(self.painter.paste_clipboard)
+
+        # filter actions
+        for filter_type in FILTERS.values():
+            filter_action = QAction(filter_type.name, self)
+            filters_menu.addAction(filter_action)
+            filter_action.triggered.connect(lambda checked, filter_type=filter_type: self.apply_filter(filter_type))
+
         # exit action
-        exit_action = QAction(QIcon("./icons/exit.png"), "Exit", self)
+        exit_action = QAction(icon("exit"), "Exit", self)
         exit_action.setShortcut("Ctrl+X")
         file_menu.addAction(exit_action)
         exit_action.triggered.connect(self.exit)
@@ -448,135 +4496,245 @@ class Window(QMainWindow):
         help_menu.addAction(help_painter)
         help_painter.triggered.connect(lambda: self.help_about(self.painter))
 
-        # help about draw mode action
-        help_draw_mode = QAction("Draw mode", self)
-        help_menu.addAction(help_draw_mode)
-        help_draw_mode.triggered.connect(lambda: self.help_about(self.draw_mode.widget()))
-
-        # help about brush color action
-        help_brush_color = QAction("Brush color", self)
-        help_menu.addAction(help_brush_color)
-        help_brush_color.triggered.connect(lambda: self.help_about(self.brush_colour.widget()))
-
-        # help about brush thickness action
-        help_brush_thickness = QAction("Brush thickness", self)
-        help_menu.addAction(help_brush_thickness)
-        help_brush_thickness.triggered.connect(lambda: self.help_about(self.brush_thickness.widget()))
-
-        # help about brush line type action
-        help_brush_line = QAction("Brush line type", self)
-        help_menu.addAction(help_brush_line)
-        help_brush_line.triggered.connect(lambda: self.help_about(self.brush_line_type.widget()))
-
-        # help about brush cap type action
-        help_brush_line = QAction("Brush cap type", self)
-        help_menu.addAction(help_brush_line)
-        help_brush_line.triggered.connect(lambda: self.help_about(self.brush_cap_type.widget()))
-
-        # help about brush join type action
-        help_brush_join = QAction("Brush join type", self)
-        help_menu.addAction(help_brush_join)
-        help_brush_join.triggered.connect(lambda: self.help_about(self.brush_join_type.widget()))
+        # help about dock actions
+        for dock in self.docks:
+            help_dock = QAction(dock.spec.label, self)
+            help_menu.addAction(help_dock)
+            help_dock.triggered.connect(lambda checked, dock=dock: self.help_about(dock))
 
         # general help action
-        help_general = QAction(QIcon("./icons/help.png"), "General help", self)
+        help_general = QAction(icon("help"), "General help", self)
         help_general.setShortcut("Ctrl+H")
         help_menu.addAction(help_general)
         help_general.triggered.connect(self.general_help)
 
-        # ui draw mode widget action
-        ui_draw_mode = QAction("Draw mode", self)
-        window_menu.addAction(ui_draw_mode)
-        ui_draw_mode.setCheckable(True)
-        ui_draw_mode.setChecked(True)
-        ui_draw_mode.changed.connect(
-            lambda: self.set_widget_visibility(self.draw_mode, ui_draw_mode.isChecked()))
-        self.draw_mode.visibilityChanged.connect(lambda: self.set_state_menu_ui(self.draw_mode, ui_draw_mode))
-
-        # ui brush color widget action
-        ui_brush_color = QAction("Brush color", self)
-        window_menu.addAction(ui_brush_color)
-        ui_brush_color.setCheckable(True)
-        ui_brush_color.setChecked(True)
-        ui_brush_color.changed.connect(
-            lambda: self.set_widget_visibility(self.brush_colour, ui_brush_color.isChecked()))
-        self.brush_colour.visibilityChanged.connect(lambda: self.set_state_menu_ui(self.brush_colour, ui_brush_color))
-
-        # ui brush thickness widget action
-        ui_brush_thickness = QAction("Brush thickness", self)
-        window_menu.addAction(ui_brush_thickness)
-        ui_brush_thickness.setCheckable(True)
-        ui_brush_thickness.setChecked(True)
-        ui_brush_thickness.changed.connect(
-            lambda: self.set_widget_visibility(self.brush_thickness, ui_brush_thickness.isChecked()))
-        self.brush_thickness.visibilityChanged.connect(
-            lambda: self.set_state_menu_ui(self.brush_thickness, ui_brush_thickness))
-
-        # ui brush line type widget action
-        ui_brush_line_type = QAction("Brush line type", self)
-        window_menu.addAction(ui_brush_line_type)
-        ui_brush_line_type.setCheckable(True)
-        ui_brush_line_type.setChecked(True)
-        ui_brush_line_type.changed.connect(
-            lambda: self.set_widget_visibility(self.brush_line_type, ui_brush_line_type.isChecked()))
-        self.brush_line_type.visibilityChanged.connect(
-            lambda: self.set_state_menu_ui(self.brush_line_type, ui_brush_line_type))
-
-        # ui brush cap type widget action
-        ui_brush_cap_type = QAction("Brush cap type", self)
-        window_menu.addAction(ui_brush_cap_type)
-        ui_brush_cap_type.setCheckable(True)
-        ui_brush_cap_type.setChecked(True)
-        ui_brush_cap_type.changed.connect(
-            lambda: self.set_widget_visibility(self.brush_cap_type, ui_brush_cap_type.isChecked()))
-        self.brush_cap_type.visibilityChanged.connect(
-            lambda: self.set_state_menu_ui(self.brush_cap_type, ui_brush_cap_type))
-
-        # ui brush join type widget action
-        ui_brush_join_type = QAction("Brush join type", self)
-        window_menu.addAction(ui_brush_join_type)
-        ui_brush_join_type.setCheckable(True)
-        ui_brush_join_type.setChecked(True)
-        ui_brush_join_type.changed.connect(
-            lambda: self.set_widget_visibility(self.brush_join_type, ui_brush_join_type.isChecked()))
-        self.brush_join_type.visibilityChanged.connect(
-            lambda: self.set_state_menu_ui(self.brush_join_type, ui_brush_join_type))
+        # memory report action
+        help_memory = QAction("Memory report", self)
+        help_menu.addAction(help_memory)
+        help_memory.triggered.connect(lambda: self.memory_report(self.painter))
+
+        # ui dock actions
+        for dock in self.docks:
+            ui_dock = QAction(dock.spec.label, self)
+            window_menu.addAction(ui_dock)
+            ui_dock.setCheckable(True)
+            ui_dock.setChecked(dock.spec.visible)
+            ui_dock.changed.connect(
+                lambda dock=dock, ui_dock=ui_dock: self.set_widget_visibility(dock, ui_dock.isChecked()))
+            dock.visibilityChanged.connect(
+                lambda visible, dock=dock, ui_dock=ui_dock: self.set_state_menu_ui(dock, ui_dock))
+
+        # performance overlay action
+        ui_performance = QAction("Performance overlay", self)
+        ui_performance.setShortcut("F3")
+        window_menu.addAction(ui_performance)
+        ui_performance.setCheckable(True)
+        ui_performance.toggled.connect(self.painter.set_hud_visible)
 
     # function that allows to open an image
     def open(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "Images (*.png *.jpg)")
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Image", "",
+                                                   "Images (*.png *.jpg);;Projects (*.paint);;Strokes (*.strokes)")
         if file_path == "":
             return
-        res = self.painter.image.load(file_path)
-        if res:
-            self.painter.image = self.painter.image.scaled(self.painter.width(), self.painter.height())
-            self.painter.update()
-            print("Image successfully loaded")
-        else:
-            print("Cannot open image")
+        if file_path.endswith(".paint"):
+            try:
+                canvas = ProjectFile.load(file_path)
+            except (OSError, ValueError) as error:
+                print("Cannot open project: " + str(error))
+                return
+            self.painter.set_canvas(canvas)
+            print("Project successfully loaded")
+            return
+        if file_path.endswith(".strokes"):
+            try:
+                log = StrokeLog.load(file_path)
+            except (OSError, ValueError) as error:
+                print("Cannot open strokes: " + str(error))
+                return
+            self.painter.set_canvas(log.rasterize(), log)
+            print("Strokes successfully loaded")
+            return
+        try:
+            canvas = TiledImage.open(file_path, self.painter.size() * 2)
+        except ValueError as error:
+            print("Cannot open image: " + str(error))
+            return
+        self.painter.set_canvas(canvas)
+        print("Image successfully opened, loading in the background")
 
     # function that allows to save an image
     def save(self):
         current_path = os.getcwd()
-        file_path, _ = QFileDialog.getSaveFileName(self, "Save Image", current_path + "/untitled.png",
+        project = self.painter.layers.image().project
+        default_path = project.file_path if project is not None else current_path + "/untitled.png"
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Image", default_path,
+                                                   "Images (*.png *.jpg);;Projects (*.paint)")
+        if file_path == "":
+            return
+        self.painter.anchor_selection()
+        if file_path.endswith(".paint"):
+            try:
+                self.painter.save_project(file_path)
+                print("Project successfully saved")
+            except OSError as error:
+                print("Cannot save project: " + str(error))
+            return
+        self.save_progress.setValue(0)
+        self.save_progress.show()
+        self.saver.save(self.painter.snapshot(), file_path)
+
+    # function called when a background save ends
+    def saved(self, file_path, error, longest_stall):
+        if self.saver.worker is None:
+            self.save_progress.hide()
+        if error == "":
+            message = "Image successfully saved"
+        else:
+            message = "Cannot save image: " + error
+        print(message)
+        self.statusBar().showMessage(message + " (" + file_path + "), longest GUI stall: " + str(longest_stall) + " ms",
+                                     5000)
+
+    # function that allows to save the strokes drawn on the active layer since its sheet has been created or opened
+    def save_strokes(self):
+        current_path = os.getcwd()
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Strokes", current_path + "/untitled.strokes",
+                                                   "Strokes (*.strokes)")
+        if file_path == "":
+            return
+        self.painter.anchor_selection()
+        try:
+            self.painter.log.save(file_path)
+            print("Strokes successfully saved")
+        except OSError as error:
+            print("Cannot save strokes: " + str(error))
+
+    # function that allows to save an image rasterized again from the strokes at another scale
+    def export(self):
+        scale, ok = QInputDialog.getDouble(self, "Export at scale", "scale:", 2.0, 0.1, 16.0, 2)
+        if not ok:
+            return
+        current_path = os.getcwd()
+        file_path, _ = QFileDialog.getSaveFileName(self, "Export Image", current_path + "/untitled.png",
                                                    "Images (*.png *.jpg)")
         if file_path == "":
             return
-        res = self.painter.image.save(file_path)
+        self.painter.anchor_selection()
+        res = self.painter.layers.rasterize(scale).to_image().save(file_path)
         if res:
-            print("Image successfully saved")
+            print("Image successfully exported")
         else:
-            print("Cannot save image")
+            print("Cannot export image")
+
+    # function that exports the measures of the performance overlay in JSON or CSV
+    def export_performance(self):
+        current_path = os.getcwd()
+        file_path, _ = QFileDialog.getSaveFileName(self, "Export performance data", current_path + "/perf.json",
+                                                   "JSON (*.json);;CSV (*.csv)")
+        if file_path == "":
+            return
+        try:
+            self.painter.perf.export(file_path)
+            print("Performance data successfully exported")
+        except OSError as error:
+            print("Cannot export performance data: " + str(error))
+
+    # function that applies a filter to the sheet, after setting its parameters in a dialog. The filter is applied
+    # in the background while a progress dialog allows to cancel it.
+    def apply_filter(self, filter_type):
+        if self.filter_worker is not None:
+            return
+        dialog = FilterDialog(self.painter.canvas, filter_type, self)
+        if dialog.exec() != QDialog.Accepted:
+            return
+        worker = FilterWorker(self.painter.canvas.snapshot(), dialog.image_filter())
+        progress = QProgressDialog(filter_type.name + "...", "Cancel", 0, 100, self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.canceled.connect(worker.requestInterruption)
+        worker.progress.connect(progress.setValue)
+        worker.finished.connect(lambda: self.filter_finished(worker, progress))
+        self.filter_worker = worker
+        worker.start()
+
+    # function called when a filter has been applied or cancelled
+    def filter_finished(self, worker, progress):
+        self.filter_worker = None
+        progress.reset()
+        if worker.result is None:
+            self.statusBar().showMessage(worker.filter_pass.filter.name + " cancelled", 5000)
+            return
+        self.painter.apply_filter(FilterRecord(worker.filter_pass.filter), *worker.result)
 
     # function that allows to clear the paint area
     def clear(self):
-        self.painter.image.fill(Qt.white)
-        self.update()
+        self.painter.clear()
 
     # function to quit the program
     def exit(self):
         self.close()
 
+    # close event listener, waits for the image being loaded and the saves in progress
+    def closeEvent(self, event):
+        self.painter.end_stroke()
+        self.painter.canvas.finish_loading()
+        if self.filter_worker is not None:
+            self.filter_worker.finished.disconnect()
+            self.filter_worker.requestInterruption()
+            self.filter_worker.wait()
+        self.saver.finish()
+        if self.painter.journal is not None:
+            self.painter.journal.close()
+        if self.painter.mirror is not None:
+            self.painter.mirror.close()
+        event.accept()
+
+    # function called once the first frame has been painted, displays the time elapsed since the start of the program
+    # and starts the initialization that can wait: the journal, and the import of numpy in the background. Without a
+    # journal directory, the startup time is printed and the program ends.
+    def started(self, start_time, journal_directory):
+        startup = (time.perf_counter() - start_time) * 1000
+        if journal_directory is None:
+            print("startup: " + format(startup, ".1f") + " ms to first paint")
+            self.close()
+            return
+        self.statusBar().showMessage("started in " + format(startup, ".0f") + " ms", 5000)
+        self.enable_journal(journal_directory)
+        threading.Thread(target=partial(importlib.import_module, "numpy"), daemon=True).start()
+
+    # function that journals the actions on the sheet in a directory, recovering first the sheet of a session that
+    # did not end cleanly. Journaling is disabled if another running program uses the directory.
+    def enable_journal(self, directory):
+        if Journal.locked(directory):
+            print("Another session is using " + directory + ", journaling disabled")
+            return
+        recovered = Journal.recover(directory) if Journal.unclean(directory) else None
+        if recovered is not None:
+            canvas, log, history = recovered
+            self.painter.set_canvas(canvas, log)
+            self.painter.history = history
+            print("Sheet recovered from the last session")
+            self.statusBar().showMessage("Sheet recovered from the last session", 5000)
+        self.painter.journal = Journal(directory, self.painter)
+        self.painter.journal.start(recovered is None)
+
+    # function that publishes the drawing session to the viewers connecting to an address, host:port or the path of a
+    # Unix socket
+    def enable_mirror(self, address):
+        try:
+            server = MirrorServer(address)
+        except ValueError:
+            print("Invalid mirror address " + address + ", mirroring disabled")
+            return
+        server.start()
+        server.ready.wait()
+        if server.error is not None:
+            server.wait()
+            print("Cannot mirror on " + address + ": " + server.error)
+            return
+        self.painter.mirror = Mirror(self.painter, server)
+        self.statusBar().showMessage("Mirroring on " + str(server.address()), 5000)
+
     # function that displays the general help
     @staticmethod
     def general_help():
@@ -586,6 +4744,16 @@ class Window(QMainWindow):
         modal.setText(message)
         modal.exec()
 
+    # function that displays the memory used by the tiles of the sheet and by the stroke log
+    @staticmethod
+    def memory_report(painter):
+        modal = QMessageBox()
+        modal.setWindowTitle("Memory report")
+        modal.setText(painter.canvas.memory_report() + "\nstroke log: " + str(len(painter.log.records)) + " records ("
+                      + str(painter.log.byte_size() // 1024) + " KB)\nlayers: " + str(len(painter.layers.layers))
+                      + ", composited tiles: " + str(len(painter.layers.composite.tiles)))
+        modal.exec()
+
     # function that displays information about a widget
     @staticmethod
     def help_about(widget):
@@ -609,9 +4777,129 @@ class Window(QMainWindow):
         ui_option.setChecked(widget.isVisible())
 
 
+# function that initializes a process of the batch renderer, rendering needs a Qt application but no display
+def init_render_worker():
+    global render_app
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    render_app = QGuiApplication(["paint"])
+
+
+# function that renders a stroke file or an image, returns the input path and an error message or None
+def render_file(job):
+    input_path, output_path, scale = job
+    try:
+        if input_path.endswith(".strokes"):
+            log = StrokeLog.load(input_path)
+        else:
+            image = QImage()
+            if not image.load(input_path):
+                raise ValueError("cannot decode image")
+            canvas = TiledImage.from_image(image)
+            log = StrokeLog(canvas.width, canvas.height, canvas)
+        if not log.rasterize(scale).to_image().save(output_path):
+            raise ValueError("cannot write " + output_path)
+    except (OSError, ValueError) as error:
+        return input_path, str(error)
+    except Exception as error:
+        # any other error of the replay is reported for the input too, the renderer stops on it like on corrupt data
+        return input_path, type(error).__name__ + ": " + str(error)
+    return input_path, None
+
+
+# function that parses a number of worker processes of the batch renderer, which must be at least one
+def job_count(text):
+    count = int(text)
+    if count < 1:
+        raise argparse.ArgumentTypeError("the number of worker processes must be at least 1")
+    return count
+
+
+# function that parses the scale of the images rendered by the batch renderer, which must be a positive number
+def render_scale(text):
+    scale = float(text)
+    if not math.isfinite(scale) or scale <= 0:
+        raise argparse.ArgumentTypeError("the scale must be a positive number")
+    return scale
+
+
+# function that renders stroke files and images without a display, spreading them over a pool of processes.
+# It rejects inputs that would be rendered to the same file and stops at the first input that cannot be rendered.
+def render_main(argv):
+    parser = argparse.ArgumentParser(prog="paint.py render", description="Render stroke files and images.")
+    parser.add_argument("inputs", nargs="+", help="stroke files (.strokes) or images to render")
+    parser.add_argument("-o", "--output", default=".", help="output directory")
+    parser.add_argument("-f", "--format", default="png", choices=["png", "jpg"], help="output format")
+    parser.add_argument("-s", "--scale", type=render_scale, default=1.0, help="scale of the rendered images")
+    parser.add_argument("-j", "--jobs", type=job_count, default=os.cpu_count() or 1, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    jobs = [(path, os.path.join(args.output, os.path.splitext(os.path.basename(path))[0] + "." + args.format),
+             args.scale) for path in args.inputs]
+    outputs = {}
+    for input_path, output_path, _ in jobs:
+        key = os.path.normcase(os.path.abspath(output_path))
+        if key in outputs:
+            parser.error(outputs[key] + " and " + input_path + " would both be rendered to " + output_path)
+        outputs[key] = input_path
+    os.makedirs(args.output, exist_ok=True)
+    start = time.perf_counter()
+    rendered = 0
+    with multiprocessing.get_context("spawn").Pool(min(args.jobs, len(jobs)), init_render_worker) as pool:
+        for input_path, error in pool.imap_unordered(render_file, jobs):
+            if error is not None:
+                pool.terminate()
+                print("Cannot render " + input_path + ": " + error, file=sys.stderr)
+                return 1
+            rendered += 1
+    elapsed = time.perf_counter() - start
+    print(str(rendered) + " images rendered in " + format(elapsed, ".2f") + " s, "
+          + format(rendered / elapsed, ".1f") + " images/s")
+    return 0
+
+
+# function that shows in a window the drawing session of another instance of the program mirroring it
+def view_main(argv):
+    parser = argparse.ArgumentParser(prog="paint.py view", description="Show live the drawing session of another "
+                                                                       "instance started with --mirror ADDRESS.")
+    parser.add_argument("address", help="address of the mirror: host:port or the path of a Unix socket")
+    args = parser.parse_args(argv)
+    try:
+        mirror_address(args.address)
+    except ValueError:
+        parser.error("invalid address: " + args.address)
+
+    app = QApplication(sys.argv[:1])
+    painter = Painter()
+    painter.read_only = True
+    painter.set_hud_visible(True)
+    painter.setWindowTitle("Paint viewer - " + args.address)
+    painter.resize(1280, 720)
+    viewer = MirrorViewer(painter, args.address)
+    viewer.client.closed.connect(lambda reason: painter.setWindowTitle("Paint viewer - " + args.address + " ("
+                                                                       + reason + ")"))
+    painter.show()
+    viewer.start()
+    status = app.exec()
+    viewer.stop()
+    return status
+
+
 # This is the entry point of the program.
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "render":
+        sys.exit(render_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "view":
+        sys.exit(view_main(sys.argv[2:]))
+    start_time = time.perf_counter()
     app = QApplication(sys.argv)
     window = Window()
+    if "--startup-time" in sys.argv:
+        journal_directory = None
+    else:
+        journal_directory = os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppLocalDataLocation),
+                                         "recovery")
+    window.painter.on_first_paint = lambda: window.started(start_time, journal_directory)
+    if "--mirror" in sys.argv[:-1]:
+        window.enable_mirror(sys.argv[sys.argv.index("--mirror") + 1])
     window.show()
     app.exec()
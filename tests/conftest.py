@@ -0,0 +1,14 @@
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+import pytest
+
+
+# fixture that returns the application, created once since Qt allows a single one per process
+@pytest.fixture(scope="session")
+def app():
+    return QApplication.instance() or QApplication([])
@@ -0,0 +1,54 @@
+from PyQt5.QtCore import Qt, QPointF, QRect
+from PyQt5.QtGui import QColor, QPainter, QPen
+from paint import TiledImage, TILE_SIZE, flood_fill
+import pytest
+
+
+# function that draws the outline of a rectangle on the sheet, across several tiles
+def draw_rect(canvas, rect, color):
+    for key in canvas.keys_in(rect.adjusted(-2, -2, 2, 2)):
+        painter = QPainter(canvas.writable_tile(key))
+        painter.translate(-key[0] * TILE_SIZE, -key[1] * TILE_SIZE)
+        painter.setPen(QPen(QColor(color), 3))
+        painter.drawRect(rect)
+        painter.end()
+
+
+# function that returns the color of a pixel of the sheet as an argb integer
+def pixel(canvas, x, y):
+    return canvas.tile((x // TILE_SIZE, y // TILE_SIZE)).pixel(x % TILE_SIZE, y % TILE_SIZE)
+
+
+@pytest.mark.parametrize("color", [Qt.white, Qt.transparent])
+@pytest.mark.parametrize("tolerance", [0, 16])
+def test_fill_stays_inside_closed_outline(app, color, tolerance):
+    canvas = TiledImage(700, 600, color)
+    outline = QRect(200, 150, 300, 300)
+    draw_rect(canvas, outline, Qt.black)
+    red = QColor(Qt.red).rgba()
+    rect = flood_fill(canvas, QPointF(350, 300), red, tolerance)
+    assert outline.adjusted(-2, -2, 2, 2).contains(rect)
+    assert pixel(canvas, 350, 300) == red
+    assert pixel(canvas, 100, 100) == QColor(color).rgba()
+    assert pixel(canvas, 200, 300) == QColor(Qt.black).rgba()
+
+
+def test_fill_covers_connected_area(app):
+    canvas = TiledImage(600, 300)
+    blue = QColor(Qt.blue).rgba()
+    rect = flood_fill(canvas, QPointF(10, 10), blue)
+    assert rect == canvas.rect()
+    assert pixel(canvas, 599, 299) == blue
+    assert flood_fill(canvas, QPointF(-1, 10), blue) is None
+
+
+def test_connectivity_crosses_diagonal_gaps_only_with_8_neighbors(app):
+    for connectivity, expected in ((4, False), (8, True)):
+        canvas = TiledImage(64, 64)
+        painter = QPainter(canvas.writable_tile((0, 0)))
+        for i in range(64):
+            # a diagonal line of single pixels closes the top left corner for 4 neighbors only
+            painter.fillRect(i, 63 - i, 1, 1, Qt.black)
+        painter.end()
+        flood_fill(canvas, QPointF(2, 2), QColor(Qt.red).rgba(), 0, connectivity)
+        assert (pixel(canvas, 62, 62) == QColor(Qt.red).rgba()) == expected
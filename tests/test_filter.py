@@ -0,0 +1,35 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor, QPainter, QImage
+from paint import TiledImage, FilterPass, BlurFilter, InvertFilter, LevelsFilter
+
+
+# function that returns a transparent sheet with a half transparent red square, filtered
+def filtered(image_filter):
+    canvas = TiledImage(256, 256, Qt.transparent)
+    painter = QPainter(canvas.writable_tile((0, 0)))
+    painter.setCompositionMode(QPainter.CompositionMode_Source)
+    painter.fillRect(100, 100, 50, 50, QColor(255, 0, 0, 128))
+    painter.end()
+    canvas.replace(*FilterPass(canvas, image_filter).run())
+    return canvas.tile((0, 0)).convertToFormat(QImage.Format_ARGB32)
+
+
+def test_invert_changes_the_colors_not_the_alpha(app):
+    color = filtered(InvertFilter()).pixelColor(120, 120)
+    assert color.alpha() == 128
+    assert (color.red(), color.green(), color.blue()) in ((0, 255, 255), (0, 254, 254))
+    assert filtered(InvertFilter()).pixelColor(10, 10).alpha() == 0
+
+
+def test_levels_keep_the_colors_of_opaque_channels(app):
+    color = filtered(LevelsFilter(0, 100)).pixelColor(120, 120)
+    assert color.alpha() == 128
+    assert abs(color.red() - 255) <= 2 and color.green() == 0
+
+
+def test_blur_spreads_the_alpha_channel(app):
+    tile = filtered(BlurFilter(4))
+    outside = tile.pixelColor(98, 125)
+    assert 0 < outside.alpha() < 128
+    assert abs(outside.red() - 255) <= 8 and outside.green() == 0
+    assert tile.pixelColor(125, 125).alpha() == 128
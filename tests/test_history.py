@@ -0,0 +1,54 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor, QPainter
+from paint import History, Layer, LayerStack, StrokeLog, TiledImage, HISTORY_BUDGET, TILE_SIZE
+
+
+# function that draws a rectangle on the sheet as one change and returns it
+def draw_change(canvas, x, y, color):
+    canvas.begin_change()
+    painter = QPainter(canvas.writable_tile((x // TILE_SIZE, y // TILE_SIZE)))
+    painter.fillRect(x % TILE_SIZE, y % TILE_SIZE, 40, 40, QColor(color))
+    painter.end()
+    return canvas.end_change()
+
+
+# function that returns the number of bytes used by the changes kept in a history
+def stacks_size(history):
+    return sum(change.byte_size() for change in history.undo_stack + history.redo_stack)
+
+
+def test_size_follows_undo_push_and_compress(app):
+    canvas = TiledImage(1024, 1024)
+    history = History()
+    for i in range(5):
+        history.push(draw_change(canvas, i * 100, 100, Qt.red))
+        history.undo(canvas)
+        history.push(draw_change(canvas, i * 100, 300, Qt.blue))
+        history.compress()
+        assert history.byte_size() == stacks_size(history)
+    history.undo(canvas)
+    history.undo(canvas)
+    history.redo(canvas)
+    assert history.byte_size() == stacks_size(history)
+    history.compress()
+    assert history.byte_size() == stacks_size(history)
+
+
+def test_budget_drops_oldest_changes(app):
+    canvas = TiledImage(2048, 2048)
+    budget = 4 * TILE_SIZE * TILE_SIZE * 4
+    history = History(budget)
+    for i in range(40):
+        history.push(draw_change(canvas, (i % 8) * TILE_SIZE, (i // 8) * TILE_SIZE, QColor(i * 5, 0, 0)))
+        assert history.byte_size() == stacks_size(history)
+    history.compress()
+    assert history.byte_size() == stacks_size(history) <= budget
+
+
+def test_layers_share_the_budget(app):
+    layers = LayerStack([Layer("Background", TiledImage(512, 512), StrokeLog(512, 512))])
+    for _ in range(3):
+        layers.add()
+    assert sum(layer.history.budget for layer in layers.layers) <= HISTORY_BUDGET
+    layers.remove()
+    assert [layer.history.budget for layer in layers.layers] == [HISTORY_BUDGET // 3] * 3
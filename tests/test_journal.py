@@ -0,0 +1,17 @@
+from paint import Journal, Painter
+
+
+# function that returns the names of the files of a directory
+def names(directory):
+    return sorted(path.name for path in directory.iterdir())
+
+
+def test_partial_checkpoints_are_removed(app, tmp_path):
+    for name in ("checkpoint-00000001.paint.part", "checkpoint-00000002.paint", "checkpoint-00000003.paint.part",
+                 "journal-00000003.bin"):
+        (tmp_path / name).write_bytes(b"")
+    journal = Journal(str(tmp_path), Painter())
+    journal.remove_files(2)
+    assert names(tmp_path) == ["checkpoint-00000002.paint", "checkpoint-00000003.paint.part", "journal-00000003.bin"]
+    journal.close()
+    assert names(tmp_path) == []
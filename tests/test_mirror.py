@@ -0,0 +1,23 @@
+from PyQt5.QtGui import QImage
+from paint import MirrorDecoder, MirrorServer, MIRROR_SHEET, MIRROR_SHEET_MESSAGE
+import pytest
+
+
+@pytest.mark.parametrize("tile_format", [QImage.Format_RGB32, QImage.Format_ARGB32_Premultiplied])
+def test_sheet_message_keeps_the_tile_format(tile_format):
+    messages = MirrorDecoder().decode(MIRROR_SHEET_MESSAGE.pack(MIRROR_SHEET, 600, 300, int(tile_format)))
+    assert messages == [(MIRROR_SHEET, 600, 300, tile_format)]
+
+
+@pytest.mark.parametrize("tile_format", [QImage.Format_Invalid, QImage.Format_Mono, QImage.Format_RGB888, 200])
+def test_sheet_message_with_another_tile_format_is_rejected(tile_format):
+    with pytest.raises(ValueError):
+        MirrorDecoder().decode(MIRROR_SHEET_MESSAGE.pack(MIRROR_SHEET, 600, 300, int(tile_format)))
+
+
+def test_server_stopped_right_after_its_start(app):
+    for _ in range(20):
+        server = MirrorServer("127.0.0.1:0")
+        server.start()
+        server.stop()
+        assert server.isFinished()
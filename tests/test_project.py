@@ -0,0 +1,40 @@
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtGui import QColor, QPainter
+from paint import ProjectFile, TiledImage, PROJECT_HEADER, PROJECT_MAGIC, TILE_SIZE
+import pytest
+import gc
+
+
+def test_project_round_trip(app, tmp_path):
+    canvas = TiledImage(600, 300)
+    painter = QPainter(canvas.writable_tile((1, 0)))
+    painter.fillRect(10, 10, 50, 50, Qt.red)
+    painter.end()
+    file_path = str(tmp_path / "sheet.paint")
+    ProjectFile.save(canvas, file_path)
+    loaded = ProjectFile.load(file_path)
+    assert (loaded.width, loaded.height) == (600, 300)
+    assert loaded.to_image() == canvas.to_image()
+
+
+@pytest.mark.parametrize("width, height", [(0, 300), (600, 0)])
+def test_project_with_empty_sheet_is_rejected(app, tmp_path, width, height):
+    file_path = tmp_path / "empty.paint"
+    file_path.write_bytes(PROJECT_HEADER.pack(PROJECT_MAGIC, 1, TILE_SIZE, width, height, 0xffffffff,
+                                              PROJECT_HEADER.size, 0))
+    with pytest.raises(ValueError):
+        ProjectFile.load(str(file_path))
+
+
+def test_view_outlives_the_project_sheet(app, tmp_path):
+    canvas = TiledImage(600, 600)
+    painter = QPainter(canvas.writable_tile((1, 1)))
+    painter.fillRect(0, 0, TILE_SIZE, TILE_SIZE, Qt.red)
+    painter.end()
+    file_path = str(tmp_path / "sheet.paint")
+    ProjectFile.save(canvas, file_path)
+    loaded = ProjectFile.load(file_path)
+    view = loaded.view(QRect(300, 300, 100, 100))
+    del loaded
+    gc.collect()
+    assert view.tiles[(1, 1)].pixel(50, 50) == QColor(Qt.red).rgb()
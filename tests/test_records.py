@@ -0,0 +1,141 @@
+from array import array
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtGui import QColor, QPainter
+from paint import BrushSpec, BrushEngine, DrawMode, StrokeRecord, DabRecord, ClearRecord, FillRecord, FilterRecord, \
+    BlurFilter, SharpenFilter, LevelsFilter, InvertFilter, EraseRecord, MoveRecord, PasteRecord, TiledImage, \
+    decode_record, RECORD_PASTE, PASTE_RECORD
+import pytest
+import math
+import zlib
+
+RED = QColor(255, 0, 0).rgba()
+
+
+# function that encodes a record between two other bytes, decodes it and checks that the whole record was read
+def round_trip(record):
+    data = b"\xff" + record.encode() + b"\xff"
+    decoded, offset = decode_record(data, 1)
+    assert offset == len(data) - 1
+    return decoded
+
+
+# function that checks that every truncation of the binary form of a record is rejected
+def check_truncations(record):
+    data = record.encode()
+    for length in range(1, len(data)):
+        with pytest.raises(ValueError):
+            decode_record(data[:length], 0)
+
+
+@pytest.mark.parametrize("mode", [DrawMode.CURVE, DrawMode.LINE])
+def test_stroke_record_round_trip(mode):
+    brush = BrushSpec(12.5, RED, Qt.DashLine, Qt.FlatCap, Qt.BevelJoin)
+    record = StrokeRecord(brush, mode, array("f", [1.5, 2.0, 30.25, 40.0, 100.0, 7.75]))
+    decoded = round_trip(record)
+    assert type(decoded) is StrokeRecord
+    assert decoded.brush == brush
+    assert decoded.mode == mode
+    assert decoded.points == record.points
+
+
+def test_clear_record_round_trip():
+    assert round_trip(ClearRecord(RED)) == ClearRecord(RED)
+
+
+def test_truncated_strokes_are_rejected():
+    check_truncations(StrokeRecord(BrushSpec(6, RED, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin), DrawMode.LINE,
+                                   array("f", [1.0, 2.0, 3.0, 4.0])))
+    check_truncations(ClearRecord(RED))
+
+
+@pytest.mark.parametrize("data", [
+    b"\x03",
+    b"\xff\x00\x00\x00\x00",
+    StrokeRecord(BrushSpec(0, RED, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin), DrawMode.LINE).encode(),
+])
+def test_invalid_strokes_are_rejected(data):
+    with pytest.raises(ValueError):
+        decode_record(data, 0)
+
+
+@pytest.mark.parametrize("record", [
+    FillRecord(10.5, 20.25, RED, 16, 4),
+    FillRecord(0.0, 0.0, QColor(Qt.transparent).rgba(), 0, 8),
+])
+def test_fill_record_round_trip(record):
+    assert round_trip(record) == record
+
+
+def test_invalid_fills_are_rejected():
+    check_truncations(FillRecord(1.0, 2.0, RED, 0, 4))
+    with pytest.raises(ValueError):
+        decode_record(FillRecord(1.0, 2.0, RED, 0, 6).encode(), 0)
+
+
+@pytest.mark.parametrize("x, y", [(math.inf, 2.0), (1.0, -math.inf), (math.nan, 2.0)])
+def test_fills_with_infinite_points_are_rejected(x, y):
+    with pytest.raises(ValueError):
+        decode_record(FillRecord(x, y, RED, 0, 4).encode(), 0)
+
+
+@pytest.mark.parametrize("image_filter", [BlurFilter(2.5), SharpenFilter(1.5, 0.75), LevelsFilter(-20.0, 150.0),
+                                          InvertFilter()])
+def test_filter_record_round_trip(image_filter):
+    decoded = round_trip(FilterRecord(image_filter))
+    assert type(decoded.filter) is type(image_filter)
+    assert decoded == FilterRecord(image_filter)
+
+
+def test_invalid_filters_are_rejected():
+    check_truncations(FilterRecord(BlurFilter(2.0)))
+    with pytest.raises(ValueError):
+        decode_record(b"\x05\xff" + bytes(8), 0)
+
+
+@pytest.mark.parametrize("image_filter", [BlurFilter(1e6), BlurFilter(-3.0), BlurFilter(math.nan), BlurFilter(math.inf),
+                                          SharpenFilter(2.0, 1000.0), SharpenFilter(0.0, 100.0),
+                                          LevelsFilter(-math.inf, 100.0), LevelsFilter(0.0, math.nan)])
+def test_filters_out_of_range_are_rejected(image_filter):
+    with pytest.raises(ValueError):
+        decode_record(FilterRecord(image_filter).encode(), 0)
+
+
+def test_dab_record_round_trip():
+    brush = BrushSpec(20.0, RED, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin, BrushEngine.DAB, 0.5, 0.75, 0.25)
+    record = DabRecord(brush, DrawMode.CURVE, array("f", [1.5, 2.0, 0.25, 30.25, 40.0, 1.0]))
+    decoded = round_trip(record)
+    assert type(decoded) is DabRecord
+    assert decoded.brush == brush
+    assert decoded.mode == DrawMode.CURVE
+    assert decoded.points == record.points
+    check_truncations(record)
+
+
+@pytest.mark.parametrize("record", [EraseRecord(-10, 20, 300, 400), MoveRecord(5, 6, 70, 80, -9, 10)])
+def test_selection_record_round_trip(record):
+    decoded = round_trip(record)
+    assert type(decoded) is type(record)
+    assert decoded == record
+    check_truncations(record)
+
+
+def test_paste_record_round_trip(app):
+    source = TiledImage(400, 300, Qt.transparent)
+    painter = QPainter(source.writable_tile((1, 0)))
+    painter.fillRect(0, 0, 40, 40, QColor(255, 0, 0, 128))
+    painter.end()
+    record = PasteRecord(-5, 7, source.view(QRect(240, 10, 60, 50)), QRect(240, 10, 60, 50))
+    decoded = round_trip(record)
+    assert (decoded.x, decoded.y) == (-5, 7)
+    assert decoded.rect.size() == record.rect.size()
+    assert decoded.image() == record.image()
+
+
+@pytest.mark.parametrize("data", [
+    PASTE_RECORD.pack(RECORD_PASTE, 0, 0, 2, 2, 4) + b"junk",
+    PASTE_RECORD.pack(RECORD_PASTE, 0, 0, 2, 2, len(zlib.compress(bytes(12)))) + zlib.compress(bytes(12)),
+    PASTE_RECORD.pack(RECORD_PASTE, 0, 0, 0, 2, 0),
+])
+def test_invalid_pastes_are_rejected(data):
+    with pytest.raises(ValueError):
+        decode_record(data, 0)
@@ -0,0 +1,23 @@
+from paint import StrokeLog, render_file, render_main
+import paint
+import pytest
+
+
+# function that fails like an unexpected error of a replay
+def failing_rasterize(self, scale=1.0):
+    raise RuntimeError("replay failed")
+
+
+def test_render_reports_unexpected_errors(app, tmp_path, monkeypatch):
+    input_path = str(tmp_path / "sheet.strokes")
+    StrokeLog(100, 100).save(input_path)
+    monkeypatch.setattr(paint.StrokeLog, "rasterize", failing_rasterize)
+    assert render_file((input_path, str(tmp_path / "sheet.png"), 1.0)) == (input_path, "RuntimeError: replay failed")
+
+
+@pytest.mark.parametrize("arguments", [["-j", "0"], ["-j", "-2"], ["-s", "0"], ["-s", "-1"], ["-s", "nan"],
+                                       ["-s", "inf"], ["a/sheet.strokes", "b/sheet.png"]])
+def test_render_rejects_invalid_arguments(tmp_path, arguments):
+    with pytest.raises(SystemExit):
+        render_main(["-o", str(tmp_path / "out"), "sheet.strokes"] + arguments)
+    assert not (tmp_path / "out").exists()
@@ -0,0 +1,39 @@
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QColor, QImage, QPainter, QPainterPath
+from paint import BrushSpec, StrokeSession, TiledImage
+import pytest
+
+
+# function that returns a zigzag path whose sharp joins point at the borders of the tiles
+def zigzag(points):
+    path = QPainterPath(QPointF(*points[0]))
+    for point in points[1:]:
+        path.lineTo(*point)
+    return path
+
+
+@pytest.mark.parametrize("cap_type, join_type", [(Qt.FlatCap, Qt.MiterJoin), (Qt.SquareCap, Qt.MiterJoin),
+                                                 (Qt.RoundCap, Qt.BevelJoin), (Qt.SquareCap, Qt.RoundJoin)])
+@pytest.mark.parametrize("size", [5, 25])
+def test_tiled_stroke_matches_a_single_image(app, size, cap_type, join_type):
+    brush = BrushSpec(size, QColor(0, 0, 0).rgba(), Qt.SolidLine, cap_type, join_type)
+    path = zigzag([(180, 60), (230, 240), (280, 60), (330, 240), (380, 60), (240, 280), (480, 262), (250, 500)])
+    reference = QImage(600, 600, QImage.Format_RGB32)
+    reference.fill(Qt.white)
+    painter = QPainter(reference)
+    painter.setPen(brush.pen())
+    painter.drawPath(path)
+    painter.end()
+
+    canvas = TiledImage(600, 600)
+    session = StrokeSession(canvas, brush)
+    rect = session.draw_path(path)
+    session.end()
+    image = canvas.to_image()
+    assert image == reference
+    blank = QImage(600, 600, QImage.Format_RGB32)
+    blank.fill(Qt.white)
+    painter = QPainter(blank)
+    painter.drawImage(rect, image, rect)
+    painter.end()
+    assert blank == reference